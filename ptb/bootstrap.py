@@ -0,0 +1,73 @@
+"""
+One-time, lazy setup shared by every invocation a Lambda container serves.
+
+The Application is built on first use, handlers are registered and the bot initialized once, and the
+timings of those steps are kept in METRICS so cold starts can be told apart from warm ones in the logs.
+"""
+import asyncio
+import json
+import os
+import time
+
+PROCESS_STARTED_AT = time.perf_counter()
+METRICS = {"cold_start": True}
+
+_application = None
+_registered = False
+_ready = False
+_ready_lock = None
+
+
+def record(name, started_at):
+    METRICS[name] = round((time.perf_counter() - started_at) * 1000, 3)
+
+
+def get_application():
+    global _application
+    if _application is None:
+        from telegram.ext import ApplicationBuilder
+
+        import persistence
+
+        started_at = time.perf_counter()
+        builder = ApplicationBuilder().token(os.getenv("TELEGRAM_TOKEN")) \
+            .connection_pool_size(int(os.getenv("SEND_CONCURRENCY", "8"))).pool_timeout(30) \
+            .persistence(persistence.default_persistence())
+        if os.getenv("TELEGRAM_API_URL"):
+            # A local Bot API server, or the stand-in of the load test.
+            builder = builder.base_url(f"{os.getenv('TELEGRAM_API_URL')}/bot") \
+                .base_file_url(f"{os.getenv('TELEGRAM_API_URL')}/file/bot")
+        _application = builder.build()
+        record("application_build_ms", started_at)
+    return _application
+
+
+async def ensure_ready(register_handlers, commands=()):
+    """
+    Return the initialized Application. On the first call in a container the handlers are registered,
+    the bot initialized and the command list published, later calls return right away. When initializing
+    fails the next call tries again, without registering the handlers a second time.
+    """
+    global _registered, _ready, _ready_lock
+    if _ready:
+        METRICS["cold_start"] = False
+        return _application
+    if _ready_lock is None:
+        _ready_lock = asyncio.Lock()
+    async with _ready_lock:
+        if not _ready:
+            application = get_application()
+            if not _registered:
+                started_at = time.perf_counter()
+                register_handlers(application)
+                _registered = True
+                record("register_handlers_ms", started_at)
+            started_at = time.perf_counter()
+            await application.initialize()
+            if commands:
+                await application.bot.set_my_commands(list(commands))
+            record("initialize_ms", started_at)
+            record("cold_start_ms", PROCESS_STARTED_AT)
+            print(json.dumps({"bootstrap": METRICS}))
+            _ready = True
+    return _application
@@ -0,0 +1,279 @@
+"""
+Bot state kept outside the Lambda container.
+
+KeyValuePersistence stores user data, chat data, bot data and conversation states as JSON values in a
+key-value store, so a conversation continues on whichever container the next message reaches.
+
+Reads go through a per-update cache: prefetch() loads the keys of the update's chat and user in one
+batch before the update is processed. Writes are batched: they are collected until flush(), which the
+webhook handler calls once the update (or a batch of updates) has been processed, and which also empties
+the cache.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+
+from telegram import Update
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+
+BOT_DATA_KEY = "bot"
+
+
+class InMemoryKeyValueStore:
+    def __init__(self):
+        self.values = {}
+
+    def get_many(self, keys):
+        return {key: self.values[key] for key in keys if key in self.values}
+
+    def write_many(self, values):
+        for key, value in values.items():
+            if value is None:
+                self.values.pop(key, None)
+            else:
+                self.values[key] = value
+
+
+class SQLiteKeyValueStore:
+    """Local stand-in for the DynamoDB store, for running the bot outside of Lambda."""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS bot_state (key TEXT PRIMARY KEY, value TEXT)")
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT key, value FROM bot_state WHERE key IN ({', '.join('?' * len(keys))})", keys).fetchall()
+        return dict(rows)
+
+    def write_many(self, values):
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)",
+                                        [(key, value) for key, value in values.items() if value is not None])
+            self.connection.executemany("DELETE FROM bot_state WHERE key = ?",
+                                        [(key,) for key, value in values.items() if value is None])
+
+
+class DynamoDBKeyValueStore:
+    BATCH_GET_LIMIT = 100
+
+    def __init__(self, table_name="bot_state"):
+        import boto3
+
+        self.table_name = table_name
+        self.dynamodb = boto3.client('dynamodb')
+        try:
+            self.dynamodb.describe_table(TableName=self.table_name)
+        except self.dynamodb.exceptions.ResourceNotFoundException:
+            self.dynamodb.create_table(
+                TableName=self.table_name,
+                KeySchema=[{'AttributeName': 'state_key', 'KeyType': 'HASH'}],
+                AttributeDefinitions=[{'AttributeName': 'state_key', 'AttributeType': 'S'}],
+                ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}
+            )
+            boto3.resource('dynamodb').Table(self.table_name).wait_until_exists()
+        self.resource = boto3.resource('dynamodb')
+        self.table = self.resource.Table(self.table_name)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        values = {}
+        for start in range(0, len(keys), self.BATCH_GET_LIMIT):
+            request = {self.table_name: {'Keys': [{'state_key': key} for key in keys[start:start + self.BATCH_GET_LIMIT]],
+                                         'ConsistentRead': True}}
+            while request:
+                response = self.resource.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(self.table_name, []):
+                    values[item['state_key']] = item['value']
+                request = response.get('UnprocessedKeys')
+        return values
+
+    def write_many(self, values):
+        with self.table.batch_writer(overwrite_by_pkeys=['state_key']) as batch:
+            for key, value in values.items():
+                if value is None:
+                    batch.delete_item(Key={'state_key': key})
+                else:
+                    batch.put_item(Item={'state_key': key, 'value': value})
+
+
+class KeyValuePersistence(BasePersistence):
+    def __init__(self, store, update_interval=60):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self.store = store
+        self.cache = {}
+        self.dirty = {}
+        self.conversation_handlers = {}
+        self.bot_data_json = None
+
+    @staticmethod
+    def user_key(user_id):
+        return f"user:{user_id}"
+
+    @staticmethod
+    def chat_key(chat_id):
+        return f"chat:{chat_id}"
+
+    @staticmethod
+    def conversation_key(name, key):
+        return f"conversation:{name}:" + ":".join(str(part) for part in key)
+
+    def _get(self, key):
+        return self.cache.get(key)
+
+    def _set(self, key, value):
+        self.cache[key] = value
+        self.dirty[key] = value
+
+    def register_conversation(self, handler):
+        self.conversation_handlers[handler.name] = handler
+
+    def update_keys(self, update):
+        keys = []
+        if update.effective_user:
+            keys.append(self.user_key(update.effective_user.id))
+        if update.effective_chat:
+            keys.append(self.chat_key(update.effective_chat.id))
+        for name, handler in self.conversation_handlers.items():
+            key = handler.conversation_key(update)
+            if key is not None:
+                keys.append(self.conversation_key(name, key))
+        return keys
+
+    async def prefetch(self, updates):
+        """Load the stored state of the chats and users of the given updates in one batch read."""
+        if isinstance(updates, Update):
+            updates = [updates]
+        keys = {key for update in updates for key in self.update_keys(update) if key not in self.dirty}
+        if not keys:
+            return
+        values = await asyncio.get_running_loop().run_in_executor(None, self.store.get_many, keys)
+        for key in keys:
+            self.cache[key] = json.loads(values[key]) if key in values else None
+
+    async def flush(self):
+        # The cache only lives until the updates it was prefetched for are written: a warm container
+        # serves many chats, and the next update of each one prefetches its state again anyway.
+        try:
+            if not self.dirty:
+                return
+            dirty, self.dirty = self.dirty, {}
+            values = {key: None if value is None else json.dumps(value, ensure_ascii=False)
+                      for key, value in dirty.items()}
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.store.write_many, values)
+            except Exception:
+                self.dirty = {**dirty, **self.dirty}
+                raise
+        finally:
+            # Writes that failed stay cached, the store doesn't have them yet.
+            self.cache = dict(self.dirty)
+
+    # Everything is loaded per update by prefetch(), so nothing is loaded up front.
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        values = await asyncio.get_running_loop().run_in_executor(None, self.store.get_many, [BOT_DATA_KEY])
+        self.bot_data_json = values.get(BOT_DATA_KEY)
+        return json.loads(self.bot_data_json) if self.bot_data_json is not None else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        self._set(self.conversation_key(name, key), new_state)
+
+    async def update_user_data(self, user_id, data):
+        self._set(self.user_key(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._set(self.chat_key(chat_id), data)
+
+    async def update_bot_data(self, data):
+        # Called after every update, bot data is only written when it changed.
+        data_json = json.dumps(data, ensure_ascii=False)
+        if data_json != self.bot_data_json:
+            self.bot_data_json = data_json
+            self._set(BOT_DATA_KEY, data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._set(self.user_key(user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._set(self.chat_key(chat_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        key = self.user_key(user_id)
+        if key in self.cache:
+            user_data.clear()
+            user_data.update(self._get(key) or {})
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        key = self.chat_key(chat_id)
+        if key in self.cache:
+            chat_data.clear()
+            chat_data.update(self._get(key) or {})
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+
+class PersistentConversationHandler(ConversationHandler):
+    """
+    A ConversationHandler that takes the state of each conversation from the persistence cache instead of
+    the states loaded once at startup, which would be stale as soon as another container moved on.
+    """
+
+    def __init__(self, persistence, *args, **kwargs):
+        super().__init__(*args, persistent=True, **kwargs)
+        self.state_persistence = persistence
+        persistence.register_conversation(self)
+
+    def conversation_key(self, update):
+        if not isinstance(update, Update) or update.channel_post or update.edited_channel_post:
+            return None
+        if self.per_chat and not update.effective_chat or self.per_user and not update.effective_user:
+            return None
+        if self.per_message and not update.callback_query:
+            return None
+        return self._get_key(update)
+
+    def check_update(self, update):
+        key = self.conversation_key(update)
+        if key is not None:
+            stored_key = self.state_persistence.conversation_key(self.name, key)
+            if stored_key in self.state_persistence.cache:
+                state = self.state_persistence.cache[stored_key]
+                if state is None:
+                    self._conversations.data.pop(key, None)
+                else:
+                    self._conversations.update_no_track({key: state})
+        return super().check_update(update)
+
+
+def default_persistence():
+    if os.getenv("STATE_DB"):
+        store = SQLiteKeyValueStore(os.getenv("STATE_DB"))
+    elif os.getenv("STATE_TABLE") or os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+        store = DynamoDBKeyValueStore(os.getenv("STATE_TABLE", "bot_state"))
+    else:
+        store = InMemoryKeyValueStore()
+    return KeyValuePersistence(store)
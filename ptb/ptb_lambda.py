@@ -1,18 +1,65 @@
-import json
 import asyncio
-from pathlib import Path
+import contextlib
 
-from telegram import Update, BotCommand, ReplyKeyboardMarkup
-from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters, ConversationHandler, \
+import bootstrap
+import persistence
+import webhook
+from telegram import Update, BotCommand, ReplyKeyboardMarkup, InputMediaDocument
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters, ConversationHandler, \
     CallbackQueryHandler
-import os
-import templater.templater
 import templater.exceptions
-import template_manager
-import schedule_send_templates
+import templater.instrumentation
 
+# boto3, lxml and ply are imported by the handlers that need them, so a webhook that only answers
+# /start never pays for them.
+SHARD_EVENT_SOURCE = "templater.shard"
+# The scheduled send: ticks send what is due (send_schedule). The weekly rule (aws.events) only sends the
+# templates saved before the ticks that weren't backfilled yet.
+TICK_EVENT_SOURCE = "templater.tick"
 LOCATION, SENDING_TEMPLATE, DONE, CHOOSING = range(4)
-application = ApplicationBuilder().token(os.getenv("TELEGRAM_TOKEN")).build()
+COMMANDS = [BotCommand("start", "התחל")]
+INSTRUCTIONS_PATH = "הוראות שימוש בטמפלייטר.docx"
+# Up to this many cities the documents are sent as one album, above it as a single zip.
+MEDIA_GROUP_LIMIT = 10
+asset_locks = {}
+
+
+@contextlib.asynccontextmanager
+async def asset_lock(path):
+    entry = asset_locks.setdefault(path, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del asset_locks[path]
+
+
+async def reply_asset(update: Update, context: ContextTypes.DEFAULT_TYPE, path):
+    """
+    Reply with a file shipped with the bot, uploading it once and sending the file_id Telegram returned
+    after that. The file_ids are kept in the bot data, so every container shares them.
+    """
+    file_ids = context.bot_data.setdefault("file_ids", {})
+    file_id = file_ids.get(path)
+    if file_id is not None:
+        try:
+            return await update.message.reply_document(document=file_id)
+        except BadRequest:
+            if file_ids.get(path) == file_id:
+                del file_ids[path]
+    # Only the upload is locked, so concurrent replies upload the file once.
+    async with asset_lock(path):
+        file_id = file_ids.get(path)
+        if file_id is None:
+            with open(path, "rb") as f:
+                message = await update.message.reply_document(document=f)
+            file_ids[path] = message.document.file_id
+            return message
+    return await update.message.reply_document(document=file_id)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -23,81 +70,164 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                                                         "\r\n"
                                                                         "מוזמן לעיין בהוראות השימוש")
 
-    await update.message.reply_document(document=open("הוראות שימוש בטמפלייטר.docx", "rb"))
+    await reply_asset(update, context, INSTRUCTIONS_PATH)
     await context.bot.send_message(chat_id=update.effective_chat.id,
                                    text="https://youtu.be/kro65ztPqKQ?si=2Y-VfLmjpxT0wlY0")
 
 
 async def template_fill(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    uploaded_file = await update.message.document.get_file()
-    template_path = await uploaded_file.download_to_drive(custom_path=Path("/tmp") / Path(uploaded_file.file_path).name)
-    context.user_data["template_path"] = template_path
-    if not template_path.name.endswith(".docx") and not template_path.name.endswith(".pptx"):
+    document = update.message.document
+    file_name = document.file_name or ""
+    if not file_name.endswith(".docx") and not file_name.endswith(".pptx"):
         await update.message.reply_text("קובץ לא נתמך, שלח קובץ Word(docx) או PowerPoint(pptx) ")
         return ConversationHandler.END
+    # Only the file_id is kept, the file is downloaded by whichever container fills it.
+    context.user_data["template"] = {"file_id": document.file_id, "file_unique_id": document.file_unique_id,
+                                     "file_name": file_name}
     await update.message.reply_text("מעולה :) שלח בבקשה את שם העיר עבורה תרצה את הלו״ז.\r\n"
                                     "שים לב שהזמנים נלקחים מאתר ישיבה!")
     return LOCATION
 
 
+async def download_template(context: ContextTypes.DEFAULT_TYPE):
+    """The conversation's template as a workspace entry, downloaded once however many updates use it."""
+    import workspace
+
+    template = context.user_data["template"]
+    with templater.instrumentation.span("telegram_download"):
+        return await workspace.get_workspace().download(context.bot, template["file_id"],
+                                                        template["file_unique_id"], template["file_name"])
+
+
+async def reply_documents(update: Update, documents):
+    """Reply with in-memory documents, counted in the workspace until they are sent."""
+    import workspace
+
+    with contextlib.ExitStack() as stack:
+        entries = [stack.enter_context(workspace.get_workspace().temporary(name, data)) for name, data in documents]
+        with templater.instrumentation.span("telegram_send"):
+            if len(entries) == 1:
+                await update.message.reply_document(document=entries[0].open(), filename=entries[0].name)
+            else:
+                await update.message.reply_media_group(media=[InputMediaDocument(entry.open(), filename=entry.name)
+                                                              for entry in entries])
+
+
+async def send_cities(update: Update, context: ContextTypes.DEFAULT_TYPE, cities):
+    """Fill the template for every city, parsing it once, and reply with the documents. Returns the cities."""
+    import services
+    import templater.cities
+    import workspace
+
+    cities = list(dict.fromkeys(templater.cities.get_index().place_id(city)[0] for city in cities))
+    templater.instrumentation.log("filling template", cities=cities)
+    with workspace.get_workspace().hold(await download_template(context)) as template:
+        documents = await services.fill_cities(cities, template, as_zip=len(cities) > MEDIA_GROUP_LIMIT)
+    await reply_documents(update, documents)
+    return cities
+
+
 async def location(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    import services
+    import templater.cities
+    import templater.templater
+    import workspace
+
+    cities = [city.strip() for city in update.message.text.split(",") if city.strip()]
     try:
-        city = update.message.text
-        print(f"Trying to get data from city: {city}")
-        context.user_data["city"] = city
-        try:
-            filled_path = templater.templater.fill_template(city,
-                                                            context.user_data["template_path"],
-                                                                 "/tmp",
-                                                                                )
-        except templater.templater.UnsupportedFileType as e:
-            await update.message.reply_text("קובץ לא נתמך: " + str(e))
-            return LOCATION
-        await update.message.reply_document(document=open(filled_path, "rb"))
+        if len(cities) > 1:
+            try:
+                context.user_data["cities"] = await send_cities(update, context, cities)
+            except templater.templater.UnsupportedFileType as e:
+                await update.message.reply_text("קובץ לא נתמך: " + str(e))
+                return LOCATION
+        else:
+            # Stored by its canonical name, like the cities of a list, so the city index finds every subscription.
+            city = templater.cities.get_index().place_id(update.message.text.strip())[0]
+            templater.instrumentation.log("filling template", city=city)
+            context.user_data["city"] = city
+            context.user_data.pop("cities", None)
+            try:
+                with workspace.get_workspace().hold(await download_template(context)) as template:
+                    document = await services.fill_document(city, template)
+            except templater.templater.UnsupportedFileType as e:
+                await update.message.reply_text("קובץ לא נתמך: " + str(e))
+                return LOCATION
+            await reply_documents(update, [document])
         keyboard = [['כן', 'לא']]
         reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
         await update.message.reply_text("האם תרצה לקבל את הלו״ז בכל יום שישי באופן אוטומטי?",
                                         reply_markup=reply_markup)
         return CHOOSING
-    except templater.exceptions.NoSuchCity:
-        await update.message.reply_text("עיר לא קיימת במאגר! בחר עיר אחרת")
+    except templater.exceptions.NoSuchCity as e:
+        if len(cities) > 1:
+            # A suggestion keyboard would replace the whole list, so the suggestions are only named.
+            text = f"העיר {e.city} לא קיימת במאגר!"
+            if e.suggestions:
+                text += " אולי התכוונת ל: " + ", ".join(e.suggestions)
+            await update.message.reply_text(text)
+            return LOCATION
+        if not e.suggestions:
+            await update.message.reply_text("עיר לא קיימת במאגר! בחר עיר אחרת")
+            return LOCATION
+        keyboard = [[suggestion] for suggestion in e.suggestions]
+        reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
+        await update.message.reply_text("עיר לא קיימת במאגר! אולי התכוונת ל:", reply_markup=reply_markup)
         return LOCATION
 
 async def choosing(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_choice = update.message.text.lower()
     if user_choice == "לא":
         return DONE
-    print("Saving template...")
-    manager = template_manager.TemplateManager()
-    manager.save(context.user_data["template_path"], context.user_data["city"], update.effective_chat.id)
+    import services
+    import template_manager
+    import workspace
+
+    templater.instrumentation.log("saving template")
+    manager = await services.run_io(template_manager.get_manager)
+    with workspace.get_workspace().hold(await download_template(context)) as template, \
+            templater.instrumentation.span("s3_save"):
+        # A subscription per city, all of them sharing the stored template.
+        for city in context.user_data.get("cities") or [context.user_data["city"]]:
+            await services.save_template(manager, template, city, update.effective_chat.id)
     return DONE
 
 
 async def done(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data.clear()
-    print(f'{"*"*10} Done {"*"*10}')
+    templater.instrumentation.log("done")
     return ConversationHandler.END
 
 async def button(update, context):
+    import services
+    import template_manager
+
     query = update.callback_query
     template_path = query.data
-    schedule_send_templates.MANAGER.delete(template_path)
+    await services.delete_template(await services.run_io(template_manager.get_manager), template_path)
     await query.answer(text="בוצע, מוזמן להעלות טמפלייט חדש.")
 
 
 def lambda_handler(event, context):
-    print(f"event: {event}")
-    if 'source' in event and event['source'] == 'aws.events':
-        return asyncio.get_event_loop().run_until_complete(schedule_send_templates.send_all_templates())
+    templater.instrumentation.log("event", source=event.get("source"))
+    if event.get('source') == TICK_EVENT_SOURCE:
+        import send_schedule
+
+        return asyncio.get_event_loop().run_until_complete(send_schedule.main(event, context))
+    if 'source' in event and event['source'] in ('aws.events', SHARD_EVENT_SOURCE):
+        import sharded_send
+
+        return asyncio.get_event_loop().run_until_complete(sharded_send.main(event, context))
     else:
         return asyncio.get_event_loop().run_until_complete(main(event, context))
 
 
-async def main(event, context):
+def register_handlers(application):
     start_handler = CommandHandler('start', start)
     application.add_handler(start_handler)
-    await application.bot.set_my_commands([BotCommand("start","התחל")])
-    conv_handler = ConversationHandler(
+    conv_handler = persistence.PersistentConversationHandler(
+        application.persistence,
+        name="template_fill",
         entry_points=[MessageHandler(filters.Document.ALL, template_fill)],
         states={
             LOCATION: [
@@ -118,23 +248,45 @@ async def main(event, context):
     application.add_handler(CallbackQueryHandler(button))
     template_handler = MessageHandler(filters.Document.ALL, template_fill)
     application.add_handler(template_handler)
+    webhook.add_error_handler(application)
+
 
+async def main(event, context):
+    """Process the update, or batch of updates, of a webhook or SQS event."""
+    batch = "Records" in event
     try:
-        await application.initialize()
-        await application.process_update(
-            Update.de_json(json.loads(event["body"]), application.bot)
-        )
+        application = await bootstrap.ensure_ready(register_handlers, COMMANDS)
+        updates = [(record_id, Update.de_json(update, application.bot))
+                   for record_id, update in webhook.updates_from_event(event)]
+        with templater.instrumentation.operation("update", cold_start=bootstrap.METRICS["cold_start"],
+                                                 profile=event.get("profile", False)):
+            with templater.instrumentation.span("state_load"):
+                await application.persistence.prefetch([update for _, update in updates])
+            failed = await webhook.dispatch(application, updates)
+            with templater.instrumentation.span("state_save"):
+                await application.update_persistence()
+                await application.persistence.flush()
 
+        if batch:
+            return {"batchItemFailures": [{"itemIdentifier": record_id} for record_id in failed]}
+        if failed:
+            templater.instrumentation.log("updates dropped", failed=len(failed), updates=len(updates))
         return {
             'statusCode': 200,
-            'body': 'Success'
+            'body': 'Failure' if failed else 'Success'
         }
 
     except Exception as exc:
+        templater.instrumentation.log("update failed", error=repr(exc))
+        if batch:
+            # Nothing was stored, let SQS deliver the whole batch again.
+            raise
+        # Telegram delivers a webhook update again until it is answered with a 200, holding up the chat's
+        # later updates behind one that may fail every time. Only SQS batches are retried.
         return {
-            'statusCode': 500,
+            'statusCode': 200,
             'body': 'Failure'
         }
 
 
-
+bootstrap.record("import_ms", bootstrap.PROCESS_STARTED_AT)
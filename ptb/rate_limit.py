@@ -0,0 +1,45 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated_at = clock()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        async with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class SendLimiter:
+    """
+    Telegram allows about 30 messages per second overall and about one per second in a single chat,
+    a send waits for both buckets.
+    """
+
+    def __init__(self, global_rate=25, chat_rate=1, clock=time.monotonic):
+        self.global_bucket = TokenBucket(global_rate, clock=clock)
+        self.chat_rate = chat_rate
+        self.clock = clock
+        self.chat_buckets = {}
+
+    async def acquire(self, chat_id):
+        chat_bucket = self.chat_buckets.get(chat_id)
+        if chat_bucket is None:
+            chat_bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, clock=self.clock)
+        await chat_bucket.acquire()
+        await self.global_bucket.acquire()
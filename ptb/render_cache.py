@@ -0,0 +1,221 @@
+"""
+Cache of rendered documents, shared by every subscription that renders the same template for the same city.
+
+Entries are addressed by the hash of the template bytes, the city and a digest of the replacements the
+document was rendered with, so a new week (or corrected times) is a new entry and nothing needs to be
+invalidated. Next to the document the cache keeps the Telegram file_id of its first upload, so repeats are
+sent by id without uploading the bytes again.
+"""
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import templater.plan
+
+RENDER_CACHE_TTL = 8 * 24 * 60 * 60
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+FILE_ID_SUFFIX = ".file_id"
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def replacements_version(names):
+    """Digest of the replacement set, together with the plan version that renders it."""
+    data = json.dumps({"plan": templater.plan.PLAN_VERSION, "names": names}, sort_keys=True, ensure_ascii=False,
+                      default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def cache_key(template_digest, city, names):
+    data = json.dumps([template_digest, city, replacements_version(names)], ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class DiskRenderCache:
+    """Documents under a local directory, evicted least recently used first once max_bytes is exceeded."""
+
+    def __init__(self, directory, max_bytes=RENDER_CACHE_MAX_BYTES, ttl=RENDER_CACHE_TTL, clock=time.time):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _read(self, path):
+        try:
+            if os.path.getmtime(path) + self.ttl <= self.clock():
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        now = self.clock()
+        os.utime(path, (now, now))
+        return data
+
+    def _write(self, path, data):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        now = self.clock()
+        os.utime(path, (now, now))
+
+    def get(self, key):
+        return self._read(self._path(key))
+
+    def put(self, key, data):
+        self._write(self._path(key), data)
+        self.evict()
+
+    def get_file_id(self, key):
+        file_id = self._read(self._path(key) + FILE_ID_SUFFIX)
+        return file_id.decode("utf-8") if file_id is not None else None
+
+    def set_file_id(self, key, file_id):
+        self._write(self._path(key) + FILE_ID_SUFFIX, file_id.encode("utf-8"))
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        now = self.clock()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes and mtime + self.ttl > now:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class S3RenderCache:
+    """
+    Documents in S3, shared by all containers. Expired entries are ignored and deleted when read, a
+    lifecycle rule on the prefix removes the ones nobody reads again.
+    """
+
+    def __init__(self, s3, bucket_name, prefix="render-cache/", ttl=RENDER_CACHE_TTL, clock=time.time):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.ttl = ttl
+        self.clock = clock
+
+    def _read(self, key):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket_name, Key=self.prefix + key)
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        if response["LastModified"].timestamp() + self.ttl <= self.clock():
+            self.s3.delete_object(Bucket=self.bucket_name, Key=self.prefix + key)
+            return None
+        return response["Body"].read()
+
+    def get(self, key):
+        return self._read(key)
+
+    def put(self, key, data):
+        self.s3.put_object(Bucket=self.bucket_name, Key=self.prefix + key, Body=data)
+
+    def get_file_id(self, key):
+        file_id = self._read(key + FILE_ID_SUFFIX)
+        return file_id.decode("utf-8") if file_id is not None else None
+
+    def set_file_id(self, key, file_id):
+        self.s3.put_object(Bucket=self.bucket_name, Key=self.prefix + key + FILE_ID_SUFFIX,
+                           Body=file_id.encode("utf-8"))
+
+
+class RenderCache:
+    """
+    A local cache in front of an optional shared one. lock(key) lets concurrent sends of the same entry
+    wait for the first one, which renders and uploads, instead of each doing the work. A key's lock is
+    dropped once nobody holds or waits for it.
+    """
+
+    def __init__(self, local, remote=None):
+        self.local = local
+        self.remote = remote
+        # key -> [lock, number of holders and waiters]
+        self.locks = {}
+
+    @contextlib.asynccontextmanager
+    async def lock(self, key):
+        entry = self.locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[key]
+
+    def get(self, key):
+        data = self.local.get(key)
+        if data is None and self.remote is not None:
+            data = self.remote.get(key)
+            if data is not None:
+                self.local.put(key, data)
+        return data
+
+    def put(self, key, data):
+        self.local.put(key, data)
+        if self.remote is not None:
+            self.remote.put(key, data)
+
+    def get_file_id(self, key):
+        file_id = self.local.get_file_id(key)
+        if file_id is None and self.remote is not None:
+            file_id = self.remote.get_file_id(key)
+            if file_id is not None:
+                self.local.set_file_id(key, file_id)
+        return file_id
+
+    def set_file_id(self, key, file_id):
+        self.local.set_file_id(key, file_id)
+        if self.remote is not None:
+            self.remote.set_file_id(key, file_id)
+
+
+def default_cache(s3=None, bucket_name=None):
+    local = DiskRenderCache(os.getenv("RENDER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "render_cache")))
+    remote = S3RenderCache(s3, bucket_name) if s3 is not None else None
+    return RenderCache(local, remote)
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        import template_manager
+
+        manager = template_manager.get_manager()
+        _cache = default_cache(manager.s3, manager.bucket_name)
+    return _cache
+
+
+def set_cache(cache):
+    global _cache
+    _cache = cache
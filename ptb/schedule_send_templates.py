@@ -1,49 +1,155 @@
 import asyncio
+import collections
+import concurrent.futures
+import io
 import json
 import os
 
-from telegram.ext import ApplicationBuilder, CallbackQueryHandler
+from telegram.error import BadRequest, RetryAfter
 
+import bootstrap
+import rate_limit
+import render_cache
+import services
 import template_manager
+import templater.instrumentation
 import templater.templater
-import tempfile
 from pathlib import Path
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-
-application = ApplicationBuilder().token(os.getenv("TELEGRAM_TOKEN")).build()
-MANAGER = template_manager.TemplateManager()
-
-async def send_template(template_path, city, chat_id):
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        chat_id = str(chat_id)
-        downloaded_template_path = tmpdirname + "/" + Path(template_path).name
-        MANAGER.s3.download_file(MANAGER.bucket_name, template_path, downloaded_template_path)
-        filled_path = templater.templater.fill_template(city, downloaded_template_path, tmpdirname)
-        keyboard = [
-            [
-                InlineKeyboardButton("הפסק עדכונים עבור לו״ז זה", callback_data=template_path)
-            ]
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "8"))
+SEND_ATTEMPTS = 3
+# Lambda has no /dev/shm, so process pools only work on the self-hosted runner.
+FILL_EXECUTOR = os.getenv("FILL_EXECUTOR", "thread")
+
+
+SendResult = collections.namedtuple("SendResult", ["template_path", "chat_id", "ok", "error"])
+
+
+def create_fill_executor():
+    if FILL_EXECUTOR == "process":
+        return concurrent.futures.ProcessPoolExecutor()
+    return concurrent.futures.ThreadPoolExecutor(max_workers=SEND_CONCURRENCY)
+
+
+def render_plan(plan, names, source):
+    target = io.BytesIO()
+    plan.render(names, source, target)
+    return target.getvalue()
+
+
+async def run_stage(name, executor, function, *args):
+    """
+    Run a blocking step, timed as the named stage of the current operation: on the given executor, or on
+    the shared I/O pool when it is None.
+    """
+    with templater.instrumentation.span(name):
+        if executor is None:
+            return await services.run_io(function, *args)
+        return await services.run_in(executor, function, *args)
+
+
+async def send_document(chat_id, document, reply_markup, limiter=None, filename=None):
+    """Send a document given as bytes or as the file_id of an earlier upload."""
+    for attempt in range(SEND_ATTEMPTS):
+        if limiter is not None:
+            with templater.instrumentation.span("rate_limit_wait"):
+                await limiter.acquire(chat_id)
+        try:
+            with templater.instrumentation.span("telegram_send"):
+                return await bootstrap.get_application().bot.send_document(chat_id=chat_id, document=document,
+                                                                           filename=filename,
+                                                                           reply_markup=reply_markup)
+        except RetryAfter as e:
+            if attempt == SEND_ATTEMPTS - 1:
+                raise
+            templater.instrumentation.count("telegram_retry_after")
+            await asyncio.sleep(e.retry_after)
+
+
+async def send_template(template_path, city, chat_id, executor=None, limiter=None, cache=None, blob_key=None):
+    manager = template_manager.get_manager()
+    cache = cache or render_cache.get_cache()
+    keyboard = [
+        [
+            InlineKeyboardButton("הפסק עדכונים עבור לו״ז זה", callback_data=template_path)
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await application.bot.send_document(chat_id=chat_id, document=open(filled_path, "rb"), reply_markup=reply_markup)
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    chat_id = str(chat_id)
+    blob_key = blob_key or template_path
+    template = await run_stage("s3_download", None, manager.load_template, blob_key)
+    template_digest = await run_stage("template_digest", None, manager.template_digest, blob_key, template)
+    with templater.instrumentation.span("replacements"):
+        names = await templater.templater.init_replacements_async(city)
+    key = render_cache.cache_key(template_digest, city, names)
+
+    async def upload():
+        document = await run_stage("render_cache", None, cache.get, key)
+        if document is None:
+            plan = await run_stage("plan_load", None, manager.get_plan, blob_key, template)
+            document = await run_stage("render", executor, render_plan, plan, names, io.BytesIO(template))
+            await run_stage("render_cache", None, cache.put, key, document)
+        filename = Path(templater.templater.output_path(names, "", Path(template_path).suffix[1:])).name
+        message = await send_document(chat_id, document, reply_markup, limiter, filename)
+        await run_stage("render_cache", None, cache.set_file_id, key, message.document.file_id)
+
+    # The lock is held until the entry has a file_id: the first send renders and uploads it, the sends
+    # waiting on it then go out by file_id concurrently.
+    async with cache.lock(key):
+        file_id = await run_stage("render_cache", None, cache.get_file_id, key)
+        if file_id is None:
+            return await upload()
+    try:
+        await send_document(chat_id, file_id, reply_markup, limiter)
+        templater.instrumentation.count("sent_by_file_id")
+        return
+    except BadRequest as e:
+        templater.instrumentation.log("cached file_id rejected, uploading again",
+                                      template_path=template_path, error=repr(e))
+    async with cache.lock(key):
+        await upload()
+
+
+async def send_all_templates(templates=None, concurrency=SEND_CONCURRENCY):
+    """Send every subscription, at most `concurrency` at a time, and report the outcome of each one."""
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = rate_limit.SendLimiter()
+
+    async def send(template, executor):
+        async with semaphore:
+            with templater.instrumentation.operation("send", template_path=template["template_path"]):
+                try:
+                    await send_template(template["template_path"], template["city"], template["chat_id"],
+                                        executor=executor, limiter=limiter, blob_key=template.get("blob_key"))
+                    return SendResult(template["template_path"], template["chat_id"], True, None)
+                except Exception as e:
+                    templater.instrumentation.count("send_failed")
+                    templater.instrumentation.log("failed sending", template_path=template["template_path"],
+                                                  error=repr(e))
+                    return SendResult(template["template_path"], template["chat_id"], False, repr(e))
+
+    if templates is None:
+        templates = template_manager.get_manager().list_templates()
+    with create_fill_executor() as executor:
+        return await asyncio.gather(*(send(template, executor) for template in templates))
 
-async def send_all_templates():
-    for template in MANAGER.list_templates():
-        await send_template(**template)
 
 async def button(update, context):
-    print("Hey!!")
     query = update.callback_query
     template_path = query.data
     await query.edit_message_text(text=template_path)
-    MANAGER.delete(template_path)
+    template_manager.get_manager().delete(template_path)
     await query.edit_message_text(text="בוצע")
 
 async def main(event, context):
-    await send_all_templates()
+    results = await send_all_templates()
     return {
         'statusCode': 200,
-        'body': 'Success'
+        'body': json.dumps({
+            "sent": sum(result.ok for result in results),
+            "failed": [result.template_path for result in results if not result.ok],
+        })
     }
 
 
@@ -0,0 +1,200 @@
+"""
+Sends every subscription a fixed lead before Shabbat comes in at its city, instead of all of them at once.
+
+A template carries next_send, the epoch second it is due, and send_bucket, the UTC hour that falls in. The
+next_send-index keeps a bucket ordered by next_send, so a tick (an EventBridge rule every few minutes with
+the input {"source": "templater.tick"}) queries the current hour and the CATCH_UP_BUCKETS before it for what
+is due, claims it, sends it and schedules it for the next week. Templates left further behind, when ticks
+stopped for longer than that, are found by a scan filtered on next_send. What a tick has no time for it
+leaves to the invocation of itself it starts before its deadline, and what fails to send to a later tick.
+Due times are the city's candle lighting minus SEND_LEAD_MINUTES, computed locally by templater.zmanim, so
+the sends follow the sunset across the country and the year. A template found after its city's candle
+lighting is not sent, only scheduled for the next week. The documents only carry Shabbat times, so
+holidays are not scheduled on their own.
+
+Templates saved before they had a next send are scheduled by a tick with "backfill": true. SCHEDULER_NOW,
+epoch seconds or an ISO datetime in Israel time, pins the clock for tests and replays.
+"""
+import datetime
+import json
+import os
+import time
+
+import services
+import template_manager
+import templater.cities
+import templater.exceptions
+import templater.instrumentation
+from templater import times, zmanim
+
+TICK_EVENT_SOURCE = "templater.tick"
+SEND_LEAD_MINUTES = int(os.getenv("SEND_LEAD_MINUTES", "240"))
+CATCH_UP_BUCKETS = int(os.getenv("CATCH_UP_BUCKETS", "2"))
+SEND_RETRY_MINUTES = int(os.getenv("SEND_RETRY_MINUTES", "10"))
+# A claimed template is due again after this long, in case the tick that claimed it dies before sending.
+SEND_LEASE_MINUTES = 15
+TICK_BATCH_SIZE = int(os.getenv("TICK_BATCH_SIZE", "8"))
+DEADLINE_MARGIN_MS = int(os.getenv("DEADLINE_MARGIN_MS", "1500"))
+FRIDAY = 4
+
+
+def scheduler_clock():
+    pinned = os.getenv("SCHEDULER_NOW")
+    if not pinned:
+        return time.time
+    try:
+        now = float(pinned)
+    except ValueError:
+        now = datetime.datetime.fromisoformat(pinned)
+        if now.tzinfo is None:
+            now = now.replace(tzinfo=times.ISRAEL_TZ)
+        now = now.timestamp()
+    return lambda: now
+
+
+def due_times(cities, after, lead=SEND_LEAD_MINUTES):
+    """
+    The first send time after `after` of every city, as epoch seconds: candle lighting there on a Friday,
+    minus lead minutes. None for the cities that can't be resolved.
+    """
+    index = templater.cities.get_index()
+    place_ids = []
+    for city in cities:
+        try:
+            place_ids.append(index.place_id(city)[1])
+        except templater.exceptions.NoSuchCity:
+            place_ids.append(None)
+    known = [place_id for place_id in place_ids if place_id is not None]
+    if not known:
+        return [None] * len(place_ids)
+
+    today = datetime.datetime.fromtimestamp(after, times.ISRAEL_TZ).date()
+    friday = today + datetime.timedelta(days=(FRIDAY - today.weekday()) % 7)
+    fridays = [friday, friday + datetime.timedelta(weeks=1)]
+    enter = iter(zmanim.shabbat_times(known, fridays)["enter"].astype(int).tolist())
+    due = []
+    for place_id in place_ids:
+        if place_id is None:
+            due.append(None)
+            continue
+        candidates = [datetime.datetime.combine(date, datetime.time(minutes // 60, minutes % 60), times.ISRAEL_TZ)
+                      .timestamp() - lead * 60 for date, minutes in zip(fridays, next(enter))]
+        due.append(int(next(candidate for candidate in candidates if candidate > after)))
+    return due
+
+
+def next_send(city, after=None, lead=SEND_LEAD_MINUTES):
+    return due_times([city], scheduler_clock()() if after is None else after, lead)[0]
+
+
+def schedule(manager, templates, after, lead=SEND_LEAD_MINUTES):
+    """Move every template to its city's first send time after `after`."""
+    templates = list(templates)
+    for template, due in zip(templates, due_times([template["city"] for template in templates], after, lead)):
+        if due is None:
+            templater.instrumentation.log("unknown city", template_path=template["template_path"],
+                                          city=template["city"])
+            continue
+        manager.set_next_send(template["template_path"], due)
+    return len(templates)
+
+
+def backfill(manager, now, lead=SEND_LEAD_MINUTES):
+    """Schedule the templates saved before templates had a next send."""
+    from boto3.dynamodb.conditions import Attr
+
+    return schedule(manager, manager.iter_templates(('template_path', 'city'), Attr('next_send').not_exists()),
+                    now, lead)
+
+
+def due_buckets(now):
+    return [template_manager.send_bucket(now - hours * template_manager.SEND_BUCKET_SECONDS)
+            for hours in range(CATCH_UP_BUCKETS, -1, -1)]
+
+
+def due_templates(manager, now):
+    due = [template for bucket in due_buckets(now)
+           for template in manager.templates_by_send_bucket(bucket, until=int(now))]
+    # The buckets before the catch-up ones are only queried for when ticks stopped for a while.
+    oldest_bucket = (int(now) // template_manager.SEND_BUCKET_SECONDS - CATCH_UP_BUCKETS) \
+        * template_manager.SEND_BUCKET_SECONDS
+    return due + list(manager.templates_due_before(oldest_bucket))
+
+
+def _split_missed(templates, now, lead):
+    """The templates still worth sending, before candle lighting at their city, and those missed this week."""
+    timely, missed = [], []
+    for template, candle_lighting in zip(templates, due_times([template["city"] for template in templates], now, 0)):
+        (timely if candle_lighting is not None and candle_lighting <= now + lead * 60 else missed).append(template)
+    return timely, missed
+
+
+def _claim(manager, templates, now):
+    lease = now + SEND_LEASE_MINUTES * 60
+    return [template for template in templates
+            if manager.set_next_send(template["template_path"], lease, expected=int(template["next_send"]))]
+
+
+def _reschedule(manager, templates, results, now, lead):
+    sent = [template for template, result in zip(templates, results) if result.ok]
+    failed = [template for template, result in zip(templates, results) if not result.ok]
+    retries, missed = [], []
+    # Failed sends are retried until candle lighting, after that the document is of no use until next week.
+    for template, candle_lighting in zip(failed, due_times([template["city"] for template in failed], now, 0)):
+        if candle_lighting is not None and now + SEND_RETRY_MINUTES * 60 < candle_lighting <= now + lead * 60:
+            retries.append(template)
+        else:
+            missed.append(template)
+    schedule(manager, sent + missed, now, lead)
+    for template in retries:
+        manager.set_next_send(template["template_path"], now + SEND_RETRY_MINUTES * 60)
+
+
+async def tick(manager, send, now, context=None, invoker=None, batch_size=TICK_BATCH_SIZE, lead=SEND_LEAD_MINUTES,
+               clock=time.monotonic):
+    """
+    Send the templates due at `now`, earliest first, and schedule them again. send takes a list of templates
+    and returns their SendResults in order, like schedule_send_templates.send_all_templates. Short of time,
+    the tick invokes itself through invoker to send the rest; every invocation sends at least one batch.
+    """
+    due = sorted(await services.run_io(due_templates, manager, now), key=lambda template: template["next_send"])
+    due, missed = await services.run_io(_split_missed, due, now, lead)
+    summary = {"due": len(due), "sent": 0, "failed": [], "missed": len(missed), "done": True}
+    if missed:
+        await services.run_io(schedule, manager, missed, now, lead)
+    longest_batch_ms = None
+    while due:
+        if longest_batch_ms is not None and context is not None and \
+                context.get_remaining_time_in_millis() < DEADLINE_MARGIN_MS + longest_batch_ms:
+            if invoker is not None:
+                await invoker.invoke({"source": TICK_EVENT_SOURCE})
+            summary["done"] = False
+            break
+        started_at = clock()
+        batch, due = due[:batch_size], due[batch_size:]
+        # Another tick may have claimed some of them already.
+        batch = await services.run_io(_claim, manager, batch, now)
+        if batch:
+            results = await send(batch)
+            await services.run_io(_reschedule, manager, batch, results, now, lead)
+            summary["sent"] += sum(result.ok for result in results)
+            summary["failed"] += [result.template_path for result in results if not result.ok]
+        longest_batch_ms = max(longest_batch_ms or 0, (clock() - started_at) * 1000)
+    return summary
+
+
+async def main(event, context):
+    import schedule_send_templates
+    import sharded_send
+
+    now = scheduler_clock()()
+    manager = await services.run_io(template_manager.get_manager)
+    summary = {"now": int(now)}
+    if event.get("backfill"):
+        summary["backfilled"] = await services.run_io(backfill, manager, now)
+    summary.update(await tick(manager, schedule_send_templates.send_all_templates, now, context,
+                               sharded_send.LambdaInvoker()))
+    return {
+        'statusCode': 200,
+        'body': json.dumps(summary, ensure_ascii=False)
+    }
@@ -0,0 +1,105 @@
+"""
+Async face of the blocking work the handlers do.
+
+boto3 calls run on a bounded I/O pool and rendering on a pool of its own, so neither blocks the event loop
+and a slow render can't starve the S3 and DynamoDB calls of other coroutines. Times come from the
+provider's native async fetch. Blocking steps keep the caller's instrumentation context.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import io
+import os
+
+import templater.cities
+import templater.plan
+import templater.templater
+
+IO_WORKERS = int(os.getenv("IO_WORKERS", "16"))
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+
+_io_executor = None
+_render_executor = None
+
+
+def io_executor():
+    global _io_executor
+    if _io_executor is None:
+        _io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+    return _io_executor
+
+
+def render_executor():
+    global _render_executor
+    if _render_executor is None:
+        _render_executor = concurrent.futures.ThreadPoolExecutor(max_workers=RENDER_WORKERS,
+                                                                 thread_name_prefix="render")
+    return _render_executor
+
+
+async def run_in(executor, function, *args, **kwargs):
+    call = functools.partial(contextvars.copy_context().run, function, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+
+async def run_io(function, *args, **kwargs):
+    """Run a blocking I/O call (boto3, disk) on the I/O pool."""
+    return await run_in(io_executor(), function, *args, **kwargs)
+
+
+async def run_render(function, *args, **kwargs):
+    return await run_in(render_executor(), function, *args, **kwargs)
+
+
+def _render_to_memory(office_templater, names, template):
+    office_templater.templater_parser.set_names(names)
+    document = io.BytesIO()
+    with template.open() as source:
+        office_templater.render(source, document, templater.templater.get_part_executor())
+    return document.getvalue()
+
+
+async def fill_document(city, template):
+    """
+    templater.fill_template for a workspace entry, in memory and without blocking the loop: the times are
+    awaited, the render runs on its pool. Returns the document's file name and bytes.
+    """
+    office_templater = templater.templater.get_templater(template.name)
+    names = await templater.templater.init_replacements_async(city)
+    file_name = os.path.basename(templater.templater.output_path(names, "", office_templater.file_extension()))
+    return file_name, await run_render(_render_to_memory, office_templater, names, template)
+
+
+def _render_cities(replacements, template, as_zip):
+    with template.open() as source:
+        if not as_zip:
+            return list(templater.plan.render_documents(replacements, template.name, source).values())
+        target = io.BytesIO()
+        templater.plan.render_cities_zip(replacements, template.name, target, source)
+    file_name = os.path.basename(templater.templater.output_path(next(iter(replacements.values())), "", "zip"))
+    return [(file_name, target.getvalue())]
+
+
+async def fill_cities(cities, template, as_zip=False):
+    """
+    One workspace template for many cities: the times of all of them are awaited together and the template
+    is parsed once. Returns the (file name, bytes) of every document, or of one zip of all of them.
+    """
+    cities = list(dict.fromkeys(templater.cities.get_index().place_id(city)[0] for city in cities))
+    names = await asyncio.gather(*(templater.templater.init_replacements_async(city) for city in cities))
+    return await run_render(_render_cities, dict(zip(cities, names)), template, as_zip)
+
+
+async def save_template(manager, template, city, chat_id):
+    """Subscribe chat_id to a workspace template, spilled entries are uploaded from their file."""
+    import send_schedule
+
+    next_send = await run_io(send_schedule.next_send, city)
+    if template.path is not None:
+        return await run_io(manager.save, template.path, city, chat_id, next_send=next_send)
+    return await run_io(manager.save, template.name, city, chat_id, data=template.data, next_send=next_send)
+
+
+async def delete_template(manager, template_path):
+    return await run_io(manager.delete, template_path)
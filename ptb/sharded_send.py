@@ -0,0 +1,176 @@
+"""
+Sharded, resumable fan-out of the weekly send.
+
+The scheduled event only fans out one event per shard. A shard is a segment of a parallel scan of the
+template table, so every shard reads only its own part of it. The worker sends a page of the segment at a
+time and saves a cursor (the key the scan continues after) when the page is sent. When the invocation is
+about to run out of time the worker stops and re-invokes itself, and the next invocation continues from
+the saved cursor. Every invocation sends at least one page, so a short budget can't re-invoke forever.
+Checkpoints expire through the table's TTL on expires_at.
+
+Subscriptions are sent by send_schedule's ticks, each before Shabbat comes in at its city. The fan-out only
+sends the templates that don't have a next_send yet, saved before the ticks and not backfilled, so a
+weekly rule left in place next to the tick rule never sends a subscription twice.
+"""
+import asyncio
+import json
+import os
+import time
+
+import templater.times
+
+SHARD_EVENT_SOURCE = "templater.shard"
+SEND_SHARDS = int(os.getenv("SEND_SHARDS", "4"))
+SHARD_BATCH_SIZE = int(os.getenv("SHARD_BATCH_SIZE", "8"))
+DEADLINE_MARGIN_MS = int(os.getenv("DEADLINE_MARGIN_MS", "1500"))
+CHECKPOINT_TTL = 8 * 24 * 60 * 60
+
+
+def shard_events(run_id, shards):
+    return [{"source": SHARD_EVENT_SOURCE, "run_id": run_id, "shard": shard, "shards": shards}
+            for shard in range(shards)]
+
+
+class InMemoryCheckpointStore:
+    def __init__(self):
+        self.checkpoints = {}
+
+    def get(self, run_id, shard):
+        return self.checkpoints.get((run_id, shard))
+
+    def set(self, run_id, shard, cursor, done):
+        self.checkpoints[(run_id, shard)] = {"cursor": cursor, "done": done}
+
+
+class DynamoDBCheckpointStore:
+    def __init__(self, table_name="send_checkpoint"):
+        import boto3
+
+        self.table_name = table_name
+        self.dynamodb = boto3.client('dynamodb')
+        try:
+            self.dynamodb.describe_table(TableName=self.table_name)
+        except self.dynamodb.exceptions.ResourceNotFoundException:
+            self.dynamodb.create_table(
+                TableName=self.table_name,
+                KeySchema=[{'AttributeName': 'checkpoint_id', 'KeyType': 'HASH'}],
+                AttributeDefinitions=[{'AttributeName': 'checkpoint_id', 'AttributeType': 'S'}],
+                ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}
+            )
+            boto3.resource('dynamodb').Table(self.table_name).wait_until_exists()
+        self._enable_ttl()
+        self.table = boto3.resource('dynamodb').Table(self.table_name)
+
+    def _enable_ttl(self):
+        description = self.dynamodb.describe_time_to_live(TableName=self.table_name)['TimeToLiveDescription']
+        if description['TimeToLiveStatus'] in ('DISABLED', 'DISABLING'):
+            self.dynamodb.update_time_to_live(TableName=self.table_name, TimeToLiveSpecification={
+                'Enabled': True, 'AttributeName': 'expires_at'})
+
+    def get(self, run_id, shard):
+        item = self.table.get_item(Key={'checkpoint_id': f"{run_id}#{shard}"}, ConsistentRead=True).get("Item")
+        if item is None:
+            return None
+        return {"cursor": item.get("cursor"), "done": item["done"]}
+
+    def set(self, run_id, shard, cursor, done):
+        item = {'checkpoint_id': f"{run_id}#{shard}", 'done': done, 'expires_at': int(time.time()) + CHECKPOINT_TTL}
+        if cursor is not None:
+            item['cursor'] = cursor
+        self.table.put_item(Item=item)
+
+
+class LambdaInvoker:
+    def __init__(self, function_name=None):
+        import boto3
+
+        self.function_name = function_name or os.getenv("AWS_LAMBDA_FUNCTION_NAME")
+        self.client = boto3.client('lambda')
+
+    async def invoke(self, event):
+        await asyncio.get_running_loop().run_in_executor(
+            None, lambda: self.client.invoke(FunctionName=self.function_name, InvocationType="Event",
+                                             Payload=json.dumps(event).encode("utf-8")))
+
+
+class LocalInvoker:
+    """Queues shard events in process, run() works through them the way async Lambda invocations would."""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.events = []
+
+    async def invoke(self, event):
+        self.events.append(event)
+
+    async def run(self, parallel=True):
+        results = []
+        while self.events:
+            events, self.events = self.events, []
+            if parallel:
+                results += await asyncio.gather(*(self.handler(event) for event in events))
+            else:
+                for event in events:
+                    results.append(await self.handler(event))
+        return results
+
+
+async def fan_out(invoker, run_id=None, shards=SEND_SHARDS):
+    run_id = run_id or templater.times.next_shabbat_date().isoformat()
+    await asyncio.gather(*(invoker.invoke(event) for event in shard_events(run_id, shards)))
+    return run_id
+
+
+async def process_shard(event, manager, store, send, invoker=None, context=None, batch_size=SHARD_BATCH_SIZE,
+                        clock=time.monotonic):
+    """
+    Send the subscriptions of one shard, resuming from the shard's saved cursor. batch_size templates are
+    read, and sent, a page at a time. send is a coroutine function taking a list of templates and returning
+    their SendResults.
+    """
+    run_id, shard, shards = event["run_id"], event["shard"], event["shards"]
+    checkpoint = store.get(run_id, shard) or {"cursor": None, "done": False}
+    summary = {"run_id": run_id, "shard": shard, "sent": 0, "failed": [], "done": True}
+    if checkpoint["done"]:
+        return summary
+
+    from boto3.dynamodb.conditions import Attr
+
+    cursor = checkpoint["cursor"]
+    longest_batch_ms = None
+    while True:
+        if longest_batch_ms is not None and context is not None and \
+                context.get_remaining_time_in_millis() < DEADLINE_MARGIN_MS + longest_batch_ms:
+            if invoker is not None:
+                await invoker.invoke(event)
+            summary["done"] = False
+            return summary
+
+        started_at = clock()
+        batch, next_cursor = manager.scan_page(shard, shards, cursor, batch_size,
+                                               filter_expression=Attr('next_send').not_exists())
+        if batch:
+            results = await send(batch)
+            summary["sent"] += sum(result.ok for result in results)
+            summary["failed"] += [result.template_path for result in results if not result.ok]
+        longest_batch_ms = max(longest_batch_ms or 0, (clock() - started_at) * 1000)
+        cursor = next_cursor
+        store.set(run_id, shard, cursor, cursor is None)
+        if cursor is None:
+            return summary
+
+
+async def main(event, context):
+    import schedule_send_templates
+    import template_manager
+
+    invoker = LambdaInvoker()
+    if event.get("source") == SHARD_EVENT_SOURCE:
+        summary = await process_shard(event, template_manager.get_manager(), DynamoDBCheckpointStore(),
+                                      schedule_send_templates.send_all_templates, invoker, context)
+    else:
+        summary = {"run_id": await fan_out(invoker), "shards": SEND_SHARDS}
+    return {
+        'statusCode': 200,
+        'body': json.dumps(summary, ensure_ascii=False)
+    }
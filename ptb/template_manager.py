@@ -1,19 +1,61 @@
 import boto3
+from boto3.dynamodb.conditions import Attr, Key
+import collections
+import hashlib
+import io
+import os
 from pathlib import Path
+import tempfile
+import threading
+import time
 import uuid
 
+import render_cache
+import templater.plan
+
+TEMPLATE_FIELDS = ('template_path', 'blob_key', 'city', 'chat_id', 'next_send')
+# Templates are indexed by the UTC hour of their next send, ordered by the send time within it.
+SEND_BUCKET_SECONDS = 60 * 60
+S3_DELETE_BATCH_SIZE = 1000
+# Template bytes are stored once per content, under blobs/<sha256><suffix>, and counted in the blob table by
+# the subscriptions that use them. Templates saved before had their bytes under their template_path.
+BLOB_PREFIX = "blobs/"
+# A blob whose last reference is released is marked as deleting until its objects are gone. Saves wait for
+# the mark to go, and take it over once it is this old, in case the delete never finished.
+BLOB_DELETE_LEASE_SECONDS = 5 * 60
+BLOB_DELETE_POLL_SECONDS = 0.05
+STREAM_CHUNK_SIZE = 1024 * 1024
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "templates"))
+TEMPLATE_CACHE_MAX_BYTES = int(os.getenv("TEMPLATE_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+
+# Secondary indexes of the template table: name -> (hash key, range key), with their attribute types.
+INDEXES = {
+    'city-index': (('city', 'S'), None),
+    'chat_id-index': (('chat_id', 'N'), None),
+    'next_send-index': (('send_bucket', 'S'), ('next_send', 'N')),
+}
+
 
 class TemplateManager:
     def __init__(self):
         self.table_name = 'template'
+        self.blobs_table_name = 'template_blob'
         self.dynamodb = boto3.client('dynamodb')
         self.s3 = boto3.client('s3')
         self.bucket_name = "aws-sam-cli-managed-default-samclisourcebucket-jitqxwpiihk1"
         self.templates_table = self._get_or_create_template_table()
+        self.blobs_table = self._get_or_create_blobs_table()
+        self.plans = {}
+        self.blob_locks = collections.defaultdict(threading.Lock)
+        self.blob_locks_lock = threading.Lock()
+        # Blobs never change, so the local copies never go stale, they are only evicted for space.
+        self.template_cache = render_cache.DiskRenderCache(TEMPLATE_CACHE_DIR, TEMPLATE_CACHE_MAX_BYTES,
+                                                           ttl=float("inf"))
 
     def _get_or_create_template_table(self):
         try:
-            self.dynamodb.describe_table(TableName=self.table_name)
+            description = self.dynamodb.describe_table(TableName=self.table_name)["Table"]
+            self._create_missing_index(description)
             return boto3.resource('dynamodb').Table(self.table_name)
         except self.dynamodb.exceptions.ResourceNotFoundException:
             table = self.dynamodb.create_table(
@@ -29,7 +71,8 @@ class TemplateManager:
                         'AttributeName': 'template_path',
                         'AttributeType': 'S'
                     }
-                ],
+                ] + self._index_attribute_definitions(INDEXES),
+                GlobalSecondaryIndexes=[self._index_definition(name) for name in INDEXES],
                 ProvisionedThroughput={
                     'ReadCapacityUnits': 1,
                     'WriteCapacityUnits': 1
@@ -41,29 +84,349 @@ class TemplateManager:
             table.wait_until_exists()
             return table
 
+    def _get_or_create_blobs_table(self):
+        try:
+            self.dynamodb.describe_table(TableName=self.blobs_table_name)
+            return boto3.resource('dynamodb').Table(self.blobs_table_name)
+        except self.dynamodb.exceptions.ResourceNotFoundException:
+            self.dynamodb.create_table(
+                TableName=self.blobs_table_name,
+                KeySchema=[{'AttributeName': 'blob_key', 'KeyType': 'HASH'}],
+                AttributeDefinitions=[{'AttributeName': 'blob_key', 'AttributeType': 'S'}],
+                ProvisionedThroughput={
+                    'ReadCapacityUnits': 1,
+                    'WriteCapacityUnits': 1
+                }
+            )
+            table = boto3.resource('dynamodb').Table(self.blobs_table_name)
+            table.wait_until_exists()
+            return table
+
+    @staticmethod
+    def _index_attribute_definitions(index_names):
+        attributes = {}
+        for name in index_names:
+            for key in INDEXES[name]:
+                if key is not None:
+                    attributes[key[0]] = key[1]
+        return [{'AttributeName': name, 'AttributeType': attribute_type}
+                for name, attribute_type in attributes.items()]
+
+    @staticmethod
+    def _index_definition(name):
+        hash_key, range_key = INDEXES[name]
+        key_schema = [{'AttributeName': hash_key[0], 'KeyType': 'HASH'}]
+        if range_key is not None:
+            key_schema.append({'AttributeName': range_key[0], 'KeyType': 'RANGE'})
+        return {
+            'IndexName': name,
+            'KeySchema': key_schema,
+            'Projection': {'ProjectionType': 'ALL'},
+            'ProvisionedThroughput': {'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}
+        }
+
+    def _create_missing_index(self, description):
+        # Tables created before the indexes existed get them one at a time, DynamoDB only builds
+        # one new index per update.
+        existing = {index['IndexName']: index['IndexStatus'] for index in description.get('GlobalSecondaryIndexes', [])}
+        if any(status != 'ACTIVE' for status in existing.values()):
+            return
+        missing = [name for name in INDEXES if name not in existing]
+        if missing:
+            self.dynamodb.update_table(
+                TableName=self.table_name,
+                AttributeDefinitions=self._index_attribute_definitions(missing[:1]),
+                GlobalSecondaryIndexUpdates=[{'Create': self._index_definition(missing[0])}]
+            )
+
     def _generate_unique_key(self, file_name):
         unique_id = str(uuid.uuid4()).replace("-", "")
         return f"{unique_id}_{file_name}"
 
-    def save(self, template_path, city, chat_id):
+    def _plan_key(self, template_path):
+        return f"{template_path}.plan.json"
+
+    @staticmethod
+    def blob_key(template):
+        """The S3 key of the bytes of a stored template."""
+        return template.get('blob_key') or template['template_path']
+
+    def _content_key(self, template_path, data=None):
+        digest = render_cache.file_digest(template_path) if data is None else hashlib.sha256(data).hexdigest()
+        return f"{BLOB_PREFIX}{digest}{Path(template_path).suffix}"
+
+    def _blob_exists(self, blob_key):
+        try:
+            self.s3.head_object(Bucket=self.bucket_name, Key=blob_key)
+            return True
+        except self.s3.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                raise
+            return False
+
+    def _add_references(self, blob_key, count):
+        """Add count (negative to release) references to a blob, returning how many are left."""
+        response = self.blobs_table.update_item(Key={'blob_key': blob_key}, UpdateExpression='ADD refs :count',
+                                                ExpressionAttributeValues={':count': count},
+                                                ReturnValues='UPDATED_NEW')
+        return response['Attributes']['refs']
+
+    def _take_reference(self, blob_key):
+        """Add a reference to a blob, once no delete of it is in progress. Returns how many there are."""
+        while True:
+            now = int(time.time())
+            try:
+                response = self.blobs_table.update_item(
+                    Key={'blob_key': blob_key}, UpdateExpression='ADD refs :one REMOVE deleting',
+                    ConditionExpression=Attr('deleting').not_exists() | Attr('deleting').lt(now),
+                    ExpressionAttributeValues={':one': 1}, ReturnValues='UPDATED_NEW')
+                return response['Attributes']['refs']
+            except self.dynamodb.exceptions.ConditionalCheckFailedException:
+                time.sleep(BLOB_DELETE_POLL_SECONDS)
+
+    def _release(self, blob_key, count=1):
+        """
+        Drop count references to a blob. When none are left the blob is marked as deleting and the mark is
+        returned, to be passed to _forget once its objects are deleted. None when the blob is still in use.
+        """
+        if self._add_references(blob_key, -count) > 0:
+            return None
+        mark = int(time.time()) + BLOB_DELETE_LEASE_SECONDS
+        try:
+            # A save may have taken a new reference since, or another release marked it already.
+            self.blobs_table.update_item(Key={'blob_key': blob_key}, UpdateExpression='SET deleting = :mark',
+                                         ConditionExpression=Attr('refs').lte(0) & Attr('deleting').not_exists(),
+                                         ExpressionAttributeValues={':mark': mark})
+            return mark
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            return None
+
+    def _forget(self, blob_key, mark):
+        """Remove the counter of a deleted blob, letting the saves waiting for it upload it again."""
+        try:
+            self.blobs_table.delete_item(Key={'blob_key': blob_key}, ConditionExpression=Attr('deleting').eq(mark))
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            pass
+
+    def _release_all(self, references):
+        """Release blob_key -> count references, deleting the blobs nobody uses anymore."""
+        marks = {blob_key: self._release(blob_key, count) for blob_key, count in references.items()}
+        marks = {blob_key: mark for blob_key, mark in marks.items() if mark is not None}
+        self._delete_objects(list(marks))
+        for blob_key, mark in marks.items():
+            self._forget(blob_key, mark)
+
+    def save(self, template_path, city, chat_id, data=None, next_send=None):
+        """
+        Subscribe chat_id to the template at template_path, or to data when the template is in memory.
+        next_send is the epoch second of the first send.
+        """
         key = self._generate_unique_key(Path(template_path).name)
-        self.s3.upload_file(template_path, self.bucket_name, key)
+        blob_key = self._content_key(template_path, data)
+        with self.blob_locks_lock:
+            blob_lock = self.blob_locks[blob_key]
+        # The first reference uploads, later ones only check the upload made it. Saves of the same bytes in
+        # this container wait for the one uploading them instead of uploading them again.
+        with blob_lock:
+            references = self._take_reference(blob_key)
+            try:
+                if references == 1 or not self._blob_exists(blob_key):
+                    if data is None:
+                        self.s3.upload_file(template_path, self.bucket_name, blob_key)
+                        plan = templater.plan.compile_plan(template_path)
+                    else:
+                        self.s3.put_object(Bucket=self.bucket_name, Key=blob_key, Body=data)
+                        plan = templater.plan.compile_plan(template_path, io.BytesIO(data))
+                    self.save_plan(blob_key, plan)
+            except Exception:
+                self._release_all({blob_key: 1})
+                raise
         template_item = {
             'template_path': key,
+            'blob_key': blob_key,
             'city': city,
             'chat_id': chat_id
         }
-        self.templates_table.put_item(Item=template_item)
+        if next_send is not None:
+            template_item.update({'next_send': int(next_send), 'send_bucket': send_bucket(next_send)})
+        try:
+            self.templates_table.put_item(Item=template_item)
+        except Exception:
+            self._release_all({blob_key: 1})
+            raise
+
+    def set_next_send(self, template_path, next_send, expected=None):
+        """
+        Move a template to another send time. With expected, only while its send time is still that one, which
+        is how a tick claims a template. Returns whether the template was moved.
+        """
+        condition = Attr('template_path').exists()
+        if expected is not None:
+            condition &= Attr('next_send').eq(expected)
+        try:
+            self.templates_table.update_item(
+                Key={'template_path': template_path},
+                UpdateExpression='SET next_send = :next_send, send_bucket = :send_bucket',
+                ExpressionAttributeValues={':next_send': int(next_send), ':send_bucket': send_bucket(next_send)},
+                ConditionExpression=condition)
+            return True
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def load_template(self, blob_key):
+        """The bytes of a stored template, from the local cache or streamed from S3 into memory."""
+        local_key = hashlib.sha256(blob_key.encode("utf-8")).hexdigest()
+        data = self.template_cache.get(local_key)
+        if data is None:
+            body = self.s3.get_object(Bucket=self.bucket_name, Key=blob_key)["Body"]
+            buffer = io.BytesIO()
+            for chunk in body.iter_chunks(STREAM_CHUNK_SIZE):
+                buffer.write(chunk)
+            data = buffer.getvalue()
+            self.template_cache.put(local_key, data)
+        return data
+
+    @staticmethod
+    def template_digest(blob_key, data):
+        """The sha256 of a template's bytes, which content addressed blobs carry in their key."""
+        if blob_key.startswith(BLOB_PREFIX):
+            return Path(blob_key[len(BLOB_PREFIX):]).stem
+        return hashlib.sha256(data).hexdigest()
+
+    def save_plan(self, template_path, plan):
+        self.s3.put_object(Bucket=self.bucket_name, Key=self._plan_key(template_path),
+                           Body=plan.to_json().encode("utf-8"), ContentType="application/json")
+        self.plans[template_path] = plan
+
+    def get_plan(self, blob_key, data):
+        """
+        Return the compiled plan of a stored template given its bytes, compiling and storing it next to the
+        template if it is missing or was written by an older plan version.
+        """
+        if blob_key in self.plans:
+            return self.plans[blob_key]
+        try:
+            body = self.s3.get_object(Bucket=self.bucket_name, Key=self._plan_key(blob_key))["Body"].read()
+            plan = templater.plan.TemplatePlan.from_json(body)
+        except (self.s3.exceptions.NoSuchKey, ValueError):
+            plan = templater.plan.compile_plan(blob_key, io.BytesIO(data))
+            self.save_plan(blob_key, plan)
+        self.plans[blob_key] = plan
+        return plan
+
+    @staticmethod
+    def _projection(fields):
+        names = {f"#{field}": field for field in fields}
+        return {'ProjectionExpression': ", ".join(names), 'ExpressionAttributeNames': names}
+
+    def _paginate(self, method, **kwargs):
+        while True:
+            page = method(**kwargs)
+            yield from page["Items"]
+            if "LastEvaluatedKey" not in page:
+                return
+            kwargs["ExclusiveStartKey"] = page["LastEvaluatedKey"]
 
+    def iter_templates(self, fields=TEMPLATE_FIELDS, filter_expression=None):
+        """Yield every stored template, reading the table page by page."""
+        kwargs = self._projection(fields) if fields else {}
+        if filter_expression is not None:
+            kwargs['FilterExpression'] = filter_expression
+        return self._paginate(self.templates_table.scan, **kwargs)
 
     def list_templates(self):
-        return self.templates_table.scan()["Items"]
+        return list(self.iter_templates())
+
+    def scan_page(self, segment=0, total_segments=1, start_key=None, limit=None, fields=TEMPLATE_FIELDS,
+                  filter_expression=None):
+        """
+        One page of segment out of total_segments of a parallel scan, starting after the template_path
+        start_key. Returns the templates and the template_path to continue after, None past the last page.
+        """
+        kwargs = {'Segment': segment, 'TotalSegments': total_segments, **self._projection(fields)}
+        if start_key is not None:
+            kwargs['ExclusiveStartKey'] = {'template_path': start_key}
+        if limit is not None:
+            kwargs['Limit'] = limit
+        if filter_expression is not None:
+            kwargs['FilterExpression'] = filter_expression
+        page = self.templates_table.scan(**kwargs)
+        return page['Items'], page.get('LastEvaluatedKey', {}).get('template_path')
+
+    def _query_index(self, index_name, key_condition, filter_expression, fields=TEMPLATE_FIELDS):
+        try:
+            yield from self._paginate(self.templates_table.query, IndexName=index_name,
+                                      KeyConditionExpression=key_condition, **self._projection(fields))
+        except self.dynamodb.exceptions.ClientError as e:
+            # The index is still being built on an existing table.
+            if e.response['Error']['Code'] not in ('ValidationException', 'ResourceNotFoundException'):
+                raise
+            yield from self.iter_templates(fields, filter_expression)
+
+    def templates_by_city(self, city):
+        return self._query_index('city-index', Key('city').eq(city), Attr('city').eq(city))
+
+    def templates_by_chat(self, chat_id):
+        return self._query_index('chat_id-index', Key('chat_id').eq(chat_id), Attr('chat_id').eq(chat_id))
+
+    def templates_by_send_bucket(self, send_bucket, until=None):
+        key_condition = Key('send_bucket').eq(send_bucket)
+        filter_expression = Attr('send_bucket').eq(send_bucket)
+        if until is not None:
+            key_condition &= Key('next_send').lte(until)
+            filter_expression &= Attr('next_send').lte(until)
+        return self._query_index('next_send-index', key_condition, filter_expression)
+
+    def templates_due_before(self, before):
+        """The templates whose next send is before `before`, whatever their bucket, by a filtered scan."""
+        return self.iter_templates(filter_expression=Attr('next_send').lt(int(before)))
+
+    def _delete_objects(self, blob_keys):
+        keys = [key for blob_key in blob_keys for key in (blob_key, self._plan_key(blob_key))]
+        for start in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+            self.s3.delete_objects(Bucket=self.bucket_name, Delete={
+                'Objects': [{'Key': key} for key in keys[start:start + S3_DELETE_BATCH_SIZE]],
+                'Quiet': True
+            })
+        for blob_key in blob_keys:
+            self.plans.pop(blob_key, None)
 
     def delete(self, template_path):
-        self.s3.delete_object(Bucket=self.bucket_name, Key=template_path)
-        self.templates_table.delete_item(Key={'template_path': template_path})
+        template = self.templates_table.delete_item(Key={'template_path': template_path},
+                                                    ReturnValues='ALL_OLD').get('Attributes')
+        if template is None:
+            return
+        if 'blob_key' not in template:
+            self._delete_objects([template['template_path']])
+        else:
+            self._release_all({template['blob_key']: 1})
+
+    def delete_many(self, templates):
+        """Delete the given template items, which need their template_path and blob_key."""
+        templates = list(templates)
+        with self.templates_table.batch_writer() as batch:
+            for template in templates:
+                batch.delete_item(Key={'template_path': template['template_path']})
+        self._delete_objects([template['template_path'] for template in templates if not template.get('blob_key')])
+        self._release_all(collections.Counter(template['blob_key'] for template in templates
+                                              if template.get('blob_key')))
 
     def delete_all(self):
-        for template in self.list_templates():
-            self.delete(template["template_path"])
+        self.delete_many(self.iter_templates(('template_path', 'blob_key')))
+
+def send_bucket(timestamp):
+    return time.strftime("%Y-%m-%dT%H", time.gmtime(int(timestamp) // SEND_BUCKET_SECONDS * SEND_BUCKET_SECONDS))
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
 
+def get_manager():
+    """The TemplateManager of this container, created (and the table checked) on first use."""
+    global _manager
+    # Handlers of concurrent chats ask for it from several I/O threads at once.
+    with _manager_lock:
+        if _manager is None:
+            _manager = TemplateManager()
+    return _manager
@@ -0,0 +1,128 @@
+"""
+City lookup over the yeshiva.org.il place ids.
+
+The table itself lives in places_index.py, generated from places.txt. After updating places.txt run
+`python -m templater.cities` from the ptb directory to regenerate it.
+"""
+import bisect
+import functools
+import os
+import re
+
+from . import exceptions
+
+FINAL_LETTERS = str.maketrans("ךםןףץ", "כמנפצ")
+PUNCTUATION = re.compile("[\"'`\u05f3\u05f4()\u0591-\u05bd\u05bf\u05c1\u05c2\u05c4-\u05c7]")
+SEPARATORS = re.compile("[\\s\\-\u05be_.,]+")
+DOUBLED_LETTERS = re.compile("(ו|י)\\1+")
+SUGGESTIONS_LIMIT = 5
+
+
+def normalize(name):
+    """Fold the spelling variants users type: punctuation, separators, final letters and doubled ו/י."""
+    name = PUNCTUATION.sub("", name)
+    name = SEPARATORS.sub(" ", name).strip().translate(FINAL_LETTERS)
+    return DOUBLED_LETTERS.sub("\\1", name)
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+class CityIndex:
+    def __init__(self, places):
+        self.places = dict(places)
+        self.by_key = {}
+        for name in self.places:
+            self.by_key.setdefault(normalize(name), []).append(name)
+        self.sorted_keys = sorted(self.by_key)
+        self.grams = {}
+        for key in self.by_key:
+            for gram in trigrams(key):
+                self.grams.setdefault(gram, set()).add(key)
+
+    def resolve(self, city):
+        """Return the canonical name of a city, or None if it isn't known."""
+        city = city.strip()
+        if city in self.places:
+            return city
+        names = self.by_key.get(normalize(city))
+        if names and len(names) == 1:
+            return names[0]
+        return None
+
+    def place_id(self, city):
+        name = self.resolve(city)
+        if name is None:
+            raise exceptions.NoSuchCity(city, self.suggest(city))
+        return name, self.places[name]
+
+    def prefix(self, text, limit=SUGGESTIONS_LIMIT):
+        key = normalize(text)
+        if not key:
+            return []
+        matches = []
+        index = bisect.bisect_left(self.sorted_keys, key)
+        while index < len(self.sorted_keys) and self.sorted_keys[index].startswith(key) and len(matches) < limit:
+            matches.extend(self.by_key[self.sorted_keys[index]])
+            index += 1
+        return matches[:limit]
+
+    def fuzzy(self, text, limit=SUGGESTIONS_LIMIT):
+        key = normalize(text)
+        if not key:
+            return []
+        candidates = set()
+        for gram in trigrams(key):
+            candidates.update(self.grams.get(gram, ()))
+        max_distance = max(1, len(key) // 3)
+        scored = []
+        for candidate in candidates:
+            # "תל אביב יפו" should still find "תל אביב"
+            distance = 1 if key.startswith(candidate + " ") else edit_distance(key, candidate)
+            if distance <= max_distance:
+                scored.append((distance, candidate))
+        matches = []
+        for _, candidate in sorted(scored):
+            matches.extend(self.by_key[candidate])
+        return matches[:limit]
+
+    def suggest(self, text, limit=SUGGESTIONS_LIMIT):
+        suggestions = []
+        for name in self.prefix(text, limit) + self.fuzzy(text, limit):
+            if name not in suggestions:
+                suggestions.append(name)
+        return suggestions[:limit]
+
+
+@functools.lru_cache(maxsize=None)
+def get_index():
+    from . import places_index
+    return CityIndex(places_index.PLACES)
+
+
+def build_places_index(places_file, output_file):
+    from .templater import resolve_cities_id_dictionary
+
+    places = resolve_cities_id_dictionary(places_file)
+    lines = ["# Generated from places.txt by `python -m templater.cities`, do not edit.", "PLACES = {"]
+    lines += [f"    {name!r}: {place_id}," for name, place_id in places.items()]
+    lines += ["}", ""]
+    with open(output_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    build_places_index(os.path.join(script_dir, "places.txt"), os.path.join(script_dir, "places_index.py"))
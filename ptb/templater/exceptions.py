@@ -1,3 +1,5 @@
 class NoSuchCity(Exception):
-    pass
-
+    def __init__(self, city, suggestions=()):
+        super().__init__(city)
+        self.city = city
+        self.suggestions = list(suggestions)
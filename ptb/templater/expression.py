@@ -0,0 +1,102 @@
+from . import instrumentation, utils
+
+
+class Expression:
+    __slots__ = ()
+
+    def evaluate(self, names):
+        raise NotImplementedError
+
+
+class Constant(Expression):
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def evaluate(self, names):
+        return self.value
+
+
+class Name(Expression):
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def evaluate(self, names):
+        try:
+            return names[self.name]
+        except LookupError:
+            instrumentation.log("undefined name", name=self.name)
+            instrumentation.count("undefined_names")
+            return 0
+
+
+class Assign(Expression):
+    __slots__ = ("name", "expression")
+
+    def __init__(self, name, expression):
+        self.name = name
+        self.expression = expression
+
+    def evaluate(self, names):
+        value = self.expression.evaluate(names)
+        names[self.name] = value
+        return value
+
+
+class BinOp(Expression):
+    __slots__ = ("op", "left", "right")
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def evaluate(self, names):
+        left = self.left.evaluate(names)
+        right = self.right.evaluate(names)
+        if self.op == '+':
+            if utils.is_number(left) and utils.is_number(right):
+                return left + right
+            return utils.add_minutes(left, right)
+        elif self.op == '-':
+            if utils.is_number(left) and utils.is_number(right):
+                return left - right
+            return utils.add_minutes(left, -right)
+        # Times only take part in * and / as their text.
+        elif self.op == '*':
+            return utils.format_value(left) * utils.format_value(right)
+        elif self.op == '/':
+            return utils.format_value(left) / utils.format_value(right)
+
+
+class Negate(Expression):
+    __slots__ = ("expression",)
+
+    def __init__(self, expression):
+        self.expression = expression
+
+    def evaluate(self, names):
+        return -self.expression.evaluate(names)
+
+
+class RoundUp(Expression):
+    __slots__ = ("expression",)
+
+    def __init__(self, expression):
+        self.expression = expression
+
+    def evaluate(self, names):
+        return utils.round_time_value(self.expression.evaluate(names), 5, 'ceil')
+
+
+class RoundDown(Expression):
+    __slots__ = ("expression",)
+
+    def __init__(self, expression):
+        self.expression = expression
+
+    def evaluate(self, names):
+        return utils.round_time_value(self.expression.evaluate(names), 5, 'floor')
@@ -0,0 +1,169 @@
+"""
+Per-stage timings and counters for fills and sends.
+
+An operation (one webhook update, one scheduled send) collects the spans and counters recorded while it
+runs and writes them as one JSON line when it ends: CloudWatch embedded metric format (EMF) on Lambda,
+plain JSON elsewhere. Code on the hot path only calls span() and count(), which do nothing outside a
+sampled operation.
+
+    with instrumentation.operation("update", chat_id=chat_id):
+        with instrumentation.span("xml_parse"):
+            ...
+
+METRICS_SAMPLE_RATE picks the share of operations that are recorded. With PROFILE_SLOW_MS set, sampled
+operations also run under cProfile, and the stats of those slower than the threshold are written to
+PROFILE_DIR for `python -m pstats` or snakeviz. cProfile sees everything the thread runs, so an operation
+is only profiled when no other one is running, and its stats are dropped if another one starts before it
+ends: concurrent sends are profiled with a concurrency of 1.
+"""
+import contextlib
+import contextvars
+import cProfile
+import json
+import os
+import random
+import time
+
+SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "1"))
+METRICS_FORMAT = os.getenv("METRICS_FORMAT", "emf" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "json")
+NAMESPACE = os.getenv("METRICS_NAMESPACE", "Templater")
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles")
+
+_current = contextvars.ContextVar("instrumentation_recorder", default=None)
+# Operations running right now, sampled or not, and the recorder of the one being profiled.
+_running = 0
+_profiled = None
+
+
+class Recorder:
+    def __init__(self, name, dimensions):
+        self.name = name
+        self.dimensions = dimensions
+        self.spans = {}
+        self.counters = {}
+        self.started_at = time.perf_counter()
+        self.duration_ms = None
+        self.overlapped = False
+
+    def add_span(self, name, duration_ms):
+        self.spans[name] = self.spans.get(name, 0) + duration_ms
+        self.counters[f"{name}_calls"] = self.counters.get(f"{name}_calls", 0) + 1
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self.started_at) * 1000
+        return self.duration_ms
+
+    def to_json(self):
+        return {"operation": self.name, **self.dimensions, "duration_ms": round(self.duration_ms, 3),
+                "spans_ms": {name: round(value, 3) for name, value in self.spans.items()},
+                "counters": self.counters}
+
+    def to_emf(self):
+        metrics = {"duration_ms": round(self.duration_ms, 3)}
+        units = {"duration_ms": "Milliseconds"}
+        for name, value in self.spans.items():
+            metrics[f"{name}_ms"] = round(value, 3)
+            units[f"{name}_ms"] = "Milliseconds"
+        for name, value in self.counters.items():
+            metrics[name] = value
+            units[name] = "Count"
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [["operation"]],
+                    "Metrics": [{"Name": name, "Unit": unit} for name, unit in units.items()],
+                }],
+            },
+            "operation": self.name,
+            **self.dimensions,
+            **metrics,
+        }
+
+    def emit(self):
+        print(json.dumps(self.to_emf() if METRICS_FORMAT == "emf" else self.to_json(), ensure_ascii=False,
+                         default=str))
+
+
+def current():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def _span(recorder, name):
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.add_span(name, (time.perf_counter() - started_at) * 1000)
+
+
+def span(name):
+    recorder = _current.get()
+    if recorder is None:
+        return contextlib.nullcontext()
+    return _span(recorder, name)
+
+
+def count(name, value=1):
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.count(name, value)
+
+
+def _dump_profile(profile, recorder):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{recorder.name}-{int(time.time() * 1000)}.prof")
+    profile.dump_stats(path)
+    return path
+
+
+@contextlib.contextmanager
+def operation(name, sample_rate=None, profile=False, **dimensions):
+    """
+    Record the spans and counters of one operation, when it is sampled. profile=True profiles this one
+    operation and writes its stats whatever it took, unless other operations run next to it.
+    """
+    global _running, _profiled
+    if _profiled is not None:
+        _profiled.overlapped = True
+    sample_rate = SAMPLE_RATE if sample_rate is None else sample_rate
+    recorder = None
+    if profile or random.random() < sample_rate:
+        recorder = Recorder(name, dimensions)
+    profiler = None
+    if recorder is not None and (profile or PROFILE_SLOW_MS) and not _running:
+        _profiled = recorder
+        profiler = cProfile.Profile()
+        profiler.enable()
+    _running += 1
+    token = _current.set(recorder) if recorder is not None else None
+    try:
+        yield recorder
+    finally:
+        _running -= 1
+        if token is not None:
+            _current.reset(token)
+        if profiler is not None:
+            profiler.disable()
+            _profiled = None
+        if recorder is not None:
+            duration_ms = recorder.finish()
+            if profiler is not None and recorder.overlapped:
+                recorder.dimensions["profile"] = "dropped, other operations overlapped it"
+            elif profiler is not None and (profile or duration_ms >= PROFILE_SLOW_MS):
+                recorder.dimensions["profile"] = _dump_profile(profiler, recorder)
+            recorder.emit()
+
+
+def log(message, **fields):
+    """A structured log line, carrying the operation it was written in."""
+    recorder = _current.get()
+    if recorder is not None:
+        fields.setdefault("operation", recorder.name)
+    print(json.dumps({"message": message, **fields}, ensure_ascii=False, default=str))
@@ -1,7 +1,14 @@
-import os
+import functools
+import threading
+
 import ply.lex as lex
 import ply.yacc as yacc
-from . import utils
+from . import expression, instrumentation, utils
+
+COMPILE_CACHE_SIZE = 4096
+_BUILD_LOCK = threading.Lock()
+_PARSE_LOCK = threading.Lock()
+
 
 class Parser:
     tokens = ()
@@ -10,28 +17,40 @@ class Parser:
     def __init__(self, names=None, **kw):
         self.debug = kw.get('debug', 0)
         self.names = names or {}
-        try:
-            modname = os.path.split(os.path.splitext(__file__)[0])[
-                          1] + "_" + self.__class__.__name__
-        except:
-            modname = "parser" + "_" + self.__class__.__name__
-        # self.debugfile = modname + ".dbg"
-        # print self.debugfile
-
-        # Build the lexer and parser
-        lex.lex(module=self, debug=self.debug)
-        yacc.yacc(module=self,
-                  debug=self.debug,
-                  )
+
+    @classmethod
+    def tables(cls):
+        # The lexer and the LALR tables are built once per process and shared by every instance,
+        # the grammar rules only build expressions so they never touch instance state.
+        if "_tables" not in cls.__dict__:
+            with _BUILD_LOCK:
+                if "_tables" not in cls.__dict__:
+                    # Build the lexer and parser
+                    grammar = cls()
+                    cls._tables = (lex.lex(module=grammar, debug=grammar.debug),
+                                   yacc.yacc(module=grammar, debug=grammar.debug))
+        return cls._tables
+
+    def compile(self, s):
+        return compile_expression(type(self), s)
 
     def parse(self, s, **kwargs):
-        b = yacc.parse(s, **kwargs)
-        return b
+        compiled = self.compile(s)
+        if compiled is None:
+            return None
+        return utils.format_value(compiled.evaluate(self.names))
 
     def set_names(self, names):
         self.names.update(names)
 
 
+@functools.lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def compile_expression(parser_class, s):
+    lexer, parser = parser_class.tables()
+    with _PARSE_LOCK:
+        return parser.parse(s, lexer=lexer)
+
+
 class TemplaterParser(Parser):
 
     tokens = (
@@ -79,7 +98,8 @@ class TemplaterParser(Parser):
 
 
     def t_error(self, t):
-        print("Illegal character '%s'" % t.value[0])
+        instrumentation.log("illegal character", character=t.value[0])
+        instrumentation.count("token_errors")
         t.lexer.skip(1)
 
     # Build the lexer
@@ -96,8 +116,8 @@ class TemplaterParser(Parser):
     def p_statement_assign(self, p):
         '''statement : NAME "=" expression
                        | NAME "=" TIME'''
-        self.names[p[1]] = p[3]
-        p[0] = p[3]
+        value = p[3] if isinstance(p[3], expression.Expression) else expression.Constant(utils.TimeValue.parse(p[3]))
+        p[0] = expression.Assign(p[1], value)
 
 
     def p_statement_expr(self, p):
@@ -109,37 +129,24 @@ class TemplaterParser(Parser):
                       | expression '-' expression
                       | expression '*' expression
                       | expression '/' expression'''
-        if p[2] == '+':
-            if utils.is_number(p[1]) and utils.is_number(p[3]):
-                p[0] = p[1] + p[3]
-            else:
-                p[0] = utils.add_minutes_to_time(p[1], p[3])
-        elif p[2] == '-':
-            if utils.is_number(p[1]) and utils.is_number(p[3]):
-                p[0] = p[1] - p[3]
-            else:
-                p[0] = utils.add_minutes_to_time(p[1], -p[3])
-        elif p[2] == '*':
-            p[0] = p[1] * p[3]
-        elif p[2] == '/':
-            p[0] = p[1] / p[3]
+        p[0] = expression.BinOp(p[2], p[1], p[3])
 
 
 
     def p_expression_uminus(self, p):
         "expression : '-' expression %prec UMINUS"
-        p[0] = -p[2]
+        p[0] = expression.Negate(p[2])
 
     def p_expression_down(self, p):
         """expression : DOWN '(' expression ')'
                         | HEBREW_DOWN '(' expression ')'"""
-        p[0] = utils.round_down_to_nearest_5_minutes(p[3])
+        p[0] = expression.RoundDown(p[3])
 
 
     def p_expression_up(self, p):
         """expression : UP '(' expression ')'
                       | HEBREW_UP '(' expression ')'"""
-        p[0] = utils.round_up_to_nearest_5_minutes(p[3])
+        p[0] = expression.RoundUp(p[3])
 
 
     def p_expression_group(self, p):
@@ -149,24 +156,18 @@ class TemplaterParser(Parser):
 
     def p_expression_number(self, p):
         "expression : NUMBER"
-        p[0] = p[1]
+        p[0] = expression.Constant(p[1])
 
     def p_expression_time(self, p):
         "expression : TIME"
-        p[0] = p[1]
+        p[0] = expression.Constant(utils.TimeValue.parse(p[1]))
 
 
     def p_expression_name(self, p):
         "expression : NAME"
-        try:
-            p[0] = self.names[p[1]]
-        except LookupError:
-            print("Undefined name '%s'" % p[1])
-            p[0] = 0
+        p[0] = expression.Name(p[1])
 
 
     def p_error(self, p):
-        if p:
-            print("Syntax error at '%s'" % p.value)
-        else:
-            print("Syntax error at EOF")
+        instrumentation.log("syntax error", at=p.value if p else "EOF")
+        instrumentation.count("token_errors")
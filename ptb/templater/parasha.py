@@ -0,0 +1,152 @@
+"""
+The weekly Torah portion read in Israel on a given Shabbat, computed from the Hebrew calendar.
+
+The year's readings are laid out between fixed anchors: Tzav (in a common year) before Pesach, Bamidbar
+before Shavuot, Devarim on the Shabbat before Tisha B'Av and Nitzavim before Rosh Hashana. Between two
+anchors the portions that may be read together are joined, in their customary order, until the readings fit
+the Shabbatot that are not holidays.
+"""
+import datetime
+import functools
+
+PARASHOT = [
+    "בראשית", "נח", "לך לך", "וירא", "חיי שרה", "תולדות", "ויצא", "וישלח", "וישב", "מקץ", "ויגש", "ויחי",
+    "שמות", "וארא", "בא", "בשלח", "יתרו", "משפטים", "תרומה", "תצוה", "כי תשא", "ויקהל", "פקודי",
+    "ויקרא", "צו", "שמיני", "תזריע", "מצורע", "אחרי מות", "קדושים", "אמור", "בהר", "בחוקותי",
+    "במדבר", "נשא", "בהעלותך", "שלח", "קרח", "חוקת", "בלק", "פינחס", "מטות", "מסעי",
+    "דברים", "ואתחנן", "עקב", "ראה", "שופטים", "כי תצא", "כי תבוא", "נצבים", "וילך", "האזינו",
+]
+TZAV, BAMIDBAR, DEVARIM, NITZAVIM = (PARASHOT.index(name) for name in ("צו", "במדבר", "דברים", "נצבים"))
+VAYELECH, HAAZINU = NITZAVIM + 1, NITZAVIM + 2
+# The first portion of each pair that may be joined to the next one, in the order they are joined.
+JOINABLE_BEFORE_PESACH = [PARASHOT.index("ויקהל")]
+JOINABLE_BEFORE_SHAVUOT = [PARASHOT.index(name) for name in ("תזריע", "אחרי מות", "בהר")]
+JOINABLE_BEFORE_TISHA_BAV = [PARASHOT.index("מטות")]
+
+# date.toordinal() of 1 Tishrei of year 1 (7 October 3761 BCE, Julian).
+HEBREW_EPOCH = -1373427
+SATURDAY = 5
+
+
+def _elapsed_days(year):
+    months = (235 * year - 234) // 19
+    parts = 12084 + 13753 * months
+    day = 29 * months + parts // 25920
+    if (3 * (day + 1)) % 7 < 3:
+        day += 1
+    return day
+
+
+def _new_year_delay(year):
+    if _elapsed_days(year + 1) - _elapsed_days(year) == 356:
+        return 2
+    if _elapsed_days(year) - _elapsed_days(year - 1) == 382:
+        return 1
+    return 0
+
+
+def new_year(year):
+    """The ordinal of Rosh Hashana (1 Tishrei) of a Hebrew year."""
+    return HEBREW_EPOCH + _elapsed_days(year) + _new_year_delay(year)
+
+
+def hebrew_year(ordinal):
+    year = (ordinal - HEBREW_EPOCH) * 98496 // 35975351 + 1
+    while new_year(year + 1) <= ordinal:
+        year += 1
+    while new_year(year) > ordinal:
+        year -= 1
+    return year
+
+
+def holiday(ordinal, year):
+    """The name of the festival falling on the given day of the year, in Israel, or None."""
+    day_of_year = ordinal - new_year(year)
+    # Nisan to Elul have fixed lengths, so the spring and summer dates count back from the next new year.
+    nisan = new_year(year + 1) - 177
+    if day_of_year in (0, 1):
+        return "ראש השנה"
+    if day_of_year == 9:
+        return "יום כיפור"
+    if day_of_year == 14:
+        return "סוכות"
+    if 15 <= day_of_year <= 20:
+        return "חול המועד סוכות"
+    if day_of_year == 21:
+        return "שמיני עצרת"
+    if ordinal == nisan + 14:
+        return "פסח"
+    if nisan + 15 <= ordinal <= nisan + 19:
+        return "חול המועד פסח"
+    if ordinal == nisan + 20:
+        return "שביעי של פסח"
+    if ordinal == nisan + 64:
+        return "שבועות"
+    return None
+
+
+def _shabbatot(start, end, year):
+    """Ordinals of the Shabbatot in [start, end) that are not festivals."""
+    first = start + (SATURDAY - datetime.date.fromordinal(start).weekday()) % 7
+    return [ordinal for ordinal in range(first, end, 7) if holiday(ordinal, year) is None]
+
+
+def _assign(readings, shabbatot, joinable):
+    """Readings (lists of portions) for the given Shabbatot, joining pairs in order until they fit."""
+    readings = [[index] for index in readings]
+    for first in joinable:
+        if len(readings) <= len(shabbatot):
+            break
+        position = next(i for i, reading in enumerate(readings) if reading == [first])
+        readings[position:position + 2] = [[first, first + 1]]
+    if len(readings) != len(shabbatot):
+        raise ValueError(f"{len(readings)} readings for {len(shabbatot)} Shabbatot")
+    return dict(zip(shabbatot, readings))
+
+
+@functools.lru_cache(maxsize=16)
+def year_schedule(year):
+    """Shabbat ordinal -> portion indexes read on it, for the Shabbatot of a Hebrew year."""
+    start, end = new_year(year), new_year(year + 1)
+    nisan = end - 177
+    leap = end - start > 380
+    schedule = {}
+
+    # Vayelech on Shabbat Shuva when there are two Shabbatot before Sukkot, then Haazinu.
+    before_sukkot = _shabbatot(start + 2, start + 14, year)
+    for ordinal, reading in zip(before_sukkot, [[VAYELECH], [HAAZINU]][2 - len(before_sukkot):]):
+        schedule[ordinal] = reading
+
+    before_pesach = _shabbatot(start + 22, nisan + 14, year)
+    # Devarim is read on the Shabbat before Tisha B'Av, or on the 9th of Av itself when it is a Shabbat.
+    if leap:
+        # A leap year joins nothing before Matot-Masei, the readings run on from Bereshit to Devarim.
+        schedule.update(_assign(range(len(before_pesach)), before_pesach, []))
+        schedule.update(_assign(range(len(before_pesach), DEVARIM + 1), _shabbatot(nisan + 21, nisan + 127, year),
+                                JOINABLE_BEFORE_TISHA_BAV))
+    else:
+        schedule.update(_assign(range(TZAV + 1), before_pesach, JOINABLE_BEFORE_PESACH))
+        schedule.update(_assign(range(TZAV + 1, BAMIDBAR + 1), _shabbatot(nisan + 21, nisan + 64, year),
+                                JOINABLE_BEFORE_SHAVUOT))
+        schedule.update(_assign(range(BAMIDBAR + 1, DEVARIM + 1), _shabbatot(nisan + 65, nisan + 127, year),
+                                JOINABLE_BEFORE_TISHA_BAV))
+    # Nitzavim and Vayelech are read together unless the next year leaves two Shabbatot before Sukkot.
+    if datetime.date.fromordinal(end).weekday() in (0, 1):
+        readings, joinable = range(DEVARIM + 1, NITZAVIM + 1), []
+    else:
+        readings, joinable = range(DEVARIM + 1, VAYELECH + 1), [NITZAVIM]
+    schedule.update(_assign(readings, _shabbatot(nisan + 127, end, year), joinable))
+    return schedule
+
+
+def parasha(date):
+    """The name of the portion (or festival) of the Shabbat on the given date, as read in Israel."""
+    ordinal = date.toordinal()
+    year = hebrew_year(ordinal)
+    reading = year_schedule(year).get(ordinal)
+    if reading is None:
+        name = holiday(ordinal, year)
+        if name is None:
+            raise ValueError(f"{date} is not a Shabbat")
+        return name
+    return "-".join(PARASHOT[index] for index in reading)
@@ -0,0 +1,161 @@
+# Generated from places.txt by `python -m templater.cities`, do not edit.
+PLACES = {
+    'אופקים': 129,
+    'אור יהודה': 218,
+    'אור עקיבא': 219,
+    'אילת': 130,
+    'אלון מורה': 362,
+    'אלוני הבשן': 382,
+    'אלעד': 131,
+    'אפרת': 217,
+    'אריאל': 132,
+    'אשדוד': 133,
+    'אשקלון': 134,
+    'באר יעקב': 135,
+    'באר שבע': 136,
+    'בית אל': 212,
+    'בית חגי': 433,
+    'בית שאן': 137,
+    'בית שמש': 138,
+    'ביתר עילית': 139,
+    'בני ברק': 140,
+    'בני נצרים': 247,
+    'בנימינה': 141,
+    'בת ים': 142,
+    'גבעת אסף': 449,
+    'גבעת זאב': 338,
+    'גבעת שמואל': 234,
+    'גבעתיים': 143,
+    'גדרה': 426,
+    'דימונה': 144,
+    'הוד השרון': 220,
+    'הר ברכה': 294,
+    'הרצליה': 145,
+    'זכרון יעקב': 146,
+    'חברון': 147,
+    'חדרה': 148,
+    'חולון': 149,
+    'חומש': 411,
+    'חיספין': 150,
+    'חיפה': 151,
+    'חמאם אל מליח': 244,
+    'חפץ חיים': 152,
+    'חריש': 248,
+    'חרמון מפלס עליון': 232,
+    'חרמון מפלס תחתון': 438,
+    'טבריה': 153,
+    'טירת הכרמל': 221,
+    'טלזסטון': 154,
+    'טלמון': 207,
+    'יבול': 206,
+    'יבנה': 222,
+    'יד בנימין': 351,
+    'יהוד': 223,
+    'יוקנעם': 371,
+    'יסוד המעלה': 344,
+    'יצהר': 423,
+    'ירוחם': 155,
+    'ירושלים': 156,
+    'יריחו': 236,
+    'יתיר': 365,
+    'כוכב השחר': 375,
+    'כינר': 350,
+    'כפר אדומים': 401,
+    'כפר חבד': 157,
+    'כפר חסידים': 158,
+    'כפר מימון': 159,
+    'כפר סבא': 224,
+    'כרמיאל': 160,
+    'לביא': 352,
+    'לוד': 161,
+    'מבשרת ציון': 370,
+    'מגדל': 321,
+    'מגדל העמק': 162,
+    'מודיעין': 163,
+    'מזכרת בתיה': 246,
+    'מחולה': 240,
+    'מירון': 164,
+    'מיתר': 422,
+    'מעגלים': 165,
+    'מעלה אדומים': 166,
+    'מעלה אפרים': 373,
+    'מעלה לבונה': 312,
+    'מעלות': 210,
+    'מצדה': 369,
+    'מצפה יריחו': 356,
+    'מצפה רמון': 167,
+    'נבי מוסא': 208,
+    'נהלל': 168,
+    'נהריה': 169,
+    'נווה צוף (חלמיש)': 341,
+    'נוף הגליל': 226,
+    'נופי פרת': 437,
+    'ניר עציון': 170,
+    'נס ציונה': 225,
+    'נריה': 366,
+    'נשר': 171,
+    'נתב"ג-התעשייה האווירית': 431,
+    'נתיבות': 172,
+    'נתניה': 173,
+    'סוסיא': 318,
+    'סיירים': 216,
+    'עזה': 436,
+    'עטרת': 209,
+    'עין בוקק': 174,
+    'עין גדי': 424,
+    'עין יהב': 237,
+    'עכו': 175,
+    'עלי': 243,
+    'עמנואל': 213,
+    'עפולה': 176,
+    'עפרה': 241,
+    'עציון גבר': 177,
+    'ערד': 178,
+    'עתניאל': 242,
+    'פדואל': 238,
+    'פקיעין': 179,
+    'פרדס חנה-כרכור': 180,
+    'פתח תקוה': 181,
+    'צאלים': 235,
+    'צפת': 182,
+    'קדומים': 183,
+    'קוממיות': 184,
+    'קיבוץ מירב': 367,
+    'קידה': 295,
+    'קציר': 250,
+    'קצרין': 233,
+    'קרית אונו': 227,
+    'קרית ארבע': 185,
+    'קרית אתא': 228,
+    'קרית ביאליק': 229,
+    'קרית גת': 186,
+    'קרית טבעון': 187,
+    'קרית ים': 188,
+    'קרית מוצקין': 230,
+    'קרית מלאכי': 189,
+    'קרית נטפים': 245,
+    'קרית ספר': 190,
+    'קרית שמונה': 191,
+    'קרני שומרון': 211,
+    'ראש העין': 192,
+    'ראש פינה': 193,
+    'ראשון לציון': 194,
+    'רחובות': 195,
+    'רכסים': 215,
+    'רמלה': 196,
+    'רמת גן': 231,
+    'רמת השרון': 197,
+    'רמת מגשימים': 198,
+    'רעננה': 199,
+    'שא נור': 412,
+    'שבי ציון': 200,
+    'שדרות': 214,
+    'שהם': 239,
+    'שומריה': 349,
+    'שילה': 249,
+    'שכם': 201,
+    'שעלבים': 202,
+    'תושיה': 203,
+    'תל אביב': 204,
+    'תפרח': 205,
+}
@@ -0,0 +1,153 @@
+import io
+import json
+import os
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from . import archive, instrumentation, lex, templater
+
+PLAN_VERSION = 1
+PLACEHOLDER = "\ue000{}\ue001"
+PLACEHOLDER_PATTERN = re.compile("\ue000(\\d+)\ue001")
+PLACEHOLDER_MARK = "\ue000".encode("utf-8")
+
+
+class _PlaceholderTemplater(templater.XMLTemplater):
+    """Runs the regular token scan, but records each token and leaves a placeholder where its value goes."""
+
+    def __init__(self):
+        super().__init__()
+        self.tokens = []
+
+    def parse_token(self, token):
+        self.tokens.append(token[2:-2])
+        return PLACEHOLDER.format(len(self.tokens) - 1)
+
+
+class TemplatePlan:
+    """
+    A template indexed once. For every part that carries tokens the serialized XML is kept as a list of
+    literal chunks alternating with token sources, so rendering is evaluating the (cached) expressions and
+    joining strings. Parts without tokens are not listed and are copied from the template untouched.
+    """
+
+    def __init__(self, extension, parts):
+        self.extension = extension
+        self.parts = parts
+
+    @classmethod
+    def compile(cls, office_file_name, source=None):
+        office_templater = templater.get_templater(office_file_name)
+        parts = {}
+        with zipfile.ZipFile(source or office_file_name) as zip_in:
+            for info in zip_in.infolist():
+                if not office_templater.is_template_part(info.filename):
+                    continue
+                data = zip_in.read(info)
+                if not templater.has_tokens(data):
+                    continue
+                if PLACEHOLDER_MARK in data:
+                    raise ValueError(f"{info.filename} already contains the plan placeholder character")
+                part_templater = _PlaceholderTemplater()
+                part_templater.init_xml(io.BytesIO(data))
+                part_templater.replace_tokens()
+                if not part_templater.tokens:
+                    continue
+                segments = PLACEHOLDER_PATTERN.split(part_templater.serialize().decode("utf-8"))
+                segments[1::2] = [part_templater.tokens[int(index)] for index in segments[1::2]]
+                parts[info.filename] = segments
+        return cls(office_templater.file_extension(), parts)
+
+    def render(self, names, source, target):
+        """
+        Render the template read from source (the same bytes the plan was compiled from) into target.
+        Both may be a path or a binary file object.
+        """
+        parser = lex.TemplaterParser(dict(names))
+        with zipfile.ZipFile(source) as zip_in, zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as zip_out:
+            for info in zip_in.infolist():
+                if info.filename in self.parts:
+                    self._render_part(parser, zip_out, info)
+                    continue
+                with instrumentation.span("zip_write"):
+                    archive.copy_member(zip_in, zip_out, info)
+
+    def render_many(self, names_list, source, targets):
+        """
+        Render the template once for every set of names, into the matching target. The archive is read once:
+        the members without tokens are kept as stored and written to every target as they are.
+        """
+        with zipfile.ZipFile(source) as zip_in:
+            members = [(info, None if info.filename in self.parts else archive.read_member(zip_in, info))
+                       for info in zip_in.infolist()]
+        for names, target in zip(names_list, targets):
+            parser = lex.TemplaterParser(dict(names))
+            with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as zip_out:
+                for info, member in members:
+                    if member is None:
+                        self._render_part(parser, zip_out, info)
+                        continue
+                    with instrumentation.span("zip_write"):
+                        archive.write_member(zip_out, info, member)
+
+    def _render_part(self, parser, zip_out, info):
+        segments = self.parts[info.filename]
+        rendered = segments[:]
+        with instrumentation.span("expression_eval"):
+            rendered[1::2] = [escape(parser.parse(token)) for token in segments[1::2]]
+        instrumentation.count("tokens", len(segments) // 2)
+        with instrumentation.span("zip_write"):
+            archive.replace_member(zip_out, info, "".join(rendered).encode("utf-8"))
+
+    def fill_template(self, city, source, target_directory):
+        names = templater.init_replacements(city)
+        target_path = templater.output_path(names, target_directory, self.extension)
+        self.render(names, source, target_path)
+        return target_path
+
+    def to_json(self):
+        return json.dumps({"version": PLAN_VERSION, "extension": self.extension, "parts": self.parts},
+                          ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data):
+        plan = json.loads(data)
+        if plan.get("version") != PLAN_VERSION:
+            raise ValueError(f"Unsupported plan version {plan.get('version')}")
+        return cls(plan["extension"], plan["parts"])
+
+
+def compile_plan(office_file_name, source=None):
+    return TemplatePlan.compile(office_file_name, source)
+
+
+def render_cities(replacements, office_file_name, target_directory):
+    """
+    Fill one template for many cities, parsing it once. replacements maps every city to its names, the
+    documents are written next to each other and returned as city -> path.
+    """
+    plan = compile_plan(office_file_name)
+    paths = {city: templater.output_path(names, target_directory, plan.extension, city)
+             for city, names in replacements.items()}
+    plan.render_many(list(replacements.values()), office_file_name, list(paths.values()))
+    return paths
+
+
+def render_documents(replacements, office_file_name, source=None):
+    """render_cities in memory: city -> (file name, document bytes). source may be a path or a file object."""
+    source = source or office_file_name
+    plan = compile_plan(office_file_name, source)
+    documents = [io.BytesIO() for _ in replacements]
+    plan.render_many(list(replacements.values()), source, documents)
+    return {city: (os.path.basename(templater.output_path(names, "", plan.extension, city)), document.getvalue())
+            for (city, names), document in zip(replacements.items(), documents)}
+
+
+def render_cities_zip(replacements, office_file_name, target, source=None):
+    """render_cities into a single zip, a path or a file object, holding the document of every city."""
+    # The documents are compressed already.
+    with zipfile.ZipFile(target, "w", zipfile.ZIP_STORED) as zip_out:
+        for name, document in render_documents(replacements, office_file_name, source).values():
+            zip_out.writestr(name, document)
+    return target
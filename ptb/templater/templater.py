@@ -1,20 +1,32 @@
-import glob
-import json
+import concurrent.futures
+import fnmatch
+import io
+import itertools
+import os
 import pathlib
-import shutil
-import tempfile
 import zipfile
 
-import requests
 import re
-import os
 from lxml import etree
 from abc import ABC, abstractmethod
 
-from . import exceptions, lex
+from . import archive, cities, instrumentation, lex, times
 
 TOKENIZED_PATTERN = re.compile(r"\w*{{(.*)}}\w*")
+TOKEN_START = "{{"
+TOKEN_END = "}}"
+TOKEN_START_BYTES = TOKEN_START.encode("utf-8")
+# Text runs of Word (w:t) and of DrawingML, which PowerPoint slides use (a:t).
+TEXT_ELEMENTS_XPATH = etree.XPath("//w:t | //a:t", namespaces={
+    "w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main",
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+})
 TEMPLATER_PARSER = lex.TemplaterParser()
+# Below this many token-bearing parts a document is rendered in process, shipping the parts to workers
+# costs more than it saves.
+PARALLEL_PARTS_THRESHOLD = int(os.getenv("PARALLEL_PARTS_THRESHOLD", "24"))
+# Process pools need /dev/shm, which Lambda doesn't have, so they are only used when PART_WORKERS is set.
+PART_WORKERS = int(os.getenv("PART_WORKERS", "0"))
 
 class UnsupportedFileType(Exception):
     pass
@@ -36,53 +48,73 @@ class Templater(ABC):
         pass
 
     def parse_token(self, token):
-        return self.templater_parser.parse(token[2:-2])
+        with instrumentation.span("expression_eval"):
+            return self.templater_parser.parse(token[2:-2])
 
     def fill_template(self, city, *args, **kwargs):
         self.templater_parser.set_names(init_replacements(city))
-        maybe_token = False
+        self.replace_tokens()
+
+    def replace_tokens(self):
+        """Replace every token in the elements and return the number of tokens replaced."""
+        # A token may open in one text element and close in a later one (Word and PowerPoint split runs
+        # freely). Those elements are kept in cross_line_token until the closing "}}" shows up: the first
+        # one is cut at the "{{", the middle ones are emptied and the value lands in the closing element.
         cross_line_token = []
+        start_index = 0
+        replaced = 0
         while True:
             element = self.get_next_element()
             if element is None:
-                break
+                return replaced
 
             text_element = self.get_text_from_element(element)
-            replaced_text = ""
+            if not text_element:
+                if cross_line_token:
+                    cross_line_token.append(element)
+                continue
+
+            replaced_text = []
             index = 0
-            while text_element and index < len(text_element):
-                if text_element[index:index + 2] == '{{':
-                    start_index = index
-                    maybe_token = True
-                    index += 2
-                    replaced_text += text_element[start_index:index]
-                elif maybe_token and text_element[index:index + 2] == '}}':
-                    end_index = index + 2
-                    maybe_token = False
-                    if not cross_line_token:
-                        token = text_element[start_index:end_index]
-                        replaced_text = replaced_text[:start_index] + self.parse_token(token)
-                    else:
-                        token = "".join([self.get_text_from_element(t) for t in cross_line_token])
-                        token += text_element[:end_index]
-                        token = token[start_index:]
-
-                        self.set_text_in_element(cross_line_token[0],
-                                                 self.get_text_from_element(cross_line_token[0])[:start_index])
-                        cross_line_token.pop(0)
-
-                        for c in cross_line_token:
-                            self.set_text_in_element(c, "")
-                        replaced_text = self.parse_token(token)
-                        cross_line_token = []
-                        start_index = 0
-                    index += 2
-                else:
-                    replaced_text += text_element[index]
-                    index += 1
-            self.set_text_in_element(element, replaced_text)
-            if maybe_token:
-                cross_line_token.append(element)
+            if cross_line_token:
+                end_index = text_element.find(TOKEN_END)
+                next_start = text_element.find(TOKEN_START)
+                if end_index == -1 and next_start == -1:
+                    cross_line_token.append(element)
+                    continue
+                if end_index != -1 and (next_start == -1 or end_index < next_start):
+                    end_index += len(TOKEN_END)
+                    token = "".join([self.get_text_from_element(t) or "" for t in cross_line_token])
+                    token = token[start_index:] + text_element[:end_index]
+                    self.set_text_in_element(cross_line_token[0],
+                                             self.get_text_from_element(cross_line_token[0])[:start_index])
+                    for c in cross_line_token[1:]:
+                        self.set_text_in_element(c, "")
+                    replaced_text.append(self.parse_token(token))
+                    replaced += 1
+                    index = end_index
+                # An unterminated "{{" followed by a new one is left as plain text.
+                cross_line_token = []
+
+            while True:
+                start = text_element.find(TOKEN_START, index)
+                if start == -1:
+                    break
+                end_index = text_element.find(TOKEN_END, start + len(TOKEN_START))
+                if end_index == -1:
+                    start_index = sum(len(t) for t in replaced_text) + start - index
+                    cross_line_token.append(element)
+                    break
+                end_index += len(TOKEN_END)
+                start = text_element.rfind(TOKEN_START, start, end_index - len(TOKEN_END))
+                replaced_text.append(text_element[index:start])
+                replaced_text.append(self.parse_token(text_element[start:end_index]))
+                replaced += 1
+                index = end_index
+
+            if index:
+                replaced_text.append(text_element[index:])
+                self.set_text_in_element(element, "".join(replaced_text))
 
 
 class XMLTemplater(Templater):
@@ -93,11 +125,11 @@ class XMLTemplater(Templater):
         self.text_elements = None
         self.index = None
 
-    def init_xml(self, xml_file_path, xpath="//*[local-name()='t']"):
+    def init_xml(self, xml_file_path, xpath=TEXT_ELEMENTS_XPATH):
         self.xml_file_path = xml_file_path
-        self.tree = etree.parse(xml_file_path)
-        root = self.tree.getroot()
-        self.text_elements = root.xpath(xpath)
+        with instrumentation.span("xml_parse"):
+            self.tree = etree.parse(xml_file_path)
+        self.text_elements = xpath(self.tree) if callable(xpath) else self.tree.getroot().xpath(xpath)
         self.index = 0
 
     def get_text_from_element(self, element):
@@ -113,10 +145,16 @@ class XMLTemplater(Templater):
         self.index += 1
         return element
 
+    def serialize(self):
+        with instrumentation.span("xml_serialize"):
+            return etree.tostring(self.tree, xml_declaration=True, encoding="UTF-8",
+                                  standalone=self.tree.docinfo.standalone)
+
     def fill_template(self, city, xml_file_path, *args, **kwargs):
         self.init_xml(xml_file_path)
-        super().fill_template(city)
-        self.tree.write(self.xml_file_path)
+        self.templater_parser.set_names(init_replacements(city))
+        if self.replace_tokens():
+            self.tree.write(self.xml_file_path)
 
 
 
@@ -129,23 +167,71 @@ class OfficeTemplater(XMLTemplater, ABC):
     def file_extension(self):
         pass
 
-    def fill_template(self, city, office_file_name, target_directory, *args, **kwargs):
-        with tempfile.TemporaryDirectory() as dir_name:
-            shutil.copy(office_file_name, f"{dir_name}/input.zip")
-            with zipfile.ZipFile(f"{dir_name}/input.zip", 'r') as zip_ref:
-                extracted_path = dir_name + "/extracted"
-                zip_ref.extractall(extracted_path)
-                for file in glob.glob(os.path.join(extracted_path, self.glob_path())):
-                    self.init_xml(file)
-                    super().fill_template(city, file)
-                    self.tree.write(file)
-
-            shutil.make_archive(f"{target_directory}/output", 'zip', extracted_path)
-            file_name = f"לוז שבת פרשת {self.templater_parser.names['parasha']}"
-            target_path = f"{target_directory}/{file_name}.{self.file_extension()}"
-            shutil.move(f"{target_directory}/output.zip", target_path)
-            return target_path
+    def is_template_part(self, name):
+        # Like glob, a * doesn't cross a "/": slide*.xml matches the slides but nothing in a folder below.
+        pattern = self.glob_path()
+        return name.count("/") == pattern.count("/") and fnmatch.fnmatchcase(name, pattern)
 
+    def fill_template(self, city, office_file_name, target_directory, *args, executor=None, **kwargs):
+        self.templater_parser.set_names(init_replacements(city))
+        target_path = output_path(self.templater_parser.names, target_directory, self.file_extension())
+        self.render(office_file_name, target_path, executor)
+        return target_path
+
+    def render(self, source, target, executor=None):
+        """
+        Fill the template read from source into target using the names already set on the parser.
+        Both may be a path or a binary file object (e.g. io.BytesIO). Only the parts matching glob_path
+        are parsed, and only the ones where a token was replaced are rewritten. Every other member is copied
+        as raw compressed bytes. With an executor, documents with many token-bearing parts have them
+        rendered by its workers.
+        """
+        with zipfile.ZipFile(source) as zip_in, zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as zip_out:
+            parts = {}
+            with instrumentation.span("unzip"):
+                for info in zip_in.infolist():
+                    if self.is_template_part(info.filename):
+                        data = zip_in.read(info)
+                        if has_tokens(data):
+                            parts[info.filename] = data
+            instrumentation.count("template_parts", len(parts))
+            rendered = self.render_parts(parts, executor)
+            with instrumentation.span("zip_write"):
+                for info in zip_in.infolist():
+                    if rendered.get(info.filename) is not None:
+                        archive.replace_member(zip_out, info, rendered[info.filename])
+                    else:
+                        archive.copy_member(zip_in, zip_out, info)
+
+    def render_parts(self, parts, executor=None):
+        """Return the rewritten XML of every part by name, None for the parts where nothing was replaced."""
+        names = list(parts)
+        if executor is None or len(names) < PARALLEL_PARTS_THRESHOLD:
+            return self._render_parts_serially(parts, names)
+
+        workers = PART_WORKERS or os.cpu_count() or 1
+        chunk_size = -(-len(names) // workers)
+        chunks = [[(name, parts[name]) for name in names[start:start + chunk_size]]
+                  for start in range(0, len(names), chunk_size)]
+        rendered = {}
+        for name, data, assigned, failed in itertools.chain.from_iterable(
+                executor.map(render_parts, chunks, itertools.repeat(self.templater_parser.names))):
+            if assigned or failed:
+                # A token assigned a name, which the parts after it may read: render them in order here. A part
+                # that failed is rendered here too, so its error is raised from the process rendering the document.
+                rendered.update(self._render_parts_serially(parts, names[names.index(name):]))
+                break
+            rendered[name] = data
+        return rendered
+
+    def _render_parts_serially(self, parts, names):
+        rendered = {}
+        for name in names:
+            self.init_xml(io.BytesIO(parts[name]))
+            with instrumentation.span("token_scan"):
+                replaced = self.replace_tokens()
+            rendered[name] = self.serialize() if replaced else None
+        return rendered
 
 class WordTemplater(OfficeTemplater):
     def glob_path(self):
@@ -161,6 +247,43 @@ class PowerPointTemplater(OfficeTemplater):
     def file_extension(self):
         return "pptx"
 
+def render_parts(parts, names):
+    """
+    Worker side of OfficeTemplater.render_parts: render (name, data) pairs, each with a templater of its
+    own, and report for every part whether one of its tokens assigned a name and whether it failed. The
+    parts after the first that did are left out, they may read the name it assigned.
+    """
+    results = []
+    for name, data in parts:
+        part_templater = XMLTemplater()
+        part_templater.templater_parser.set_names(names)
+        try:
+            part_templater.init_xml(io.BytesIO(data))
+            replaced = part_templater.replace_tokens()
+        except Exception:
+            results.append((name, None, False, True))
+            break
+        assigned = part_templater.templater_parser.names != names
+        results.append((name, part_templater.serialize() if replaced else None, assigned, False))
+        if assigned:
+            break
+    return results
+
+_part_executor = None
+
+def get_part_executor():
+    global _part_executor
+    if _part_executor is None and PART_WORKERS > 1:
+        _part_executor = concurrent.futures.ProcessPoolExecutor(max_workers=PART_WORKERS)
+    return _part_executor
+
+def has_tokens(data):
+    """
+    Cheap check on the raw bytes of a part: a token opens with "{{" inside a single text element, so a
+    part without those two bytes next to each other has nothing to replace.
+    """
+    return TOKEN_START_BYTES in data
+
 def resolve_cities_id_dictionary(file_name):
     pattern = r'<option value="(\d+)">([^<]+)</option>'
 
@@ -169,23 +292,31 @@ def resolve_cities_id_dictionary(file_name):
 
     return cities_dict
 
-def get_times(city):
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    places_file = os.path.join(script_dir, "places.txt")
-    cities_dict = resolve_cities_id_dictionary(places_file)
-    if city not in cities_dict:
-        raise Exception("City not found")
-    response = requests.get(f"https://www.yeshiva.org.il/api/times/AllDailyTimes?cacheVer=51&place={cities_dict[city]}", headers={"Referer": "https://www.yeshiva.org.il/"})
-    if response.status_code != 200:
-        raise Exception("Failed to get next times")
-    json_times = response.json()
+def check_place(json_times, city):
     if json_times["standardTimes"]["place"]["name"] != city:
         raise Exception("Wrong city")
     return json_times
 
+def get_times(city):
+    city, place_id = cities.get_index().place_id(city)
+    with instrumentation.span("times_fetch"):
+        json_times = times.get_provider().fetch(place_id)
+    return check_place(json_times, city)
+
+async def get_times_async(city):
+    city, place_id = cities.get_index().place_id(city)
+    with instrumentation.span("times_fetch"):
+        json_times = await times.get_provider().fetch_async(place_id)
+    return check_place(json_times, city)
+
 
 def init_replacements(city):
-    json_times = get_times(city)
+    return replacements_from_times(get_times(city))
+
+async def init_replacements_async(city):
+    return replacements_from_times(await get_times_async(city))
+
+def replacements_from_times(json_times):
     # TODO: check next holiday
     next_shabbat = json_times["standardTimes"]["shabat"]
     parsed_times = {k["name"]: k["value"] for k in next_shabbat["times"]}
@@ -214,12 +345,22 @@ def init_replacements(city):
 def parse_token(token):
     return TEMPLATER_PARSER.parse(token[2:-2])
 
-def fill_template(city, office_file_name, target_directory):
+def output_path(names, target_directory, extension, city=None):
+    file_name = f"לוז שבת פרשת {names['parasha']}"
+    if city is not None:
+        file_name += f" - {city}"
+    return f"{target_directory}/{file_name}.{extension}"
+
+def get_templater(office_file_name):
     extension = pathlib.Path(office_file_name).suffix
     if extension == ".docx":
-        templater = WordTemplater()
+        return WordTemplater()
     elif extension == ".pptx":
-        templater = PowerPointTemplater()
+        return PowerPointTemplater()
     else:
         raise UnsupportedFileType(extension)
-    return templater.fill_template(city, office_file_name, target_directory)
+
+def fill_template(city, office_file_name, target_directory, executor=None):
+    templater = get_templater(office_file_name)
+    return templater.fill_template(city, office_file_name, target_directory,
+                                   executor=executor or get_part_executor())
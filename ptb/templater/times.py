@@ -0,0 +1,277 @@
+import asyncio
+import datetime
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from zoneinfo import ZoneInfo
+    ISRAEL_TZ = ZoneInfo("Asia/Jerusalem")
+except Exception:
+    ISRAEL_TZ = datetime.timezone(datetime.timedelta(hours=2))
+
+SATURDAY = 5
+DEFAULT_TTL = 6 * 60 * 60
+
+
+def next_shabbat_date(now=None):
+    today = datetime.datetime.fromtimestamp(now if now is not None else time.time(), ISRAEL_TZ).date()
+    return today + datetime.timedelta(days=(SATURDAY - today.weekday()) % 7)
+
+
+class TimesProvider(ABC):
+    @abstractmethod
+    def fetch(self, place_id):
+        """Return the AllDailyTimes json of a place, as served by yeshiva.org.il"""
+        pass
+
+    async def fetch_async(self, place_id):
+        """fetch() for the event loop, providers without a native one run it on a thread."""
+        return await asyncio.to_thread(self.fetch, place_id)
+
+
+class YeshivaTimesProvider(TimesProvider):
+    url = os.getenv("TIMES_URL", "https://www.yeshiva.org.il") + "/api/times/AllDailyTimes?cacheVer=51&place={}"
+    headers = {"Referer": "https://www.yeshiva.org.il/"}
+    retry_statuses = (429, 500, 502, 503, 504)
+    backoff_factor = 0.3
+
+    def __init__(self, timeout=5, retries=3):
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        retry = Retry(total=retries, backoff_factor=self.backoff_factor, status_forcelist=self.retry_statuses,
+                      allowed_methods=("GET",))
+        self.session.mount("https://", HTTPAdapter(max_retries=retry))
+        self.async_client = None
+
+    def fetch(self, place_id):
+        response = self.session.get(self.url.format(place_id), timeout=self.timeout)
+        if response.status_code != 200:
+            raise Exception("Failed to get next times")
+        return response.json()
+
+    def _get_async_client(self):
+        # One pooled client for every coroutine of the container. httpx comes with python-telegram-bot.
+        if self.async_client is None or self.async_client.is_closed:
+            import httpx
+
+            self.async_client = httpx.AsyncClient(headers=self.headers, timeout=self.timeout,
+                                                  limits=httpx.Limits(max_connections=20))
+        return self.async_client
+
+    async def fetch_async(self, place_id):
+        import httpx
+
+        client = self._get_async_client()
+        for attempt in range(self.retries + 1):
+            try:
+                response = await client.get(self.url.format(place_id))
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+                response = None
+            if response is not None and response.status_code not in self.retry_statuses:
+                break
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+        if response.status_code != 200:
+            raise Exception("Failed to get next times")
+        return response.json()
+
+    async def aclose(self):
+        if self.async_client is not None:
+            await self.async_client.aclose()
+
+
+class FakeTimesProvider(TimesProvider):
+    """
+    Serves recorded responses, either a {place_id: json} mapping or a callable taking the place id.
+    fetch_async() answers after `delay` seconds, standing in for the network wait.
+    """
+
+    def __init__(self, responses, delay=0):
+        self.responses = responses
+        self.delay = delay
+        self.calls = []
+
+    def fetch(self, place_id):
+        self.calls.append(place_id)
+        if callable(self.responses):
+            return self.responses(place_id)
+        return self.responses[place_id]
+
+    async def fetch_async(self, place_id):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self.fetch(place_id)
+
+
+class FileTimesStore:
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key):
+        try:
+            entry = json.loads((self.directory / f"{key}.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        return entry["expires_at"], entry["times"]
+
+    def set(self, key, times, expires_at):
+        path = self.directory / f"{key}.json"
+        temp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        temp_path.write_text(json.dumps({"expires_at": expires_at, "times": times}, ensure_ascii=False),
+                             encoding="utf-8")
+        os.replace(temp_path, path)
+
+
+class DynamoDBTimesStore:
+    def __init__(self, table_name="times_cache"):
+        import boto3
+
+        self.table_name = table_name
+        self.dynamodb = boto3.client('dynamodb')
+        self.table = self._get_or_create_table(boto3)
+
+    def _get_or_create_table(self, boto3):
+        try:
+            self.dynamodb.describe_table(TableName=self.table_name)
+        except self.dynamodb.exceptions.ResourceNotFoundException:
+            self.dynamodb.create_table(
+                TableName=self.table_name,
+                KeySchema=[{'AttributeName': 'cache_key', 'KeyType': 'HASH'}],
+                AttributeDefinitions=[{'AttributeName': 'cache_key', 'AttributeType': 'S'}],
+                ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}
+            )
+            boto3.resource('dynamodb').Table(self.table_name).wait_until_exists()
+        return boto3.resource('dynamodb').Table(self.table_name)
+
+    def get(self, key):
+        item = self.table.get_item(Key={'cache_key': key}).get("Item")
+        if item is None:
+            return None
+        return int(item["expires_at"]), json.loads(item["times"])
+
+    def set(self, key, times, expires_at):
+        self.table.put_item(Item={'cache_key': key, 'times': json.dumps(times, ensure_ascii=False),
+                                  'expires_at': int(expires_at)})
+
+
+class CachedTimesProvider(TimesProvider):
+    """
+    Caches another provider's responses per place and Shabbat date, in process and optionally in a
+    persistent store. Concurrent misses for the same key wait for a single fetch.
+    """
+
+    def __init__(self, provider, ttl=DEFAULT_TTL, store=None, clock=time.time):
+        self.provider = provider
+        self.ttl = ttl
+        self.store = store
+        self.clock = clock
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.pending = {}
+
+    def cache_key(self, place_id):
+        return f"{place_id}_{next_shabbat_date(self.clock()).isoformat()}"
+
+    def _get_fresh(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > self.clock():
+            return entry[1]
+        return None
+
+    def fetch(self, place_id):
+        key = self.cache_key(place_id)
+        times = self._get_fresh(key)
+        if times is not None:
+            return times
+
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            times = self._get_fresh(key)
+            if times is not None:
+                return times
+            entry = self.store.get(key) if self.store is not None else None
+            if entry is None or entry[0] <= self.clock():
+                times = self.provider.fetch(place_id)
+                entry = (self.clock() + self.ttl, times)
+                if self.store is not None:
+                    self.store.set(key, times, entry[0])
+            self._set(key, entry)
+            return entry[1]
+
+    async def fetch_async(self, place_id):
+        key = self.cache_key(place_id)
+        times = self._get_fresh(key)
+        if times is not None:
+            return times
+        # Coroutines missing the same key share one fetch.
+        if key not in self.pending:
+            self.pending[key] = asyncio.ensure_future(self._fetch_missing(key, place_id))
+            self.pending[key].add_done_callback(lambda _: self.pending.pop(key, None))
+        return await asyncio.shield(self.pending[key])
+
+    async def _fetch_missing(self, key, place_id):
+        entry = await asyncio.to_thread(self.store.get, key) if self.store is not None else None
+        if entry is None or entry[0] <= self.clock():
+            times = await self.provider.fetch_async(place_id)
+            entry = (self.clock() + self.ttl, times)
+            if self.store is not None:
+                await asyncio.to_thread(self.store.set, key, times, entry[0])
+        self._set(key, entry)
+        return entry[1]
+
+    def _set(self, key, entry):
+        with self.lock:
+            now = self.clock()
+            for expired in [k for k, (expires_at, _) in self.entries.items() if expires_at <= now]:
+                del self.entries[expired]
+                self.key_locks.pop(expired, None)
+            self.entries[key] = entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_provider = None
+
+
+def default_provider():
+    if os.getenv("TIMES_SOURCE") == "local":
+        from . import zmanim
+
+        return zmanim.ZmanimTimesProvider()
+    store = None
+    if os.getenv("TIMES_CACHE_TABLE"):
+        store = DynamoDBTimesStore(os.getenv("TIMES_CACHE_TABLE"))
+    elif os.getenv("TIMES_CACHE_DIR"):
+        store = FileTimesStore(os.getenv("TIMES_CACHE_DIR"))
+    return CachedTimesProvider(YeshivaTimesProvider(), store=store)
+
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        _provider = default_provider()
+    return _provider
+
+
+def set_provider(provider):
+    """Use provider from now on, None for the default one. Returns the provider it replaces."""
+    global _provider
+    previous, _provider = _provider, provider
+    return previous
@@ -1,22 +1,92 @@
-from datetime import datetime, timedelta
+import functools
+import math
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class TimeValue:
+    """A time of day kept as minutes since midnight, formatted as HH:MM only when it is written out."""
+    __slots__ = ("minutes",)
+
+    def __init__(self, minutes):
+        # Like the datetime arithmetic this replaces, fractions of a minute are dropped.
+        self.minutes = math.floor(minutes) % MINUTES_PER_DAY
+
+    @classmethod
+    def parse(cls, value):
+        if isinstance(value, TimeValue):
+            return value
+        if not isinstance(value, str):
+            raise TypeError(f"expected a time, got {type(value).__name__}")
+        return cls(parse_minutes(value))
+
+    def __add__(self, minutes):
+        if not is_minutes(minutes):
+            return NotImplemented
+        return TimeValue(self.minutes + minutes)
+
+    __radd__ = __add__
+
+    def __sub__(self, minutes):
+        if not is_minutes(minutes):
+            return NotImplemented
+        return TimeValue(self.minutes - minutes)
+
+    def __eq__(self, other):
+        return isinstance(other, TimeValue) and self.minutes == other.minutes
+
+    def __hash__(self):
+        return hash(self.minutes)
+
+    def __str__(self):
+        return format_minutes(self.minutes)
+
+    def __repr__(self):
+        return f"TimeValue({format_minutes(self.minutes)!r})"
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_minutes(time_str):
+    hours, separator, minutes = time_str.partition(":")
+    if not separator or not hours.isdigit() or not minutes.isdigit() or len(hours) > 2 or len(minutes) > 2 \
+            or int(hours) > 23 or int(minutes) > 59:
+        raise ValueError(f"time data {time_str!r} does not match format '%H:%M'")
+    return int(hours) * 60 + int(minutes)
+
+
+def format_minutes(minutes):
+    return f"{minutes // 60:02}:{minutes % 60:02}"
+
+
+def format_value(value):
+    return str(value) if isinstance(value, TimeValue) else value
+
+
+def add_minutes(time, minutes):
+    if type(time) is int:
+        time, minutes = minutes, time
+    if not is_minutes(minutes):
+        raise TypeError(f"can't add {type(minutes).__name__} minutes to a time")
+    return TimeValue.parse(time) + minutes
+
+
+def round_minutes(minutes, round_to=5, round_type='ceil'):
+    # 'ceil' always moves forward, a time already on the mark goes to the next one.
+    if round_type == 'ceil':
+        return minutes + round_to - minutes % round_to
+    return minutes - minutes % round_to
+
+
+def round_time_value(time, round_to=5, round_type='ceil'):
+    return TimeValue(round_minutes(TimeValue.parse(time).minutes, round_to, round_type))
 
 
 def add_minutes_to_time(time_str, minutes):
-    if type(time_str) is int:
-        time_str, minutes = minutes, time_str
+    return str(add_minutes(time_str, minutes))
+
 
-    datetime_obj = datetime.strptime(time_str, '%H:%M')
-    new_datetime_obj = datetime_obj + timedelta(minutes=minutes)
-    return new_datetime_obj.time().strftime('%H:%M')
 def round_time(time_str, round_to=5, round_type='ceil'):
-    datetime_obj = datetime.strptime(time_str, '%H:%M')
-    minutes = datetime_obj.minute
-    if round_type == 'ceil':
-        diff = round_to - minutes % round_to
-    else:
-        diff = -(minutes % round_to)
-    new_datetime_obj = datetime_obj + timedelta(minutes=diff)
-    return new_datetime_obj.time().strftime('%H:%M')
+    return str(round_time_value(time_str, round_to, round_type))
 
 def round_up_to_nearest_5_minutes(time_str):
     return round_time(time_str, 5, 'ceil')
@@ -27,3 +97,6 @@ def round_down_to_nearest_5_minutes(time_str):
 
 def is_number(x):
     return type(x) is int
+
+def is_minutes(x):
+    return type(x) in (int, float)
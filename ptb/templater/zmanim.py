@@ -0,0 +1,242 @@
+"""
+Zmanim computed locally for every place of places.csv and any date, with no request to yeshiva.org.il.
+
+The sun's position follows the NOAA solar calculator and is evaluated with NumPy over places x dates, so a
+year of every place is one batch:
+
+    table = zmanim.compute(place_ids, dates)          # name -> minutes since local midnight, [places, dates]
+    zmanim.shabbat_replacements(place_ids, fridays)   # the templater's names, per place and Shabbat
+
+ZmanimTimesProvider serves the same json as the AllDailyTimes API, so replacements_from_times() gives the
+same names whichever provider answered. Sunrise and sunset are at sea level unless USE_ELEVATION is set,
+the coordinates in places.csv are approximate to about a kilometre, which moves the times by seconds.
+"""
+import csv
+import datetime
+import functools
+import os
+import time
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from . import batch, parasha, times
+
+PLACES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "places.csv")
+USE_ELEVATION = os.getenv("ZMANIM_USE_ELEVATION", "") == "1"
+
+# Degrees below the horizon. Sunrise and sunset account for refraction and the sun's radius.
+HORIZON = 0.833
+MISHEYAKIR = 11.5
+TZEIT = 8.5
+RABBEINU_TAM_MINUTES = 72
+# Julian day of date.toordinal() 0 at midnight UTC.
+ORDINAL_JULIAN_DAY = 1721424.5
+
+# The daily times of the API response, by the names it gives them.
+DAILY_TIMES = [
+    "עלות השחר 90 דקות מעלות)", "עלות השחר 72 דקות", "זמן טלית ותפילין", "הנץ החמה",
+    "סוף זמן קריאת שמע למגן אברהם", "סוף זמן קריאת שמע לגרא", "סוף זמן תפילה למגן אברהם",
+    'סוף זמן תפילה לגר"א', "חצות היום", "מנחה גדולה", "מנחה קטנה", "פלג המנחה", "צאת הכוכבים",
+    "צאת הכוכבים לרבינו תם", "חצות הלילה",
+]
+
+
+class Places:
+    """Columns of places.csv as arrays, with the row of every place id."""
+
+    def __init__(self, rows):
+        self.ids = np.array([int(row["place_id"]) for row in rows])
+        self.names = [row["name"] for row in rows]
+        self.latitudes = np.array([float(row["latitude"]) for row in rows])
+        self.longitudes = np.array([float(row["longitude"]) for row in rows])
+        self.elevations = np.array([float(row["elevation"]) for row in rows])
+        self.timezones = [row["timezone"] for row in rows]
+        self.candle_lighting = np.array([int(row["candle_lighting"]) for row in rows])
+        self.rows = {place_id: row for row, place_id in enumerate(self.ids.tolist())}
+
+    def take(self, place_ids):
+        return np.array([self.rows[place_id] for place_id in place_ids], dtype=np.int64)
+
+
+@functools.lru_cache(maxsize=None)
+def get_places(path=PLACES_PATH):
+    with open(path, encoding="utf-8", newline="") as f:
+        return Places(list(csv.DictReader(f)))
+
+
+def _sun(julian_day):
+    """Declination (radians) and equation of time (minutes) of the sun at the given julian days."""
+    t = (julian_day - 2451545.0) / 36525.0
+    mean_longitude = np.radians((280.46646 + t * (36000.76983 + t * 0.0003032)) % 360)
+    mean_anomaly = np.radians(357.52911 + t * (35999.05029 - 0.0001537 * t))
+    eccentricity = 0.016708634 - t * (0.000042037 + 0.0000001267 * t)
+    center = np.radians(np.sin(mean_anomaly) * (1.914602 - t * (0.004817 + 0.000014 * t))
+                        + np.sin(2 * mean_anomaly) * (0.019993 - 0.000101 * t)
+                        + np.sin(3 * mean_anomaly) * 0.000289)
+    omega = np.radians(125.04 - 1934.136 * t)
+    apparent_longitude = mean_longitude + center - np.radians(0.00569 + 0.00478 * np.sin(omega))
+    mean_obliquity = 23 + (26 + (21.448 - t * (46.815 + t * (0.00059 - t * 0.001813))) / 60) / 60
+    obliquity = np.radians(mean_obliquity + 0.00256 * np.cos(omega))
+    declination = np.arcsin(np.sin(obliquity) * np.sin(apparent_longitude))
+    y = np.tan(obliquity / 2) ** 2
+    equation_of_time = 4 * np.degrees(
+        y * np.sin(2 * mean_longitude) - 2 * eccentricity * np.sin(mean_anomaly)
+        + 4 * eccentricity * y * np.sin(mean_anomaly) * np.cos(2 * mean_longitude)
+        - 0.5 * y * y * np.sin(4 * mean_longitude) - 1.25 * eccentricity * eccentricity * np.sin(2 * mean_anomaly))
+    return declination, equation_of_time
+
+
+def _noon(midnight, longitudes):
+    """Solar noon in minutes after midnight UTC."""
+    _, equation_of_time = _sun(midnight + 0.5 - longitudes / 360)
+    return 720 - 4 * longitudes - equation_of_time
+
+
+def _event(midnight, latitudes, longitudes, depression, direction):
+    """
+    Minutes after midnight UTC at which the sun crosses `depression` degrees below the horizon, rising
+    (direction -1) or setting (+1). The first estimate uses the sun at noon, the second the sun at the event.
+    """
+    minutes = _noon(midnight, longitudes)
+    latitudes = np.radians(latitudes)
+    for _ in range(2):
+        declination, equation_of_time = _sun(midnight + minutes / 1440)
+        cos_hour_angle = ((np.sin(np.radians(-depression)) - np.sin(latitudes) * np.sin(declination))
+                          / (np.cos(latitudes) * np.cos(declination)))
+        hour_angle = np.degrees(np.arccos(np.clip(cos_hour_angle, -1, 1)))
+        minutes = 720 - 4 * longitudes - equation_of_time + direction * 4 * hour_angle
+    return minutes
+
+
+def utc_offsets(timezones, dates):
+    """Minutes ahead of UTC at noon of every date, [places, dates]."""
+    offsets = {}
+    for timezone in set(timezones):
+        zone = ZoneInfo(timezone)
+        offsets[timezone] = [datetime.datetime.combine(date, datetime.time(12), zone).utcoffset().total_seconds() / 60
+                             for date in dates]
+    return np.array([offsets[timezone] for timezone in timezones])
+
+
+def compute(place_ids, dates, places=None):
+    """
+    The zmanim of the given places on the given dates, as name -> float minutes after local midnight with
+    shape [places, dates]. Names are those of DAILY_TIMES plus sunrise, sunset and tzeit.
+    """
+    places = places or get_places()
+    rows = places.take(place_ids)
+    latitudes = places.latitudes[rows][:, None]
+    longitudes = places.longitudes[rows][:, None]
+    midnight = np.array([date.toordinal() for date in dates], dtype=np.float64)[None, :] + ORDINAL_JULIAN_DAY
+    offsets = utc_offsets([places.timezones[row] for row in rows], dates)
+    horizon = HORIZON
+    if USE_ELEVATION:
+        horizon = HORIZON + 0.0347 * np.sqrt(np.maximum(places.elevations[rows], 0))[:, None]
+
+    def local(minutes):
+        return minutes + offsets
+
+    sunrise = local(_event(midnight, latitudes, longitudes, horizon, -1))
+    sunset = local(_event(midnight, latitudes, longitudes, horizon, 1))
+    noon = local(_noon(midnight, longitudes))
+    tzeit = local(_event(midnight, latitudes, longitudes, TZEIT, 1))
+    misheyakir = local(_event(midnight, latitudes, longitudes, MISHEYAKIR, -1))
+    # Seasonal hours: sunrise to sunset by the Gra, dawn to nightfall (72 minutes each side) by the Magen Avraham.
+    hour = (sunset - sunrise) / 12
+    dawn = sunrise - RABBEINU_TAM_MINUTES
+    magen_avraham_hour = (sunset + RABBEINU_TAM_MINUTES - dawn) / 12
+    return {
+        "sunrise": sunrise,
+        "sunset": sunset,
+        "tzeit": tzeit,
+        DAILY_TIMES[0]: sunrise - 90,
+        DAILY_TIMES[1]: dawn,
+        DAILY_TIMES[2]: misheyakir,
+        DAILY_TIMES[3]: sunrise,
+        DAILY_TIMES[4]: dawn + 3 * magen_avraham_hour,
+        DAILY_TIMES[5]: sunrise + 3 * hour,
+        DAILY_TIMES[6]: dawn + 4 * magen_avraham_hour,
+        DAILY_TIMES[7]: sunrise + 4 * hour,
+        DAILY_TIMES[8]: noon,
+        DAILY_TIMES[9]: noon + hour / 2,
+        DAILY_TIMES[10]: sunrise + 9.5 * hour,
+        DAILY_TIMES[11]: sunrise + 10.75 * hour,
+        DAILY_TIMES[12]: tzeit,
+        DAILY_TIMES[13]: sunset + RABBEINU_TAM_MINUTES,
+        DAILY_TIMES[14]: noon + 720,
+    }
+
+
+def shabbat_times(place_ids, fridays, places=None):
+    """
+    Friday's sunset and candle lighting and Saturday's exit times, in minutes, [places, dates]. Shabbat
+    starts on the earlier minute and ends on the later one.
+    """
+    places = places or get_places()
+    friday = compute(place_ids, fridays, places)
+    saturday = compute(place_ids, [date + datetime.timedelta(days=1) for date in fridays], places)
+    candle_lighting = places.candle_lighting[places.take(place_ids)][:, None]
+    return {
+        "sunset": np.round(friday["sunset"]),
+        "enter": np.floor(friday["sunset"] - candle_lighting),
+        "exit": np.ceil(saturday["tzeit"]),
+        "rabbeinu_tam": np.ceil(saturday["sunset"] + RABBEINU_TAM_MINUTES),
+    }
+
+
+def format_times(minutes):
+    return batch.format_minutes(np.round(minutes).astype(np.int64) % (24 * 60))
+
+
+def shabbat_replacements(place_ids, fridays, places=None):
+    """The templater's names for every place and Shabbat, as a [places][dates] list of dicts."""
+    from . import templater
+
+    places = places or get_places()
+    shabbat = {name: format_times(minutes) for name, minutes in shabbat_times(place_ids, fridays, places).items()}
+    daily = {name: format_times(minutes) for name, minutes in compute(place_ids, fridays, places).items()
+             if name in DAILY_TIMES}
+    parashot = [parasha.parasha(friday + datetime.timedelta(days=1)) for friday in fridays]
+    return [[templater.replacements_from_times(_response(places.names[row], parashot[j], shabbat, daily, i, j))
+             for j in range(len(fridays))]
+            for i, row in enumerate(places.take(place_ids))]
+
+
+def _response(name, shabat_name, shabbat, daily, i, j):
+    return {"standardTimes": {
+        "place": {"name": name},
+        "shabat": {
+            "shabat_name": shabat_name,
+            "skiah": str(shabbat["sunset"][i, j]),
+            "times": [{"name": "כניסת שבת", "value": str(shabbat["enter"][i, j])},
+                      {"name": "צאת שבת", "value": str(shabbat["exit"][i, j])},
+                      {"name": 'צאת שבת ר"ת', "value": str(shabbat["rabbeinu_tam"][i, j])}],
+        },
+        "times": [{"name": name, "value": str(daily[name][i, j])} for name in DAILY_TIMES],
+    }}
+
+
+def response(place_id, date, places=None):
+    """An AllDailyTimes json of a place: the daily times of date and the times of the Shabbat that follows."""
+    places = places or get_places()
+    friday = date + datetime.timedelta(days=(times.SATURDAY - date.weekday()) % 7 - 1)
+    shabbat = {name: format_times(minutes) for name, minutes in shabbat_times([place_id], [friday], places).items()}
+    daily = {name: format_times(minutes) for name, minutes in compute([place_id], [date], places).items()
+             if name in DAILY_TIMES}
+    shabat_name = parasha.parasha(friday + datetime.timedelta(days=1))
+    return _response(places.names[places.rows[place_id]], shabat_name, shabbat, daily, 0, 0)
+
+
+class ZmanimTimesProvider(times.TimesProvider):
+    """Computes the times instead of fetching them, needing no network."""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+
+    def fetch(self, place_id):
+        today = datetime.datetime.fromtimestamp(self.clock(), times.ISRAEL_TZ).date()
+        return response(place_id, today)
+
+    async def fetch_async(self, place_id):
+        return self.fetch(place_id)
@@ -0,0 +1,80 @@
+"""
+Webhook events carrying one update or a batch of them.
+
+An event is either a Function URL request whose body is one update or a JSON list of updates, or an SQS
+batch whose records each carry one update. Updates of different chats are processed concurrently, the
+updates of one chat one after the other in the order they came in.
+
+PTB doesn't raise a handler's exception from process_update, it hands it to the error handlers. The
+error handler added by add_error_handler records it for dispatch, in the context of the chat's task.
+"""
+import asyncio
+import contextvars
+import json
+
+import templater.instrumentation
+
+
+def updates_from_event(event):
+    """Return (record id, update json) pairs, the record id being the SQS message id or None."""
+    if "Records" in event:
+        return [(record["messageId"], json.loads(record["body"])) for record in event["Records"]]
+    body = json.loads(event["body"])
+    if isinstance(body, list):
+        return [(None, update) for update in body]
+    return [(None, body)]
+
+
+_errors = contextvars.ContextVar("webhook_errors", default=None)
+
+
+async def record_error(update, context):
+    """Error handler that keeps the error of the update being dispatched."""
+    errors = _errors.get()
+    if errors is not None:
+        errors.append(context.error)
+
+
+def add_error_handler(application):
+    application.add_error_handler(record_error)
+
+
+def chat_key(update):
+    if update.effective_chat is not None:
+        return "chat", update.effective_chat.id
+    if update.effective_user is not None:
+        return "user", update.effective_user.id
+    return "update", update.update_id
+
+
+async def dispatch(application, updates):
+    """
+    Process (record id, Update) pairs, concurrently per chat. Returns the record ids that weren't processed:
+    once an update fails, the later updates of its chat are left for a retry so they don't overtake it.
+    """
+    chats = {}
+    for record_id, update in updates:
+        chats.setdefault(chat_key(update), []).append((record_id, update))
+    failed = []
+
+    async def process_chat(chat_updates):
+        # gather runs every chat in a task of its own, so the errors are the ones of this chat.
+        errors = []
+        _errors.set(errors)
+        for index, (record_id, update) in enumerate(chat_updates):
+            try:
+                await application.process_update(update)
+                if errors:
+                    raise errors[0]
+                # Later updates of the chat read the conversation state from the persistence cache.
+                await application.update_persistence()
+            except Exception as e:
+                templater.instrumentation.log("update failed", update_id=update.update_id, error=repr(e))
+                failed.extend(record_id for record_id, _ in chat_updates[index:])
+                return
+
+    templater.instrumentation.count("updates", len(updates))
+    templater.instrumentation.count("chats", len(chats))
+    await asyncio.gather(*(process_chat(chat_updates) for chat_updates in chats.values()))
+    templater.instrumentation.count("failed_updates", len(failed))
+    return failed
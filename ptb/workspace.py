@@ -0,0 +1,189 @@
+"""
+The container's files: templates users upload and the documents filled from them.
+
+Files up to MEMORY_THRESHOLD bytes stay in memory, bigger ones are spilled to a directory of their own under
+WORKSPACE_DIR, so concurrent updates never share a path. Everything counts against MAX_BYTES: adding past it
+evicts the least recently used files nobody holds, and raises QuotaExceeded when the rest are all in use.
+Stages hand entries to each other, entry.open() gives every reader its own file object over the same bytes.
+"""
+import asyncio
+import collections
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+MEMORY_THRESHOLD = int(os.getenv("WORKSPACE_MEMORY_BYTES", str(16 * 1024 * 1024)))
+MAX_BYTES = int(os.getenv("WORKSPACE_MAX_BYTES", str(256 * 1024 * 1024)))
+WORKSPACE_DIR = os.getenv("WORKSPACE_DIR", os.path.join(tempfile.gettempdir(), "workspace"))
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class Entry:
+    __slots__ = ("key", "name", "size", "data", "path", "users")
+
+    def __init__(self, key, name, size, data=None, path=None):
+        self.key = key
+        self.name = name
+        self.size = size
+        self.data = data
+        self.path = path
+        self.users = 0
+
+    def open(self):
+        # BytesIO shares the bytes it is given until someone writes to it.
+        return io.BytesIO(self.data) if self.data is not None else open(self.path, "rb")
+
+    def read(self):
+        if self.data is not None:
+            return self.data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+class Workspace:
+    def __init__(self, max_bytes=MAX_BYTES, memory_threshold=MEMORY_THRESHOLD, directory=WORKSPACE_DIR):
+        self.max_bytes = max_bytes
+        self.memory_threshold = memory_threshold
+        self.directory = directory
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.download_locks = {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def _reserve(self, size, key=None):
+        """
+        Evict unheld entries, least recently used first, until size more bytes fit. The entry under key is
+        about to be replaced, its bytes count as free and it is left alone. Call under the lock.
+        """
+        replaced = self.entries.get(key)
+        if replaced is not None:
+            size -= replaced.size
+        if self.size + size <= self.max_bytes:
+            return
+        for entry in list(self.entries.values()):
+            if entry.users == 0 and entry is not replaced:
+                self._remove(entry)
+                if self.size + size <= self.max_bytes:
+                    return
+        raise QuotaExceeded(f"{size} bytes don't fit, {self.size} of {self.max_bytes} are in use")
+
+    def _spill_path(self, name):
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(tempfile.mkdtemp(dir=self.directory), name)
+
+    def _insert(self, entry):
+        with self.lock:
+            # The entry replaced goes first, so its bytes don't evict others to make room for the new ones.
+            old = self.entries.get(entry.key)
+            if old is not None:
+                self._remove(old)
+            self._reserve(entry.size)
+            self.entries[entry.key] = entry
+            self.size += entry.size
+        return entry
+
+    def add(self, key, name, data):
+        """Keep data under key, in memory when it is small enough."""
+        if len(data) <= self.memory_threshold:
+            return self._insert(Entry(key, name, len(data), data=data))
+        with self.lock:
+            self._reserve(len(data), key)
+        path = self._spill_path(name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return self._insert(Entry(key, name, len(data), path=path))
+
+    @contextlib.asynccontextmanager
+    async def _download_lock(self, key):
+        entry = self.download_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.download_locks[key]
+
+    async def download(self, bot, file_id, key, name):
+        """The Telegram file as an entry under key, downloaded once however many updates ask for it."""
+        async with self._download_lock(key):
+            entry = self.get(key)
+            if entry is not None:
+                return entry
+            telegram_file = await bot.get_file(file_id)
+            size = telegram_file.file_size or 0
+            with self.lock:
+                self._reserve(size, key)
+            if size and size <= self.memory_threshold:
+                buffer = io.BytesIO()
+                await telegram_file.download_to_memory(buffer)
+                return self._insert(Entry(key, name, size, data=buffer.getvalue()))
+            path = self._spill_path(name)
+            await telegram_file.download_to_drive(custom_path=path)
+            return self._insert(Entry(key, name, os.path.getsize(path), path=path))
+
+    def _remove(self, entry):
+        if self.entries.get(entry.key) is entry:
+            del self.entries[entry.key]
+            self.size -= entry.size
+        if entry.path is not None:
+            shutil.rmtree(os.path.dirname(entry.path), ignore_errors=True)
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self._remove(entry)
+
+    @contextlib.contextmanager
+    def hold(self, *entries):
+        """Keep the entries from being evicted while they are used."""
+        with self.lock:
+            for entry in entries:
+                entry.users += 1
+        try:
+            yield entries[0] if len(entries) == 1 else entries
+        finally:
+            with self.lock:
+                for entry in entries:
+                    entry.users -= 1
+
+    @contextlib.contextmanager
+    def temporary(self, name, data):
+        """A held entry that lives for the with block, for documents that are sent and forgotten."""
+        entry = self.add(f"temporary:{uuid.uuid4().hex}", name, data)
+        try:
+            with self.hold(entry):
+                yield entry
+        finally:
+            self.remove(entry.key)
+
+
+_workspace = None
+
+
+def get_workspace():
+    global _workspace
+    if _workspace is None:
+        _workspace = Workspace()
+    return _workspace
+
+
+def set_workspace(workspace):
+    global _workspace
+    _workspace = workspace
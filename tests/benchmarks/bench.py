@@ -0,0 +1,240 @@
+"""
+Benchmarks of the templater hot paths, run offline against synthetic templates and synthetic times.
+
+    python -m tests.benchmarks.bench                      # run and print the results
+    python -m tests.benchmarks.bench --save               # store them as the baseline
+    python -m tests.benchmarks.bench --compare            # fail on regressions against the baseline
+
+Every benchmark reports the min and median of its rounds. Peak memory is measured in separate runs under
+tracemalloc, which slows everything it traces. The baseline only means something on the machine that
+recorded it, so record one before an optimization and compare after it.
+
+synthetic_times.json is made up in the shape of an AllDailyTimes response: it has every name the templater
+fills, but its times are evenly spaced placeholders, not zmanim of any place or date.
+"""
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(BENCHMARKS_DIR)), "ptb"))
+
+from templater import archive, cities, lex, plan, templater, times  # noqa: E402
+
+from . import corpus  # noqa: E402
+
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, "baseline.json")
+SYNTHETIC_TIMES_PATH = os.path.join(BENCHMARKS_DIR, "synthetic_times.json")
+CITY = "חריש"
+DEFAULT_TOLERANCE = 0.25
+
+# name -> corpus generator arguments, "small" keeps the pytest smoke run quick.
+CORPORA = {
+    "docx": (corpus.make_docx, {"paragraphs": 400, "token_density": 0.2, "split_ratio": 0.3, "media_bytes": 256 * 1024}),
+    "pptx": (corpus.make_pptx, {"slides": 60, "token_density": 0.2, "split_ratio": 0.3, "media_bytes": 256 * 1024}),
+    "pptx_title_only": (corpus.make_pptx, {"slides": 200, "tokenized_slides": 0.01, "token_density": 0.5}),
+}
+SMALL_CORPORA = {
+    "docx": (corpus.make_docx, {"paragraphs": 20}),
+    "pptx": (corpus.make_pptx, {"slides": 4}),
+    "pptx_title_only": (corpus.make_pptx, {"slides": 10, "tokenized_slides": 0.1}),
+}
+
+
+def synthetic_times():
+    with open(SYNTHETIC_TIMES_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def synthetic_provider(delay=0):
+    """Serves the synthetic response for every place, under the name of the place that was asked for."""
+    synthetic = synthetic_times()
+    place_names = {place_id: name for name, place_id in cities.get_index().places.items()}
+
+    def respond(place_id):
+        response = copy.deepcopy(synthetic)
+        response["standardTimes"]["place"]["name"] = place_names[place_id]
+        return response
+
+    return times.FakeTimesProvider(respond, delay=delay)
+
+
+@contextlib.contextmanager
+def use_synthetic_times():
+    """Fill with the synthetic times inside the with block, the provider before it is restored after."""
+    previous = times.set_provider(times.CachedTimesProvider(synthetic_provider()))
+    try:
+        yield
+    finally:
+        times.set_provider(previous)
+
+
+def measure(function, rounds, setup=None):
+    """Time `rounds` calls of function, each after an untimed setup() whose result is passed in."""
+    durations = []
+    for _ in range(rounds):
+        argument = setup() if setup is not None else None
+        started_at = time.perf_counter()
+        function(argument) if setup is not None else function()
+        durations.append(time.perf_counter() - started_at)
+    return {"min": min(durations), "median": statistics.median(durations), "rounds": rounds}
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def template_parts(path):
+    """The parts the templater parses: template parts that carry tokens."""
+    office_templater = templater.get_templater(path)
+    with zipfile.ZipFile(path) as zip_in:
+        parts = {info.filename: zip_in.read(info) for info in zip_in.infolist()
+                 if office_templater.is_template_part(info.filename)}
+    return {name: data for name, data in parts.items() if templater.has_tokens(data)}
+
+
+def collect_tokens(parts):
+    tokens = []
+    for data in parts.values():
+        part_templater = plan._PlaceholderTemplater()
+        part_templater.init_xml(io.BytesIO(data))
+        part_templater.replace_tokens()
+        tokens += part_templater.tokens
+    return tokens
+
+
+def benchmarks(path, names, output_directory):
+    """name -> (function, setup) of every stage measured on one template."""
+    parts = template_parts(path)
+    tokens = collect_tokens(parts)
+    compiled_plan = plan.compile_plan(path)
+
+    def parsed_parts():
+        part_templaters = []
+        for data in parts.values():
+            part_templater = templater.XMLTemplater()
+            part_templater.templater_parser.set_names(names)
+            part_templater.init_xml(io.BytesIO(data))
+            part_templaters.append(part_templater)
+        return part_templaters
+
+    def scan(part_templaters):
+        for part_templater in part_templaters:
+            part_templater.replace_tokens()
+
+    def parse_xml():
+        for data in parts.values():
+            templater.XMLTemplater().init_xml(io.BytesIO(data))
+
+    def parse_tokens():
+        parser = lex.TemplaterParser(dict(names))
+        for token in tokens:
+            parser.parse(token)
+
+    def parse_tokens_cold():
+        lex.compile_expression.cache_clear()
+        parse_tokens()
+
+    def copy_archive():
+        with zipfile.ZipFile(path) as zip_in, zipfile.ZipFile(io.BytesIO(), "w", zipfile.ZIP_DEFLATED) as zip_out:
+            for info in zip_in.infolist():
+                archive.copy_member(zip_in, zip_out, info)
+
+    return {
+        "fill_template": (lambda: templater.fill_template(CITY, path, output_directory), None),
+        "xml_parse": (parse_xml, None),
+        "scan": (scan, parsed_parts),
+        "parser_warm": (parse_tokens, None),
+        "parser_cold": (parse_tokens_cold, None),
+        "zip_copy": (copy_archive, None),
+        "plan_compile": (lambda: plan.compile_plan(path), None),
+        "plan_render": (lambda: compiled_plan.render(names, path, io.BytesIO()), None),
+    }
+
+
+def run(corpora=None, rounds=5, directory=None):
+    corpora = corpora or CORPORA
+    with use_synthetic_times():
+        return _run(corpora, rounds, directory)
+
+
+def _run(corpora, rounds, directory):
+    names = templater.init_replacements(CITY)
+    results = {"environment": {"python": platform.python_version(), "machine": platform.machine(),
+                               "cpus": os.cpu_count()},
+               "timings": {}, "peak_memory": {}}
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        directory = directory or temporary_directory
+        for corpus_name, (make, arguments) in corpora.items():
+            extension = corpus_name.split("_")[0]
+            path = make(os.path.join(directory, f"{corpus_name}.{extension}"), **arguments)
+            for name, (function, setup) in benchmarks(path, names, directory).items():
+                results["timings"][f"{corpus_name}.{name}"] = measure(function, rounds, setup)
+            results["peak_memory"][f"{corpus_name}.fill_template"] = peak_memory(
+                lambda: templater.fill_template(CITY, path, directory))
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return a line for every timing or peak that grew by more than tolerance over the baseline."""
+    regressions = []
+    for name, timing in results["timings"].items():
+        expected = baseline.get("timings", {}).get(name)
+        if expected and timing["median"] > expected["median"] * (1 + tolerance):
+            regressions.append(f"{name}: median {timing['median'] * 1000:.2f}ms, "
+                               f"baseline {expected['median'] * 1000:.2f}ms")
+    for name, peak in results["peak_memory"].items():
+        expected = baseline.get("peak_memory", {}).get(name)
+        if expected and peak > expected * (1 + tolerance):
+            regressions.append(f"{name}: peak {peak / 1024:.0f}KiB, baseline {expected / 1024:.0f}KiB")
+    return regressions
+
+
+def report(results):
+    for name, timing in results["timings"].items():
+        print(f"{name:40} min {timing['min'] * 1000:9.3f}ms  median {timing['median'] * 1000:9.3f}ms")
+    for name, peak in results["peak_memory"].items():
+        print(f"{name:40} peak {peak / 1024:9.0f}KiB")
+
+
+def main(argv=None):
+    arguments = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arguments.add_argument("--rounds", type=int, default=5)
+    arguments.add_argument("--save", action="store_true", help="store the results as the baseline")
+    arguments.add_argument("--compare", action="store_true", help="exit 1 on regressions against the baseline")
+    arguments.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    arguments.add_argument("--baseline", default=BASELINE_PATH)
+    options = arguments.parse_args(argv)
+
+    results = run(rounds=options.rounds)
+    report(results)
+    if options.save:
+        with open(options.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if options.compare:
+        with open(options.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), options.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Synthetic Word and PowerPoint templates for the benchmarks.
+
+The documents carry only the parts the templater reads (and what a zip reader needs), filled with
+paragraphs of Hebrew filler text. Their size, the share of paragraphs with a token and the share of tokens
+split across runs, the way Word and PowerPoint split them, are all configurable. The same seed gives the
+same bytes.
+"""
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+W_NAMESPACE = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+A_NAMESPACE = "http://schemas.openxmlformats.org/drawingml/2006/main"
+P_NAMESPACE = "http://schemas.openxmlformats.org/presentationml/2006/main"
+
+TOKENS = [
+    "{{enter_time}}",
+    "{{exit_time}}",
+    "{{פרשה}}",
+    "{{UP(enter_time - 20)}}",
+    "{{למטה(exit_time + 15)}}",
+    "{{rabino_tam - 5}}",
+    "{{הנץ_החמה}}",
+    "{{UP(מנחה_קטנה) - 10}}",
+]
+WORDS = ["שחרית", "מנחה", "ערבית", "קבלת", "שבת", "שיעור", "בבית", "הכנסת", "דף", "יומי", "סעודה", "שלישית"]
+
+CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Default Extension="png" ContentType="image/png"/>
+{overrides}
+</Types>"""
+RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="{target}"/>
+</Relationships>"""
+
+
+def _runs(rng, token_density, split_ratio):
+    """The texts of the runs of one paragraph."""
+    text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+    if rng.random() >= token_density:
+        return [text]
+    token = rng.choice(TOKENS)
+    if rng.random() >= split_ratio:
+        return [f"{text} {token}"]
+    # Split the token inside its source, keeping "{{" whole: the editors never split the braces themselves.
+    cut = rng.randint(3, len(token) - 2)
+    return [f"{text} {token[:cut]}", token[cut:]]
+
+
+def _write_package(path, parts, rng, media_bytes):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_out:
+        for name, data in parts.items():
+            zip_out.writestr(name, data)
+        if media_bytes:
+            zip_out.writestr("media/image1.png", rng.randbytes(media_bytes), zipfile.ZIP_STORED)
+    return path
+
+
+def make_docx(path, paragraphs=200, token_density=0.2, split_ratio=0.3, media_bytes=0, seed=0):
+    rng = random.Random(seed)
+    body = []
+    for _ in range(paragraphs):
+        runs = "".join(f'<w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r>'
+                       for text in _runs(rng, token_density, split_ratio))
+        body.append(f"<w:p>{runs}</w:p>")
+    document = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                f'<w:document xmlns:w="{W_NAMESPACE}"><w:body>{"".join(body)}</w:body></w:document>')
+    overrides = ('<Override PartName="/word/document.xml" ContentType='
+                 '"application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>')
+    return _write_package(path, {
+        "[Content_Types].xml": CONTENT_TYPES.format(overrides=overrides),
+        "_rels/.rels": RELS.format(target="word/document.xml"),
+        "word/document.xml": document,
+    }, rng, media_bytes)
+
+
+def make_pptx(path, slides=50, paragraphs_per_slide=8, token_density=0.2, tokenized_slides=1.0, split_ratio=0.3,
+              media_bytes=0, seed=0):
+    """tokenized_slides is the share of slides that may carry tokens at all, the rest are plain text."""
+    rng = random.Random(seed)
+    parts = {}
+    overrides = []
+    for number in range(1, slides + 1):
+        density = token_density if rng.random() < tokenized_slides else 0
+        paragraphs = []
+        for _ in range(paragraphs_per_slide):
+            runs = "".join(f"<a:r><a:t>{escape(text)}</a:t></a:r>" for text in _runs(rng, density, split_ratio))
+            paragraphs.append(f"<a:p>{runs}</a:p>")
+        parts[f"ppt/slides/slide{number}.xml"] = (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<p:sld xmlns:p="{P_NAMESPACE}" xmlns:a="{A_NAMESPACE}"><p:cSld><p:spTree><p:sp><p:txBody>'
+            f'{"".join(paragraphs)}</p:txBody></p:sp></p:spTree></p:cSld></p:sld>')
+        overrides.append(f'<Override PartName="/ppt/slides/slide{number}.xml" ContentType='
+                         f'"application/vnd.openxmlformats-officedocument.presentationml.slide+xml"/>')
+    parts["ppt/presentation.xml"] = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                                     f'<p:presentation xmlns:p="{P_NAMESPACE}"/>')
+    return _write_package(path, {
+        "[Content_Types].xml": CONTENT_TYPES.format(overrides="\n".join(overrides)),
+        "_rels/.rels": RELS.format(target="ppt/presentation.xml"),
+        **parts,
+    }, rng, media_bytes)
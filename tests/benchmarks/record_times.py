@@ -0,0 +1,145 @@
+"""
+Record AllDailyTimes responses of yeshiva.org.il, which test_zmanim compares the local engine against.
+
+    python -m tests.benchmarks.record_times 156 204 151      # place ids, see ptb/templater/places.csv
+
+Each response is saved as recorded_times/<place id>_<date>.json with the date it was recorded on, since the
+daily times in it are those of that date, and "source": "yeshiva.org.il".
+
+Without access to the API, --almanac writes the same json computed offline by the US Naval Observatory's
+Almanac for Computers algorithm, other formulas than the NOAA ones of templater.zmanim and good to about a
+minute, for any date. Those are saved as <place id>_<date>_almanac.json with "source": "almanac".
+
+    python -m tests.benchmarks.record_times --almanac --date 2025-06-20 156 204 151
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import sys
+from zoneinfo import ZoneInfo
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+RECORDINGS_DIR = os.path.join(BENCHMARKS_DIR, "recorded_times")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(BENCHMARKS_DIR)), "ptb"))
+
+from templater import parasha, times, zmanim  # noqa: E402
+
+# Degrees below the horizon, those templater.zmanim uses.
+ALMANAC_DEPRESSIONS = {"horizon": 50 / 60, "misheyakir": 11.5, "tzeit": 8.5}
+
+
+def recordings():
+    if not os.path.isdir(RECORDINGS_DIR):
+        return []
+    return sorted(os.path.join(RECORDINGS_DIR, name) for name in os.listdir(RECORDINGS_DIR) if name.endswith(".json"))
+
+
+def almanac_sun(place_id, date, rising, depression=ALMANAC_DEPRESSIONS["horizon"]):
+    """
+    Minutes after local midnight at which the sun crosses `depression` degrees below the horizon, rising
+    or setting, by the Almanac for Computers algorithm.
+    """
+    places = zmanim.get_places()
+    row = places.rows[place_id]
+    latitude, longitude = math.radians(places.latitudes[row]), places.longitudes[row]
+    t = date.timetuple().tm_yday + ((6 if rising else 18) - longitude / 15) / 24
+    mean_anomaly = 0.9856 * t - 3.289
+    true_longitude = (mean_anomaly + 1.916 * math.sin(math.radians(mean_anomaly))
+                      + 0.020 * math.sin(math.radians(2 * mean_anomaly)) + 282.634) % 360
+    right_ascension = math.degrees(math.atan(0.91764 * math.tan(math.radians(true_longitude)))) % 360
+    right_ascension += true_longitude // 90 * 90 - right_ascension // 90 * 90
+    sin_declination = 0.39782 * math.sin(math.radians(true_longitude))
+    cos_declination = math.cos(math.asin(sin_declination))
+    cos_hour_angle = ((math.cos(math.radians(90 + depression)) - sin_declination * math.sin(latitude))
+                      / (cos_declination * math.cos(latitude)))
+    hour_angle = math.degrees(math.acos(cos_hour_angle))
+    hour_angle = (360 - hour_angle if rising else hour_angle) / 15
+    universal = (hour_angle + right_ascension / 15 - 0.06571 * t - 6.622 - longitude / 15) % 24
+    offset = datetime.datetime.combine(date, datetime.time(12), ZoneInfo(places.timezones[row])).utcoffset()
+    return universal * 60 + offset.total_seconds() / 60
+
+
+def _format(minutes):
+    minutes = int(minutes) % (24 * 60)
+    return f"{minutes // 60:02}:{minutes % 60:02}"
+
+
+def almanac_response(place_id, date):
+    """The AllDailyTimes json of a place and date, with the times by the Almanac for Computers algorithm."""
+    places = zmanim.get_places()
+    row = places.rows[place_id]
+    sunrise, sunset = almanac_sun(place_id, date, True), almanac_sun(place_id, date, False)
+    misheyakir = almanac_sun(place_id, date, True, ALMANAC_DEPRESSIONS["misheyakir"])
+    tzeit = almanac_sun(place_id, date, False, ALMANAC_DEPRESSIONS["tzeit"])
+    # The halachic definitions, from sunrise and sunset: seasonal hours and fixed 72 minute dawn and nightfall.
+    noon = (sunrise + sunset) / 2
+    hour = (sunset - sunrise) / 12
+    dawn = sunrise - zmanim.RABBEINU_TAM_MINUTES
+    magen_avraham_hour = (sunset + zmanim.RABBEINU_TAM_MINUTES - dawn) / 12
+    daily = [sunrise - 90, dawn, misheyakir, sunrise, dawn + 3 * magen_avraham_hour, sunrise + 3 * hour,
+             dawn + 4 * magen_avraham_hour, sunrise + 4 * hour, noon, noon + hour / 2, sunrise + 9.5 * hour,
+             sunrise + 10.75 * hour, tzeit, sunset + zmanim.RABBEINU_TAM_MINUTES, noon + 720]
+
+    friday = date + datetime.timedelta(days=(times.SATURDAY - date.weekday()) % 7 - 1)
+    saturday = friday + datetime.timedelta(days=1)
+    friday_sunset = almanac_sun(place_id, friday, False)
+    return {"standardTimes": {
+        "place": {"name": places.names[row]},
+        "shabat": {
+            "shabat_name": parasha.parasha(saturday),
+            "skiah": _format(round(friday_sunset)),
+            "times": [
+                {"name": "כניסת שבת", "value": _format(math.floor(friday_sunset - places.candle_lighting[row]))},
+                {"name": "צאת שבת", "value": _format(math.ceil(
+                    almanac_sun(place_id, saturday, False, ALMANAC_DEPRESSIONS["tzeit"])))},
+                {"name": 'צאת שבת ר"ת', "value": _format(math.ceil(
+                    almanac_sun(place_id, saturday, False) + zmanim.RABBEINU_TAM_MINUTES))},
+            ],
+        },
+        "times": [{"name": name, "value": _format(round(minutes))}
+                  for name, minutes in zip(zmanim.DAILY_TIMES, daily)],
+    }}
+
+
+def _save(directory, name, recording):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(recording, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    print(path)
+
+
+def record(place_ids, directory=RECORDINGS_DIR):
+    provider = times.YeshivaTimesProvider()
+    today = datetime.datetime.now(times.ISRAEL_TZ).date()
+    for place_id in place_ids:
+        _save(directory, f"{place_id}_{today.isoformat()}.json",
+              {"place_id": place_id, "date": today.isoformat(), "source": "yeshiva.org.il",
+               "response": provider.fetch(place_id)})
+
+
+def record_almanac(place_ids, date, directory=RECORDINGS_DIR):
+    for place_id in place_ids:
+        _save(directory, f"{place_id}_{date.isoformat()}_almanac.json",
+              {"place_id": place_id, "date": date.isoformat(), "source": "almanac",
+               "response": almanac_response(place_id, date)})
+
+
+def main(argv=None):
+    arguments = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arguments.add_argument("place_ids", type=int, nargs="+")
+    arguments.add_argument("--almanac", action="store_true", help="compute the responses offline")
+    arguments.add_argument("--date", type=datetime.date.fromisoformat, help="the date of --almanac responses")
+    parsed = arguments.parse_args(argv)
+    if parsed.almanac:
+        record_almanac(parsed.place_ids, parsed.date or datetime.datetime.now(times.ISRAEL_TZ).date())
+    else:
+        record(parsed.place_ids)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
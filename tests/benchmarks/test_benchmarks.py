@@ -0,0 +1,41 @@
+"""
+Smoke run of the benchmarks on small templates, so the harness keeps working. Set BENCHMARK_COMPARE=1 to
+run the full benchmarks and fail on regressions against the stored baseline.
+"""
+import json
+import os
+
+import pytest
+
+from . import bench
+
+
+def test_benchmarks_run_offline(tmp_path):
+    results = bench.run(bench.SMALL_CORPORA, rounds=1, directory=str(tmp_path))
+
+    assert set(results["timings"]) == {f"{corpus}.{name}" for corpus in bench.SMALL_CORPORA
+                                       for name in ("fill_template", "xml_parse", "scan", "parser_warm",
+                                                    "parser_cold", "zip_copy", "plan_compile", "plan_render")}
+    assert all(peak > 0 for peak in results["peak_memory"].values())
+
+
+def test_synthetic_times_fill_the_tokens(synthetic_times, tmp_path):
+    path = bench.corpus.make_docx(str(tmp_path / "template.docx"), paragraphs=50, token_density=1, split_ratio=0.5)
+    filled = bench.templater.fill_template(bench.CITY, path, str(tmp_path))
+
+    assert not bench.template_parts(filled)
+
+
+def test_corpus_is_reproducible(tmp_path):
+    first = bench.corpus.make_pptx(str(tmp_path / "first.pptx"), slides=3, seed=7)
+    second = bench.corpus.make_pptx(str(tmp_path / "second.pptx"), slides=3, seed=7)
+
+    assert bench.template_parts(first) == bench.template_parts(second)
+
+
+@pytest.mark.skipif(not os.getenv("BENCHMARK_COMPARE"), reason="set BENCHMARK_COMPARE=1 to compare with the baseline")
+def test_no_regressions():
+    with open(bench.BASELINE_PATH, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    assert bench.compare(bench.run(), baseline) == []
@@ -0,0 +1,92 @@
+import os
+import sys
+import zipfile
+
+# The Lambda code lives in ptb/ and imports its modules as top level ones.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ptb"))
+
+import pytest  # noqa: E402
+
+W_NAMESPACE = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+P_NAMESPACE = "http://schemas.openxmlformats.org/presentationml/2006/main"
+A_NAMESPACE = "http://schemas.openxmlformats.org/drawingml/2006/main"
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+# The runs of each paragraph of the test templates: tokens whole, split across runs, several in a run and none.
+PARAGRAPHS = [
+    ["כניסת שבת: ", "{{enter_time}}"],
+    ["מנחה ", "{{UP(enter", "_time) + 10}}", " בבית הכנסת"],
+    ["{{", "exit_time", "}}"],
+    ["פרשת {{parasha}}, צאת השבת {{exit_time - 5}}"],
+    ["no tokens here"],
+]
+
+
+def _write_package(path, parts):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_out:
+        for name, data in parts.items():
+            zip_out.writestr(name, data)
+        zip_out.writestr("media/image1.png", bytes(range(256)) * 4, zipfile.ZIP_STORED)
+    return path
+
+
+def make_docx(path):
+    body = "".join("<w:p>" + "".join(f"<w:r><w:t>{run}</w:t></w:r>" for run in runs) + "</w:p>"
+                   for runs in PARAGRAPHS)
+    return _write_package(path, {
+        "word/document.xml": f'{XML_DECLARATION}<w:document xmlns:w="{W_NAMESPACE}"><w:body>{body}</w:body>'
+                             '</w:document>'
+    })
+
+
+def make_pptx(path):
+    """One slide per paragraph, the last one without tokens."""
+    slides = {}
+    for number, runs in enumerate(PARAGRAPHS, 1):
+        paragraph = "<a:p>" + "".join(f"<a:r><a:t>{run}</a:t></a:r>" for run in runs) + "</a:p>"
+        slides[f"ppt/slides/slide{number}.xml"] = (
+            f'{XML_DECLARATION}<p:sld xmlns:p="{P_NAMESPACE}" xmlns:a="{A_NAMESPACE}"><p:cSld><p:spTree><p:sp>'
+            f'<p:txBody>{paragraph}</p:txBody></p:sp></p:spTree></p:cSld></p:sld>')
+    return _write_package(path, slides)
+
+
+@pytest.fixture(params=["docx", "pptx"])
+def template(request, tmp_path):
+    """A small Word and then PowerPoint template, by path."""
+    path = str(tmp_path / f"template.{request.param}")
+    return make_docx(path) if request.param == "docx" else make_pptx(path)
+
+
+@pytest.fixture
+def synthetic_times():
+    """Times come from tests/benchmarks/synthetic_times.json during the test."""
+    from tests.benchmarks import bench
+
+    with bench.use_synthetic_times():
+        yield
+
+
+@pytest.fixture
+def stored_templates():
+    """The template items the manager fixture starts with. A test module overrides it to seed the table."""
+    return []
+
+
+@pytest.fixture
+def manager(monkeypatch, tmp_path, stored_templates):
+    """A TemplateManager on moto's in-memory DynamoDB and S3, its table holding stored_templates."""
+    import boto3
+    from moto import mock_aws
+
+    import template_manager
+
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(template_manager, "TEMPLATE_CACHE_DIR", str(tmp_path))
+    with mock_aws():
+        manager = template_manager.TemplateManager()
+        boto3.client("s3").create_bucket(Bucket=manager.bucket_name)
+        with manager.templates_table.batch_writer() as batch:
+            for item in stored_templates:
+                batch.put_item(Item=item)
+        yield manager
@@ -0,0 +1,251 @@
+"""
+End-to-end load test of the bot: webhook conversations and the Friday send replayed into
+ptb_lambda.lambda_handler, against fake_api and moto's in-memory S3 and DynamoDB.
+
+    python -m tests.load.driver                                   # 2 containers, 20 chats
+    python -m tests.load.driver --containers 4 --chats 200 --batch 10 --times-delay-ms 150 --memory-mb 512
+
+Every container is a fresh process, like a Lambda execution environment: the import of ptb_lambda is its
+init and its first invocation is cold, the rest are warm. Each container has its own in-memory AWS, so the
+updates of a chat all go to one container. Chats go through /start, a template upload, their cities and
+כן or לא, one step of every chat after the other; with --batch the steps of that many chats arrive as one
+SQS event. Then every container sends the subscriptions it saved with send_schedule ticks every
+--tick-minutes across the due times, on a pinned SCHEDULER_NOW.
+
+The report has the throughput, p50/p99 per kind of invocation, cold and warm durations, peak memory and
+GB-seconds at --memory-mb. The concurrency a rate of updates needs is about rate x mean duration.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+LOAD_DIR = os.path.dirname(os.path.abspath(__file__))
+PTB_DIR = os.path.join(os.path.dirname(os.path.dirname(LOAD_DIR)), "ptb")
+TOKEN = "123456:load"
+MULTI_CITY_SHARE = 0.2
+
+
+class FakeLambdaContext:
+    def __init__(self, budget_ms=15 * 60 * 1000):
+        self.deadline = time.monotonic() + budget_ms / 1000
+        self.function_name = "templater-load"
+        self.aws_request_id = "load"
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def message(update_id, chat_id, **fields):
+    return {"update_id": update_id,
+            "message": {"message_id": update_id, "date": int(time.time()),
+                        "chat": {"id": chat_id, "type": "private"},
+                        "from": {"id": chat_id, "is_bot": False, "first_name": "load"}, **fields}}
+
+
+def conversation(chat, update_ids):
+    """The updates of one chat: /start, the template, its cities and whether to subscribe."""
+    template = chat["template"]
+    return [
+        ("start", message(next(update_ids), chat["chat_id"], text="/start",
+                          entities=[{"type": "bot_command", "offset": 0, "length": 6}])),
+        ("upload", message(next(update_ids), chat["chat_id"],
+                           document={"file_id": template["file_id"],
+                                     "file_unique_id": f"unique-{template['file_id']}",
+                                     "file_name": template["file_name"], "file_size": template["size"]})),
+        ("location", message(next(update_ids), chat["chat_id"], text=", ".join(chat["cities"]))),
+        ("choosing", message(next(update_ids), chat["chat_id"], text="כן" if chat["subscribe"] else "לא")),
+    ]
+
+
+def events(chats, batch):
+    """(kind, event) in the order they arrive: step by step across chats, `batch` updates to an SQS event."""
+    update_ids = iter(range(1, 10 ** 9))
+    steps = list(zip(*(conversation(chat, update_ids) for chat in chats)))
+    for step in steps:
+        if batch <= 1:
+            for kind, update in step:
+                yield kind, {"body": json.dumps(update, ensure_ascii=False)}
+            continue
+        for start in range(0, len(step), batch):
+            records = [{"messageId": str(update["update_id"]), "body": json.dumps(update, ensure_ascii=False)}
+                       for _, update in step[start:start + batch]]
+            yield f"batch_{step[0][0]}", {"Records": records}
+
+
+def succeeded(response):
+    if "batchItemFailures" in response:
+        return not response["batchItemFailures"]
+    if response.get("statusCode") != 200 or response.get("body") == "Failure":
+        return False
+    body = response.get("body", "")
+    return not (body.startswith("{") and json.loads(body).get("failed"))
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def tick_times(tick_minutes):
+    """Tick times covering the next sends of every saved subscription."""
+    import template_manager
+
+    due = sorted(int(template["next_send"]) for template in template_manager.get_manager().iter_templates(
+        ('next_send',)) if "next_send" in template)
+    step = tick_minutes * 60
+    return range(due[0] // step * step, due[-1] + step, step) if due else []
+
+
+def run_container(chats, api_url, batch, tick_minutes):
+    """One Lambda container serving the given chats and then the scheduled send. Runs in its own process."""
+    os.environ.update({
+        "TELEGRAM_TOKEN": TOKEN, "TELEGRAM_API_URL": api_url, "TIMES_URL": api_url,
+        "AWS_DEFAULT_REGION": "us-east-1", "AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing",
+        "STATE_TABLE": "bot_state", "TMPDIR": tempfile.mkdtemp(prefix="container-"),
+    })
+    tempfile.tempdir = None
+    os.chdir(PTB_DIR)
+    sys.path.insert(0, PTB_DIR)
+    # moto and boto3 load before the init, which Lambda pays for on the first invocation that uses AWS.
+    import boto3
+    from moto import mock_aws
+
+    # The containers log to stderr, leaving stdout to the report.
+    with mock_aws(), contextlib.redirect_stdout(sys.stderr):
+        boto3.client("s3").create_bucket(Bucket="aws-sam-cli-managed-default-samclisourcebucket-jitqxwpiihk1")
+        started_at = time.perf_counter()
+        import ptb_lambda
+        init_ms = (time.perf_counter() - started_at) * 1000
+
+        samples = []
+        cold_rss_mb = None
+
+        def invoke(kind, event):
+            nonlocal cold_rss_mb
+            started_at = time.perf_counter()
+            response = ptb_lambda.lambda_handler(event, FakeLambdaContext())
+            samples.append({"kind": kind, "ms": (time.perf_counter() - started_at) * 1000,
+                            "updates": len(event["Records"]) if "Records" in event else int("body" in event),
+                            "cold": not samples, "ok": succeeded(response)})
+            if cold_rss_mb is None:
+                cold_rss_mb = max_rss_mb()
+
+        for kind, event in events(chats, batch):
+            invoke(kind, event)
+        for now in tick_times(tick_minutes):
+            os.environ["SCHEDULER_NOW"] = str(now)
+            invoke("tick", {"source": "templater.tick"})
+    return {"init_ms": init_ms, "samples": samples, "cold_rss_mb": cold_rss_mb, "peak_rss_mb": max_rss_mb()}
+
+
+def make_chats(chats, templates, directory, seed=0):
+    """The chats and the template files they upload, file_id -> bytes. Chats share the templates."""
+    from tests.benchmarks import corpus
+
+    from templater import cities
+
+    rng = random.Random(seed)
+    files, template_list = {}, []
+    for index in range(templates):
+        if index % 2:
+            path = corpus.make_pptx(os.path.join(directory, f"{index}.pptx"), slides=4 + 4 * index, seed=index)
+        else:
+            path = corpus.make_docx(os.path.join(directory, f"{index}.docx"), paragraphs=20 + 40 * index,
+                                    media_bytes=32 * 1024 * index, seed=index)
+        with open(path, "rb") as f:
+            files[f"template-{index}"] = f.read()
+        template_list.append({"file_id": f"template-{index}", "file_name": os.path.basename(path),
+                              "size": len(files[f"template-{index}"])})
+    names = sorted(cities.get_index().places)
+    return files, [{"chat_id": 1000 + index, "template": template_list[index % templates],
+                    "cities": rng.sample(names, rng.choice([2, 3]) if rng.random() < MULTI_CITY_SHARE else 1),
+                    "subscribe": index % 2 == 0}
+                   for index in range(chats)]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def summarize(durations, memory_mb):
+    return {"count": len(durations), "mean_ms": round(statistics.mean(durations), 1),
+            "p50_ms": round(percentile(durations, 0.5), 1), "p99_ms": round(percentile(durations, 0.99), 1),
+            "gb_seconds": round(sum(math.ceil(ms) for ms in durations) / 1000 * memory_mb / 1024, 3)}
+
+
+def expected_documents(chat):
+    """Documents a chat receives: the instructions, its cities when it asks and again from the scheduled send."""
+    return 1 + len(chat["cities"]) * (2 if chat["subscribe"] else 1)
+
+
+def run(containers=2, chats=20, batch=1, templates=4, times_delay_ms=0, memory_mb=512, tick_minutes=10, seed=0):
+    from tests.load import fake_api
+
+    with tempfile.TemporaryDirectory() as directory:
+        files, chat_list = make_chats(chats, min(templates, chats), directory, seed)
+    with fake_api.FakeApi(files, times_delay_ms / 1000) as api:
+        started_at = time.perf_counter()
+        with concurrent.futures.ProcessPoolExecutor(containers, mp_context=multiprocessing.get_context("spawn")) \
+                as executor:
+            results = list(executor.map(run_container, [chat_list[index::containers] for index in range(containers)],
+                                        [api.url] * containers, [batch] * containers, [tick_minutes] * containers))
+        wall_s = time.perf_counter() - started_at
+        documents = api.documents()
+        calls = {method: api.count(method) for method in ("sendDocument", "sendMediaGroup", "getFile", "times")}
+
+    samples = [sample for result in results for sample in result["samples"]]
+    kinds = {}
+    for sample in samples:
+        kinds.setdefault(sample["kind"], []).append(sample["ms"])
+    warm = [sample["ms"] for sample in samples if not sample["cold"]]
+    cold = [result["init_ms"] + result["samples"][0]["ms"] for result in results]
+    return {
+        "containers": containers,
+        "chats": chats,
+        "invocations": len(samples),
+        "failed": sum(not sample["ok"] for sample in samples),
+        "missing_documents": [chat["chat_id"] for chat in chat_list
+                              if documents.get(chat["chat_id"], 0) != expected_documents(chat)],
+        "wall_s": round(wall_s, 2),
+        "throughput_per_s": round(len(samples) / wall_s, 1),
+        "updates_per_s": round(sum(sample["updates"] for sample in samples) / wall_s, 1),
+        "kinds": {kind: summarize(durations, memory_mb) for kind, durations in kinds.items()},
+        "cold": {"init_ms": round(statistics.median(result["init_ms"] for result in results), 1),
+                 **summarize(cold, memory_mb)},
+        "warm": summarize(warm, memory_mb) if warm else None,
+        "memory": {"cold_rss_mb": round(max(result["cold_rss_mb"] for result in results), 1),
+                   "peak_rss_mb": round(max(result["peak_rss_mb"] for result in results), 1),
+                   "configured_mb": memory_mb},
+        "telegram": calls,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--containers", type=int, default=2)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=1, help="updates per SQS event, 1 sends plain webhooks")
+    parser.add_argument("--templates", type=int, default=4, help="distinct templates the chats upload")
+    parser.add_argument("--times-delay-ms", type=float, default=0)
+    parser.add_argument("--memory-mb", type=int, default=512, help="Lambda memory the GB-seconds are priced at")
+    parser.add_argument("--tick-minutes", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    report = run(args.containers, args.chats, args.batch, args.templates, args.times_delay_ms, args.memory_mb,
+                 args.tick_minutes, args.seed)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 1 if report["failed"] or report["missing_documents"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
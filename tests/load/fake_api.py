@@ -0,0 +1,170 @@
+"""
+A local stand-in for the Telegram Bot API and the yeshiva.org.il times API, served over HTTP on one port.
+
+The bot talks to it through TELEGRAM_API_URL and the times provider through TIMES_URL, so every request goes
+through the same httpx/requests clients it uses in production. Calls are recorded per method, uploaded
+templates are served to getFile, and the times API answers the synthetic response after `times_delay`
+seconds, standing in for the network.
+"""
+import copy
+import email.parser
+import email.policy
+import http.server
+import itertools
+import json
+import threading
+import time
+import urllib.parse
+
+from tests.benchmarks import bench
+
+from templater import cities  # noqa: E402  (bench puts ptb/ on the path)
+
+
+def parse_multipart(content_type, body):
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body)
+    fields, files = {}, {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if part.get_param("filename", header="content-disposition") is not None:
+            files[name] = part.get_payload(decode=True)
+        else:
+            fields[name] = part.get_payload(decode=True).decode("utf-8")
+    return fields, files
+
+
+class Call:
+    __slots__ = ("method", "chat_id", "documents", "size")
+
+    def __init__(self, method, chat_id, documents, size):
+        self.method = method
+        self.chat_id = chat_id
+        self.documents = documents
+        self.size = size
+
+
+class FakeApi:
+    def __init__(self, files=None, times_delay=0):
+        self.files = files or {}
+        self.times_delay = times_delay
+        self.calls = []
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.place_names = {place_id: name for name, place_id in cities.get_index().places.items()}
+        self.times = bench.synthetic_times()
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def record(self, method, chat_id=None, documents=0, size=0):
+        with self.lock:
+            self.calls.append(Call(method, chat_id, documents, size))
+
+    def count(self, method):
+        with self.lock:
+            return sum(call.method == method for call in self.calls)
+
+    def documents(self):
+        """chat_id -> the number of documents sent to it, each file of an album counting once."""
+        sent = {}
+        with self.lock:
+            for call in self.calls:
+                if call.documents:
+                    sent[call.chat_id] = sent.get(call.chat_id, 0) + call.documents
+        return sent
+
+    def _message(self, chat_id, **fields):
+        return {"message_id": next(self.ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, **fields}
+
+    def _document(self):
+        file_id = next(self.ids)
+        return {"file_id": f"sent-{file_id}", "file_unique_id": f"sent-unique-{file_id}", "file_name": "document"}
+
+    def call(self, method, fields, files):
+        chat_id = int(fields["chat_id"]) if "chat_id" in fields else None
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "templater", "username": "templater_bot"}
+        elif method == "sendMessage":
+            result = self._message(chat_id, text=fields.get("text", ""))
+        elif method == "sendDocument":
+            self.record(method, chat_id, 1, sum(len(data) for data in files.values()))
+            return self._message(chat_id, document=self._document())
+        elif method == "sendMediaGroup":
+            media = json.loads(fields["media"])
+            self.record(method, chat_id, len(media), sum(len(data) for data in files.values()))
+            return [self._message(chat_id, document=self._document()) for _ in media]
+        elif method == "getFile":
+            file_id = fields["file_id"]
+            result = {"file_id": file_id, "file_unique_id": f"unique-{file_id}",
+                      "file_size": len(self.files[file_id]), "file_path": f"documents/{file_id}"}
+        elif method == "editMessageText":
+            result = self._message(chat_id, text=fields.get("text", ""))
+        else:
+            result = True
+        self.record(method, chat_id)
+        return result
+
+    def times_response(self, place_id):
+        time.sleep(self.times_delay)
+        self.record("times")
+        response = copy.deepcopy(self.times)
+        response["standardTimes"]["place"]["name"] = self.place_names[place_id]
+        return response
+
+    def _handler(self):
+        api = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body, content_type="application/json"):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                content_type = self.headers.get("Content-Type", "")
+                if content_type.startswith("multipart/form-data"):
+                    fields, files = parse_multipart(content_type, body)
+                else:
+                    fields = dict(urllib.parse.parse_qsl(body.decode("utf-8")))
+                    files = {}
+                method = self.path.rsplit("/", 1)[1]
+                self.reply(200, {"ok": True, "result": api.call(method, fields, files)})
+
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                if url.path.startswith("/file/bot"):
+                    file_id = url.path.rsplit("/", 1)[1]
+                    api.record("download")
+                    self.reply(200, api.files[file_id], "application/octet-stream")
+                elif url.path == "/api/times/AllDailyTimes":
+                    place_id = int(urllib.parse.parse_qs(url.query)["place"][0])
+                    self.reply(200, api.times_response(place_id))
+                else:
+                    self.reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+
+        return Handler
@@ -0,0 +1,18 @@
+from tests.load import driver
+
+
+def test_webhook_conversations_and_schedule():
+    report = driver.run(containers=1, chats=4, templates=2)
+
+    assert report["failed"] == 0 and report["missing_documents"] == []
+    assert {"start", "upload", "location", "choosing", "tick"} == set(report["kinds"])
+    # Chats sharing a template download it once.
+    assert report["telegram"]["getFile"] == 2
+    assert report["cold"]["count"] == 1 and report["warm"]["count"] == report["invocations"] - 1
+
+
+def test_sqs_batches_of_chats():
+    report = driver.run(containers=2, chats=6, batch=3, templates=1)
+
+    assert report["failed"] == 0 and report["missing_documents"] == []
+    assert report["kinds"]["batch_location"]["count"] == 2 and "tick" in report["kinds"]
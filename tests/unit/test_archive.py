@@ -0,0 +1,81 @@
+import copy
+import io
+import zipfile
+
+from templater import archive, templater
+
+MEMBERS = [
+    ("word/document.xml", zipfile.ZIP_DEFLATED, b"<w:document>" + b"text " * 2000 + b"</w:document>"),
+    ("word/media/image1.png", zipfile.ZIP_STORED, bytes(range(256)) * 64),
+    ("docProps/app.xml", zipfile.ZIP_DEFLATED, b""),
+]
+
+
+def make_source():
+    source = io.BytesIO()
+    with zipfile.ZipFile(source, "w") as zip_out:
+        for name, compress_type, data in MEMBERS:
+            zip_out.writestr(zipfile.ZipInfo(name, date_time=(2024, 1, 2, 3, 4, 6)), data, compress_type)
+    return source
+
+
+def central_directory(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_in:
+        assert zip_in.testzip() is None
+        return [(info.filename, info.compress_type, info.CRC, info.file_size, info.compress_size, info.date_time,
+                 info.external_attr, info.flag_bits & ~archive.FLAG_DATA_DESCRIPTOR)
+                for info in zip_in.infolist()], {info.filename: zip_in.read(info) for info in zip_in.infolist()}
+
+
+def copy_with(copy_function):
+    source = make_source()
+    target = io.BytesIO()
+    with zipfile.ZipFile(source) as zip_in, zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as zip_out:
+        for info in zip_in.infolist():
+            copy_function(zip_in, zip_out, info)
+    return target.getvalue()
+
+
+def test_copy_member_matches_a_writestr_copy():
+    copied = copy_with(archive.copy_member)
+    rewritten = copy_with(lambda zip_in, zip_out, info: zip_out.writestr(copy.copy(info), zip_in.read(info)))
+
+    assert central_directory(copied) == central_directory(rewritten)
+    assert central_directory(copied)[1] == {name: data for name, _, data in MEMBERS}
+
+
+def test_copies_and_rewrites_interleave():
+    source = make_source()
+    target = io.BytesIO()
+    with zipfile.ZipFile(source) as zip_in, zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as zip_out:
+        first, second, third = zip_in.infolist()
+        archive.copy_member(zip_in, zip_out, first)
+        archive.replace_member(zip_out, second, b"replaced")
+        archive.write_member(zip_out, third, archive.read_member(zip_in, third))
+
+    _, members = central_directory(target.getvalue())
+    assert members == {MEMBERS[0][0]: MEMBERS[0][2], MEMBERS[1][0]: b"replaced", MEMBERS[2][0]: b""}
+
+
+def test_read_member_writes_into_many_archives():
+    source = make_source()
+    with zipfile.ZipFile(source) as zip_in:
+        stored = [(info, archive.read_member(zip_in, info)) for info in zip_in.infolist()]
+    targets = []
+    for _ in range(2):
+        target = io.BytesIO()
+        with zipfile.ZipFile(target, "w") as zip_out:
+            for info, member in stored:
+                archive.write_member(zip_out, info, member)
+        targets.append(target.getvalue())
+
+    assert targets[0] == targets[1]
+    assert central_directory(targets[0])[1] == {name: data for name, _, data in MEMBERS}
+
+
+def test_template_parts_match_like_glob():
+    power_point = templater.PowerPointTemplater()
+    assert power_point.is_template_part("ppt/slides/slide12.xml")
+    assert not power_point.is_template_part("ppt/slides/_rels/slide12.xml.rels")
+    assert not power_point.is_template_part("ppt/slides/slide1/embedded.xml")
+    assert templater.WordTemplater().is_template_part("word/document.xml")
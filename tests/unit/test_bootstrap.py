@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+import bootstrap
+
+
+class FakeApplication:
+    def __init__(self, failures):
+        self.failures = failures
+        self.handlers = []
+
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+
+    async def initialize(self):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("getMe failed")
+
+
+def test_failed_initialize_does_not_register_the_handlers_again(monkeypatch):
+    application = FakeApplication(failures=1)
+    monkeypatch.setattr(bootstrap, "_application", application)
+    monkeypatch.setattr(bootstrap, "_registered", False)
+    monkeypatch.setattr(bootstrap, "_ready", False)
+    monkeypatch.setattr(bootstrap, "_ready_lock", None)
+
+    def register_handlers(application):
+        application.add_handler("start")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(bootstrap.ensure_ready(register_handlers))
+    assert asyncio.run(bootstrap.ensure_ready(register_handlers)) is application
+    assert application.handlers == ["start"]
@@ -0,0 +1,54 @@
+import pytest
+
+from templater import cities, exceptions
+
+NATBAG = 'נתב"ג-התעשייה האווירית'
+
+
+@pytest.fixture(scope="module")
+def index():
+    return cities.get_index()
+
+
+def test_normalize_folds_spelling_variants():
+    assert cities.normalize('נתב"ג-התעשייה  האווירית') == cities.normalize("נתב״ג התעשיה האוירית") == "נתבג התעשיה האוירית"
+    assert cities.normalize("קריית-שמונה") == cities.normalize("קרית שמונה")
+    # Final letters are folded, so a name cut in the middle of a word still matches its prefix.
+    assert cities.normalize("ירושלים") == "ירושלימ"
+
+
+def test_missing_or_extra_quotes_resolve(index):
+    assert index.resolve("נתבג התעשייה האווירית") == NATBAG
+    assert index.resolve("נתב׳׳ג-התעשיה האוירית") == NATBAG
+    assert index.resolve("חיפה'") == "חיפה"
+    assert index.resolve(" ירושליים ") == "ירושלים"
+
+
+def test_misspelled_city_is_suggested(index):
+    assert index.resolve("ירשלים") is None
+    assert index.fuzzy("ירשלים") == ["ירושלים"]
+    assert index.suggest("בארשבע")[0] == "באר שבע"
+    # A longer official name finds the one in the index.
+    assert index.suggest("תל אביב יפו") == ["תל אביב"]
+
+
+def test_prefix_lists_the_cities_it_starts(index):
+    assert index.prefix("בית") == ["בית אל", "בית חגי", "בית שאן", "בית שמש", "ביתר עילית"]
+    assert index.prefix("בית", limit=2) == ["בית אל", "בית חגי"]
+    assert index.prefix("") == []
+
+
+def test_unknown_city_raises_with_its_suggestions(index):
+    with pytest.raises(exceptions.NoSuchCity) as e:
+        index.place_id("ירשלים")
+    assert e.value.city == "ירשלים" and e.value.suggestions == ["ירושלים"]
+
+    with pytest.raises(exceptions.NoSuchCity) as e:
+        index.place_id("ניו יורק")
+    assert e.value.suggestions == []
+
+
+def test_edit_distance():
+    assert cities.edit_distance("ירושלים", "ירשלים") == 1
+    assert cities.edit_distance("חיפה", "חיפה") == 0
+    assert cities.edit_distance("", "abc") == 3
@@ -0,0 +1,76 @@
+import asyncio
+import concurrent.futures
+import json
+import os
+
+import schedule_send_templates
+import templater.instrumentation as instrumentation
+from templater import lex
+
+
+def parse_part():
+    with instrumentation.span("xml_parse"):
+        instrumentation.count("parts")
+
+
+def test_spans_of_stages_on_an_executor_reach_the_operation():
+    async def send():
+        with instrumentation.operation("send", sample_rate=1) as recorder, \
+                concurrent.futures.ThreadPoolExecutor(1) as executor:
+            await schedule_send_templates.run_stage("render", executor, parse_part)
+            await schedule_send_templates.run_stage("render_cache", None, parse_part)
+        return recorder
+
+    recorder = asyncio.run(send())
+    assert set(recorder.spans) == {"render", "render_cache", "xml_parse"}
+    assert recorder.counters["xml_parse_calls"] == 2 and recorder.counters["parts"] == 2
+
+
+def test_emf_names_every_metric(monkeypatch, capsys):
+    monkeypatch.setattr(instrumentation, "METRICS_FORMAT", "emf")
+    with instrumentation.operation("update", sample_rate=1, cold_start=True):
+        parse_part()
+
+    line = json.loads(capsys.readouterr().out)
+    metrics = line["_aws"]["CloudWatchMetrics"][0]
+    assert metrics["Namespace"] == instrumentation.NAMESPACE and metrics["Dimensions"] == [["operation"]]
+    assert {metric["Name"]: metric["Unit"] for metric in metrics["Metrics"]} == {
+        "duration_ms": "Milliseconds", "xml_parse_ms": "Milliseconds", "xml_parse_calls": "Count",
+        "parts": "Count"}
+    assert line["operation"] == "update" and line["cold_start"] is True and line["parts"] == 1
+
+
+def test_unsampled_operations_record_nothing(capsys):
+    with instrumentation.operation("update", sample_rate=0) as recorder:
+        parse_part()
+    assert recorder is None and capsys.readouterr().out == ""
+
+
+def test_profile_is_written_for_a_lone_operation_only(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(instrumentation, "PROFILE_DIR", str(tmp_path))
+
+    async def send(delay):
+        with instrumentation.operation("send", profile=True) as recorder:
+            await asyncio.sleep(delay)
+        return recorder
+
+    async def concurrent_sends():
+        return await asyncio.gather(send(0.05), send(0.01))
+
+    lone = asyncio.run(send(0))
+    assert os.path.exists(lone.dimensions["profile"])
+
+    first, second = asyncio.run(concurrent_sends())
+    assert first.dimensions["profile"].startswith("dropped") and "profile" not in second.dimensions
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_token_errors_are_logged_and_counted(capsys):
+    with instrumentation.operation("update", sample_rate=1) as recorder:
+        lex.TemplaterParser({}).parse("missing + 5")
+        lex.TemplaterParser({}).parse("enter_time +")
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [line["message"] for line in lines if "message" in line] == ["undefined name", "syntax error"]
+    assert all(line["operation"] == "update" for line in lines if "message" in line)
+    assert recorder.counters["undefined_names"] == 1 and recorder.counters["token_errors"] == 1
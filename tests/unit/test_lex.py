@@ -0,0 +1,58 @@
+import concurrent.futures
+
+import pytest
+
+from templater import expression, lex
+
+
+def test_tables_are_built_once_per_class():
+    assert lex.TemplaterParser().tables() is lex.TemplaterParser().tables()
+
+
+def test_compiled_expressions_are_cached_and_shared():
+    first = lex.TemplaterParser({"enter_time": "16:57"})
+    second = lex.TemplaterParser({"enter_time": "18:00"})
+
+    compiled = first.compile("UP(enter_time) + 10")
+    assert second.compile("UP(enter_time) + 10") is compiled
+    assert isinstance(compiled, expression.BinOp)
+    assert (first.parse("UP(enter_time) + 10"), second.parse("UP(enter_time) + 10")) == ("17:10", "18:15")
+
+
+def test_assignment_writes_the_names_of_its_own_parser():
+    first = lex.TemplaterParser({"enter_time": "16:57"})
+    second = lex.TemplaterParser({"enter_time": "16:57"})
+
+    assert first.parse("enter_time = 18:00") == "18:00"
+    assert second.parse("enter_time = 18:00") == "18:00"
+    second.parse("enter_time = enter_time + 5")
+
+    assert first.parse("enter_time") == "18:00"
+    assert second.parse("enter_time") == "18:05"
+
+
+@pytest.mark.parametrize("token, value", [
+    ("enter_time - 40", "16:17"),
+    ("למעלה(enter_time)", "17:00"),
+    ("DOWN(enter_time + 7)", "17:00"),
+    ("-(3 - 5) * 2", 4),
+    ("undefined_name + 1", 1),
+])
+def test_expressions_evaluate_like_the_grammar(token, value):
+    assert lex.TemplaterParser({"enter_time": "16:57"}).parse(token) == value
+
+
+def test_syntax_errors_compile_to_nothing():
+    assert lex.TemplaterParser().compile("enter_time +") is None
+    assert lex.TemplaterParser().parse("enter_time +") is None
+
+
+def test_parses_from_many_threads():
+    tokens = [f"enter_time + {minutes}" for minutes in range(200)]
+    parser = lex.TemplaterParser({"enter_time": "00:00"})
+    lex.compile_expression.cache_clear()
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        values = list(executor.map(parser.parse, tokens))
+
+    assert values == [f"{minutes // 60:02}:{minutes % 60:02}" for minutes in range(200)]
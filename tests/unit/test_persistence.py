@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+from telegram import Bot, Update
+from telegram.ext import ApplicationBuilder, ConversationHandler, MessageHandler, filters
+
+import persistence
+
+ASKED = 1
+
+
+@pytest.fixture(autouse=True)
+def offline_bot(monkeypatch):
+    async def initialize(self):
+        self._initialized = True
+
+    monkeypatch.setattr(Bot, "initialize", initialize)
+
+
+def make_application(store, log):
+    async def entry(update, context):
+        context.user_data["template"] = update.message.text
+        log.append("entry")
+        return ASKED
+
+    async def answer(update, context):
+        log.append(("answer", context.user_data["template"]))
+        return ConversationHandler.END
+
+    state = persistence.KeyValuePersistence(store)
+    application = ApplicationBuilder().token("1:token").persistence(state).build()
+    application.add_handler(persistence.PersistentConversationHandler(
+        state, name="test", entry_points=[MessageHandler(filters.TEXT, entry)],
+        states={ASKED: [MessageHandler(filters.TEXT, answer)]}, fallbacks=[]))
+    return application
+
+
+def make_update(update_id, text, chat_id=5):
+    return {"update_id": update_id,
+            "message": {"message_id": update_id, "date": 0, "text": text, "chat": {"id": chat_id, "type": "private"},
+                        "from": {"id": 7, "is_bot": False, "first_name": "user"}}}
+
+
+async def process(application, data):
+    await application.initialize()
+    update = Update.de_json(data, application.bot)
+    await application.persistence.prefetch(update)
+    await application.process_update(update)
+    await application.update_persistence()
+    await application.persistence.flush()
+
+
+def test_conversation_continues_on_another_container(tmp_path):
+    store = persistence.SQLiteKeyValueStore(str(tmp_path / "state.db"))
+    log = []
+    first, second = make_application(store, log), make_application(store, log)
+
+    async def run():
+        await process(first, make_update(1, "template.docx"))
+        await process(second, make_update(2, "חריש"))
+        # The first container still remembers the conversation as asked, the store says it ended.
+        await process(first, make_update(3, "other.docx"))
+
+    asyncio.run(run())
+    assert log == ["entry", ("answer", "template.docx"), "entry"]
+    assert store.get_many(["user:7"]) == {"user:7": '{"template": "other.docx"}'}
+
+
+def test_writes_wait_for_flush():
+    store = persistence.InMemoryKeyValueStore()
+    state = persistence.KeyValuePersistence(store)
+
+    async def run():
+        await state.update_user_data(7, {"city": "חריש"})
+        assert store.values == {}
+        await state.flush()
+
+    asyncio.run(run())
+    assert store.values == {"user:7": '{"city": "חריש"}'}
+
+
+def test_cache_is_emptied_by_flush():
+    store = persistence.InMemoryKeyValueStore()
+    state = persistence.KeyValuePersistence(store)
+    bot = Bot("1:token")
+
+    async def run():
+        await state.prefetch([Update.de_json(make_update(chat_id, "x", chat_id), bot) for chat_id in range(20)])
+        assert len(state.cache) == 21
+        await state.update_user_data(7, {"city": "חריש"})
+        await state.flush()
+
+    asyncio.run(run())
+    assert state.cache == {}
+    assert store.values == {"user:7": '{"city": "חריש"}'}
+
+
+def test_failed_writes_stay_cached():
+    class FailingStore(persistence.InMemoryKeyValueStore):
+        def write_many(self, values):
+            raise ConnectionError()
+
+    state = persistence.KeyValuePersistence(FailingStore())
+
+    async def run():
+        await state.update_user_data(7, {"city": "חריש"})
+        with pytest.raises(ConnectionError):
+            await state.flush()
+
+    asyncio.run(run())
+    assert state.cache == state.dirty == {"user:7": {"city": "חריש"}}
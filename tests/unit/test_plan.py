@@ -0,0 +1,74 @@
+import io
+import zipfile
+
+import pytest
+from lxml import etree
+
+from templater import plan, templater
+
+NAMES = {"enter_time": "16:57", "exit_time": "18:05", "parasha": "נח"}
+
+
+def members(path_or_file):
+    """The members of an archive, XML parts in canonical form: the templater writes its own XML declaration."""
+    with zipfile.ZipFile(path_or_file) as zip_in:
+        return {info.filename: etree.tostring(etree.fromstring(zip_in.read(info)), method="c14n")
+                if info.filename.endswith(".xml") else zip_in.read(info) for info in zip_in.infolist()}
+
+
+def render_with_templater(template, names):
+    office_templater = templater.get_templater(template)
+    office_templater.templater_parser.set_names(dict(names))
+    target = io.BytesIO()
+    office_templater.render(template, target)
+    return members(target)
+
+
+def render_with_plan(compiled_plan, template, names):
+    target = io.BytesIO()
+    compiled_plan.render(names, template, target)
+    return members(target)
+
+
+def test_renders_like_the_templater(template):
+    assert render_with_plan(plan.compile_plan(template), template, NAMES) == render_with_templater(template, NAMES)
+
+
+def test_values_are_escaped_like_the_templater(template):
+    names = dict(NAMES, parasha="<נח & לך לך>")
+    assert render_with_plan(plan.compile_plan(template), template, names) == render_with_templater(template, names)
+
+
+def test_json_round_trip(template):
+    compiled_plan = plan.compile_plan(template)
+    loaded = plan.TemplatePlan.from_json(compiled_plan.to_json())
+
+    assert (loaded.extension, loaded.parts) == (compiled_plan.extension, compiled_plan.parts)
+    assert render_with_plan(loaded, template, NAMES) == render_with_plan(compiled_plan, template, NAMES)
+
+
+def test_parts_alternate_literals_and_tokens(template):
+    parts = plan.compile_plan(template).parts
+
+    assert parts
+    for segments in parts.values():
+        assert len(segments) % 2 == 1
+        assert all("{{" not in segment and "}}" not in segment for segment in segments)
+        tokens = segments[1::2]
+        assert tokens and all(plan.lex.TemplaterParser(dict(NAMES)).compile(token) is not None for token in tokens)
+
+
+def test_other_plan_versions_are_refused():
+    with pytest.raises(ValueError):
+        plan.TemplatePlan.from_json('{"version": 0, "extension": "docx", "parts": {}}')
+
+
+def test_template_with_the_placeholder_character_is_refused(tmp_path):
+    path = tmp_path / "template.docx"
+    document = ('<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body><w:p>'
+                '<w:r><w:t>\ue000 {{enter_time}}</w:t></w:r></w:p></w:body></w:document>')
+    with zipfile.ZipFile(path, "w") as zip_out:
+        zip_out.writestr("word/document.xml", document.encode("utf-8"))
+
+    with pytest.raises(ValueError):
+        plan.compile_plan(str(path))
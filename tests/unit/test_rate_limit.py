@@ -0,0 +1,91 @@
+import asyncio
+import heapq
+import itertools
+import math
+
+import pytest
+
+import rate_limit
+
+SETTLE_STEPS = 10
+
+
+class FakeClock:
+    """
+    Virtual time: a sleeping bucket is woken once every other task has run as far as it can, with the clock
+    moved to its wake-up time.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleepers = []
+        self.order = itertools.count()
+        self.yield_to_loop = asyncio.sleep
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.sleepers, (self.now + seconds, next(self.order), future))
+        await future
+
+    async def run(self, coroutines):
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        while not all(task.done() for task in tasks):
+            for _ in range(SETTLE_STEPS):
+                await self.yield_to_loop(0)
+            if self.sleepers:
+                wake_at, _, future = heapq.heappop(self.sleepers)
+                # Time always moves on, even when the sleep is shorter than a float can tell apart.
+                self.now = max(wake_at, math.nextafter(self.now, math.inf))
+                future.set_result(None)
+        return [task.result() for task in tasks]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit.asyncio, "sleep", clock.sleep)
+    return clock
+
+
+def acquired_at(clock, acquire, *keys):
+    async def one(key):
+        await acquire(*key)
+        return round(clock(), 3)
+
+    return asyncio.run(clock.run([one(key) for key in keys]))
+
+
+def test_bucket_spends_its_burst_then_keeps_the_rate(clock):
+    bucket = rate_limit.TokenBucket(2, capacity=3, clock=clock)
+    assert acquired_at(clock, bucket.acquire, *[()] * 7) == [0, 0, 0, 0.5, 1, 1.5, 2]
+
+
+def test_bucket_refills_while_idle_up_to_its_capacity(clock):
+    bucket = rate_limit.TokenBucket(2, capacity=2, clock=clock)
+    bucket.tokens = 0
+    clock.now = 10
+    assert acquired_at(clock, bucket.acquire, *[()] * 3) == [10, 10, 10.5]
+
+
+def test_limiter_spaces_the_sends_to_one_chat(clock):
+    limiter = rate_limit.SendLimiter(global_rate=25, chat_rate=1, clock=clock)
+    assert acquired_at(clock, limiter.acquire, (1,), (1,), (1,)) == [0, 1, 2]
+
+
+def test_limiter_holds_every_chat_to_the_global_rate(clock):
+    limiter = rate_limit.SendLimiter(global_rate=10, chat_rate=1, clock=clock)
+    times = acquired_at(clock, limiter.acquire, *[(chat_id,) for chat_id in range(25)])
+
+    assert times[:10] == [0] * 10
+    assert times[10:] == [round((n + 1) / 10, 3) for n in range(15)]
+
+
+def test_busy_chat_does_not_hold_up_the_others(clock):
+    limiter = rate_limit.SendLimiter(global_rate=25, chat_rate=1, clock=clock)
+    times = acquired_at(clock, limiter.acquire, (1,), (1,), (1,), (2,), (3,))
+
+    assert times[:3] == [0, 1, 2]
+    assert times[3:] == [0, 0]
@@ -0,0 +1,45 @@
+import render_cache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    clock = FakeClock()
+    cache = render_cache.DiskRenderCache(str(tmp_path), max_bytes=20, clock=clock)
+    cache.put("a", b"x" * 10)
+    clock.now += 1
+    cache.put("b", b"x" * 10)
+    clock.now += 1
+    assert cache.get("a") == b"x" * 10
+    clock.now += 1
+    cache.put("c", b"x" * 10)
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+
+
+def test_expired_entries_are_not_returned(tmp_path):
+    clock = FakeClock()
+    cache = render_cache.DiskRenderCache(str(tmp_path), ttl=60, clock=clock)
+    cache.put("a", b"document")
+    cache.set_file_id("a", "file-id")
+    clock.now += 61
+
+    assert cache.get("a") is None
+    assert cache.get_file_id("a") is None
+
+
+def test_key_changes_with_replacements():
+    names = {"parasha": "נח", "enter_time": "16:57"}
+    key = render_cache.cache_key("digest", "חריש", names)
+
+    assert key == render_cache.cache_key("digest", "חריש", dict(names))
+    assert key != render_cache.cache_key("digest", "חריש", {**names, "enter_time": "16:58"})
+    assert key != render_cache.cache_key("digest", "חיפה", names)
@@ -0,0 +1,62 @@
+import asyncio
+import io
+import os
+import zipfile
+
+import pytest
+
+import services
+import workspace
+from templater import exceptions, plan, templater
+
+from tests.benchmarks import corpus
+
+CITIES = ["חריש", "חיפה", "ירושלים"]
+
+
+@pytest.fixture
+def template(synthetic_times, tmp_path):
+    return corpus.make_docx(str(tmp_path / "template.docx"), paragraphs=20, media_bytes=4096)
+
+
+def members(path_or_file):
+    with zipfile.ZipFile(path_or_file) as zip_in:
+        return {info.filename: zip_in.read(info) for info in zip_in.infolist()}
+
+
+def test_cities_render_like_one_city_at_a_time(template, tmp_path):
+    replacements = {city: templater.init_replacements(city) for city in CITIES}
+    paths = plan.render_cities(replacements, template, str(tmp_path))
+
+    compiled_plan = plan.compile_plan(template)
+    for city, names in replacements.items():
+        expected = io.BytesIO()
+        compiled_plan.render(names, template, expected)
+        assert city in os.path.basename(paths[city])
+        assert members(paths[city]) == members(expected)
+
+
+def test_zip_holds_a_document_per_city(template, tmp_path):
+    replacements = {city: templater.init_replacements(city) for city in CITIES}
+    path = plan.render_cities_zip(replacements, template, str(tmp_path / "cities.zip"))
+
+    documents = members(path)
+    assert len(documents) == len(CITIES)
+    for city in CITIES:
+        name = next(name for name in documents if city in name)
+        assert members(io.BytesIO(documents[name])) == members(plan.render_cities({city: replacements[city]},
+                                                                                  template, str(tmp_path))[city])
+
+
+def test_fill_cities_resolves_and_dedupes(template, tmp_path):
+    with open(template, "rb") as f:
+        entry = workspace.Workspace(directory=str(tmp_path)).add("template", "template.docx", f.read())
+    documents = asyncio.run(services.fill_cities(["חריש", " חריש", "חיפה"], entry))
+    assert [name.rsplit(" - ", 1)[1] for name, _ in documents] == ["חריש.docx", "חיפה.docx"]
+
+    (name, data), = asyncio.run(services.fill_cities(["חריש", "חיפה"], entry, as_zip=True))
+    assert name.endswith(".zip") and len(members(io.BytesIO(data))) == 2
+
+    with pytest.raises(exceptions.NoSuchCity) as e:
+        asyncio.run(services.fill_cities(["חריש", "עיר שלא קיימת"], entry))
+    assert e.value.city == "עיר שלא קיימת"
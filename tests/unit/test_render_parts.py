@@ -0,0 +1,51 @@
+import concurrent.futures
+
+from templater import templater
+
+SLIDE = ('<p:sld xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main" '
+         'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"><a:t>{}</a:t></p:sld>')
+
+
+def render(parts, executor):
+    powerpoint_templater = templater.PowerPointTemplater()
+    powerpoint_templater.templater_parser.set_names({"enter_time": "16:57"})
+    return powerpoint_templater.render_parts(parts, executor)
+
+
+def make_parts(texts):
+    return {f"ppt/slides/slide{i}.xml": SLIDE.format(text).encode("utf-8") for i, text in enumerate(texts)}
+
+
+def test_workers_render_like_the_serial_path(monkeypatch):
+    monkeypatch.setattr(templater, "PARALLEL_PARTS_THRESHOLD", 2)
+    monkeypatch.setattr(templater, "PART_WORKERS", 2)
+    parts = make_parts(["{{enter_time + 10}}", "no tokens", "{{ UP(enter_time) }}"] * 4)
+
+    with concurrent.futures.ThreadPoolExecutor(3) as executor:
+        assert render(parts, executor) == render(parts, None)
+
+
+def test_assignment_is_seen_by_later_parts(monkeypatch):
+    monkeypatch.setattr(templater, "PARALLEL_PARTS_THRESHOLD", 2)
+    monkeypatch.setattr(templater, "PART_WORKERS", 2)
+    parts = make_parts(["{{enter_time}}", "{{enter_time = 18:00}}", "{{enter_time}}", "{{enter_time}}"])
+
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        rendered = render(parts, executor)
+
+    assert rendered == render(parts, None)
+    assert b"18:00" in rendered["ppt/slides/slide3.xml"]
+
+
+def test_name_assigned_and_read_in_one_chunk(monkeypatch):
+    monkeypatch.setattr(templater, "PARALLEL_PARTS_THRESHOLD", 2)
+    monkeypatch.setattr(templater, "PART_WORKERS", 2)
+    # Two chunks of six parts, x is assigned and read in the first.
+    parts = make_parts(["{{enter_time}}", "{{x = 18:00}}", "{{x}}", "{{x + 5}}"] * 3)
+
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        rendered = render(parts, executor)
+
+    assert rendered == render(parts, None)
+    assert b"18:00" in rendered["ppt/slides/slide2.xml"]
+    assert b"18:05" in rendered["ppt/slides/slide3.xml"]
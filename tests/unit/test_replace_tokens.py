@@ -0,0 +1,107 @@
+import io
+
+import pytest
+
+from templater import templater
+
+DOCUMENT = ('<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body><w:p>{}</w:p>'
+            '</w:body></w:document>')
+NAMES = {"enter_time": "16:57", "exit_time": "18:05", "parasha": "נח"}
+
+
+class LegacyTemplater(templater.XMLTemplater):
+    """The character by character loop replace_tokens took the place of, kept as the reference output."""
+
+    def replace_tokens(self):
+        maybe_token = False
+        cross_line_token = []
+        while True:
+            element = self.get_next_element()
+            if element is None:
+                break
+
+            text_element = self.get_text_from_element(element)
+            replaced_text = ""
+            index = 0
+            while text_element and index < len(text_element):
+                if text_element[index:index + 2] == '{{':
+                    start_index = index
+                    maybe_token = True
+                    index += 2
+                    replaced_text += text_element[start_index:index]
+                elif maybe_token and text_element[index:index + 2] == '}}':
+                    end_index = index + 2
+                    maybe_token = False
+                    if not cross_line_token:
+                        token = text_element[start_index:end_index]
+                        replaced_text = replaced_text[:start_index] + self.parse_token(token)
+                    else:
+                        token = "".join([self.get_text_from_element(t) for t in cross_line_token])
+                        token += text_element[:end_index]
+                        token = token[start_index:]
+
+                        self.set_text_in_element(cross_line_token[0],
+                                                 self.get_text_from_element(cross_line_token[0])[:start_index])
+                        cross_line_token.pop(0)
+
+                        for c in cross_line_token:
+                            self.set_text_in_element(c, "")
+                        replaced_text = self.parse_token(token)
+                        cross_line_token = []
+                        start_index = 0
+                    index += 2
+                else:
+                    replaced_text += text_element[index]
+                    index += 1
+            self.set_text_in_element(element, replaced_text)
+            if maybe_token:
+                cross_line_token.append(element)
+
+
+def render(templater_class, runs):
+    runs_xml = "".join(f"<w:r><w:t>{run}</w:t></w:r>" for run in runs)
+    part_templater = templater_class()
+    part_templater.templater_parser.set_names(dict(NAMES))
+    part_templater.init_xml(io.BytesIO(DOCUMENT.format(runs_xml).encode("utf-8")))
+    part_templater.replace_tokens()
+    return part_templater.serialize()
+
+
+@pytest.mark.parametrize("runs", [
+    ["{{enter_time}}"],
+    ["כניסה: ", "{{enter_time}}", " יציאה"],
+    ["{{", "enter_time", "}}"],
+    ["{{enter", "_time}}"],
+    ["{{ UP(enter_time", ") + 10 }}"],
+    ["{{enter_time", " + ", "10", "}}"],
+    ["{", "{enter_time}", "}"],
+    ["שבת {{enter", "_time}} עד"],
+    ["{{parasha}}", " שלום ", "{{exit", "_time - 5}}", "."],
+    ["no tokens", " at all"],
+    ["{{enter_time", " never closes"],
+])
+def test_output_is_byte_identical_to_the_character_loop(runs):
+    assert render(templater.XMLTemplater, runs) == render(LegacyTemplater, runs)
+
+
+def test_token_split_across_runs_lands_in_the_closing_run():
+    rendered = render(templater.XMLTemplater, ["כניסה {{enter", "_time", " + 10}} בדיוק"])
+    assert "<w:t>כניסה </w:t></w:r><w:r><w:t></w:t></w:r><w:r><w:t>17:07 בדיוק</w:t>" in rendered.decode("utf-8")
+
+
+def test_several_tokens_in_one_run():
+    # The character loop cut at the offset of the "{{" in the source text, so a second token in the same
+    # run came out wrong once the first one changed length. The scanner keeps every token's own text.
+    rendered = render(templater.XMLTemplater, ["{{parasha}} {{enter_time}} {{exit_time}}"])
+    assert "<w:t>נח 16:57 18:05</w:t>" in rendered.decode("utf-8")
+    rendered = render(templater.XMLTemplater, ["שבת {{enter", "_time}} עד {{exit_time}}"])
+    assert "<w:t>16:57 עד 18:05</w:t>" in rendered.decode("utf-8")
+
+
+def test_returns_the_number_of_tokens_replaced():
+    part_templater = templater.XMLTemplater()
+    part_templater.templater_parser.set_names(dict(NAMES))
+    part_templater.init_xml(io.BytesIO(DOCUMENT.format(
+        "<w:r><w:t>{{parasha}} {{enter</w:t></w:r><w:r><w:t>_time}}</w:t></w:r><w:r><w:t>none</w:t></w:r>")
+                                       .encode("utf-8")))
+    assert part_templater.replace_tokens() == 2
@@ -0,0 +1,93 @@
+import asyncio
+import collections
+
+import render_cache
+import schedule_send_templates
+import template_manager
+import templater.templater
+
+Message = collections.namedtuple("Message", ["document"])
+Document = collections.namedtuple("Document", ["file_id"])
+
+
+class FakeManager:
+    def load_template(self, blob_key):
+        return b"template"
+
+    def template_digest(self, blob_key, template):
+        return "digest"
+
+    def get_plan(self, blob_key, template):
+        return FakePlan()
+
+
+class FakePlan:
+    def render(self, names, source, target):
+        target.write(b"document for " + names["parasha"].encode("utf-8"))
+
+
+class FakeTelegram:
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.uploads = 0
+        self.by_file_id = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def send_document(self, chat_id, document, reply_markup, limiter=None, filename=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        if isinstance(document, bytes):
+            self.uploads += 1
+        else:
+            self.by_file_id += 1
+        return Message(Document("file-id"))
+
+
+def test_one_upload_then_concurrent_sends_by_file_id(monkeypatch, tmp_path):
+    async def replacements(city):
+        return {"parasha": "נח"}
+
+    telegram = FakeTelegram()
+    monkeypatch.setattr(template_manager, "get_manager", FakeManager)
+    monkeypatch.setattr(templater.templater, "init_replacements_async", replacements)
+    monkeypatch.setattr(schedule_send_templates, "send_document", telegram.send_document)
+    cache = render_cache.RenderCache(render_cache.DiskRenderCache(str(tmp_path)))
+
+    async def send_all():
+        await asyncio.gather(*(schedule_send_templates.send_template(f"{chat_id}_template.docx", "חריש", chat_id,
+                                                                     cache=cache, blob_key="blob")
+                               for chat_id in range(6)))
+
+    asyncio.run(send_all())
+
+    assert telegram.uploads == 1 and telegram.by_file_id == 5
+    # Only the upload waits on the lock, the sends by file_id overlap.
+    assert telegram.max_in_flight == 5
+    assert cache.locks == {}
+
+
+def test_send_all_reports_every_template_in_order(monkeypatch):
+    in_flight = []
+    max_in_flight = []
+
+    async def send_template(template_path, city, chat_id, executor=None, limiter=None, blob_key=None):
+        in_flight.append(template_path)
+        max_in_flight.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(template_path)
+        if city == "עיר שלא קיימת":
+            raise ValueError(city)
+
+    monkeypatch.setattr(schedule_send_templates, "send_template", send_template)
+    templates = [{"template_path": f"{chat_id}_template.docx", "chat_id": chat_id,
+                  "city": "עיר שלא קיימת" if chat_id % 3 == 0 else "חריש"} for chat_id in range(10)]
+
+    results = asyncio.run(schedule_send_templates.send_all_templates(templates, concurrency=4))
+
+    assert [(result.template_path, result.chat_id, result.ok) for result in results] == \
+           [(template["template_path"], template["chat_id"], template["chat_id"] % 3 != 0) for template in templates]
+    assert {result.error for result in results if not result.ok} == {repr(ValueError("עיר שלא קיימת"))}
+    assert max(max_in_flight) == 4
@@ -0,0 +1,156 @@
+import asyncio
+import datetime
+
+import pytest
+
+import send_schedule
+import sharded_send
+import template_manager
+from schedule_send_templates import SendResult
+from templater import times, zmanim
+
+# A Wednesday, the Friday after is 2025-01-10.
+WEDNESDAY = datetime.datetime(2025, 1, 8, 12, tzinfo=times.ISRAEL_TZ).timestamp()
+FRIDAY = datetime.date(2025, 1, 10)
+CITIES = {"ירושלים": 156, "חיפה": 151, "אילת": 130}
+LEAD = 240
+
+
+@pytest.fixture
+def stored_templates():
+    return [{"template_path": f"{chat_id}_template.docx", "city": city, "chat_id": chat_id}
+            for chat_id, city in enumerate(CITIES)]
+
+
+def candle_lighting(city, friday=FRIDAY):
+    minutes = int(zmanim.shabbat_times([CITIES[city]], [friday])["enter"][0, 0])
+    return datetime.datetime.combine(friday, datetime.time(minutes // 60, minutes % 60), times.ISRAEL_TZ).timestamp()
+
+
+def make_sender(sent, fail=()):
+    async def send(batch):
+        sent.extend(template["city"] for template in batch)
+        return [SendResult(template["template_path"], template["chat_id"], template["city"] not in fail, None)
+                for template in batch]
+    return send
+
+
+def run_ticks(manager, send, start, hours, step_minutes=10):
+    summaries = []
+    for step in range(int(hours * 60 / step_minutes)):
+        summaries.append(asyncio.run(send_schedule.tick(manager, send, start + step * step_minutes * 60,
+                                                        lead=LEAD)))
+    return summaries
+
+
+def test_due_times_follow_candle_lighting():
+    due = send_schedule.due_times(list(CITIES), WEDNESDAY, LEAD)
+    assert due == [candle_lighting(city) - LEAD * 60 for city in CITIES]
+
+    # Past this Friday's time the next one is a week later.
+    next_week = send_schedule.due_times(["ירושלים"], due[0], LEAD)[0]
+    assert next_week == candle_lighting("ירושלים", FRIDAY + datetime.timedelta(weeks=1)) - LEAD * 60
+    assert send_schedule.due_times(["עיר שלא קיימת"], WEDNESDAY) == [None]
+
+
+def test_ticks_send_each_city_when_it_is_due(manager):
+    assert send_schedule.backfill(manager, WEDNESDAY, LEAD) == 3
+    sent = []
+    friday_morning = datetime.datetime.combine(FRIDAY, datetime.time(8), times.ISRAEL_TZ).timestamp()
+    summaries = run_ticks(manager, make_sender(sent), friday_morning, hours=12)
+
+    # Haifa lights candles the latest, Jerusalem 40 minutes before sunset.
+    assert sent == sorted(CITIES, key=candle_lighting)
+    assert [summary["sent"] for summary in summaries].count(1) == 3
+    assert all(summary["due"] <= 1 for summary in summaries)
+    for template in manager.list_templates():
+        assert template["next_send"] == candle_lighting(template["city"], FRIDAY + datetime.timedelta(weeks=1)) \
+            - LEAD * 60
+
+
+def test_failed_sends_are_retried_until_candle_lighting(manager):
+    send_schedule.backfill(manager, WEDNESDAY, LEAD)
+    sent = []
+    friday_morning = datetime.datetime.combine(FRIDAY, datetime.time(8), times.ISRAEL_TZ).timestamp()
+    run_ticks(manager, make_sender(sent, fail={"אילת"}), friday_morning, hours=12)
+
+    # Retried every SEND_RETRY_MINUTES for the four hours of the lead, then left for next week.
+    assert sent.count("אילת") == LEAD // send_schedule.SEND_RETRY_MINUTES
+    eilat = next(template for template in manager.list_templates() if template["city"] == "אילת")
+    assert eilat["next_send"] == candle_lighting("אילת", FRIDAY + datetime.timedelta(weeks=1)) - LEAD * 60
+
+
+def test_concurrent_ticks_send_once(manager):
+    send_schedule.backfill(manager, WEDNESDAY, LEAD)
+    sent = []
+    now = max(send_schedule.due_times(list(CITIES), WEDNESDAY, LEAD))
+
+    async def two_ticks():
+        return await asyncio.gather(*(send_schedule.tick(manager, make_sender(sent), now, lead=LEAD)
+                                      for _ in range(2)))
+
+    asyncio.run(two_ticks())
+    assert sorted(sent) == sorted(set(sent)) and sent
+
+
+def test_saved_templates_get_their_first_send(manager, monkeypatch):
+    monkeypatch.setenv("SCHEDULER_NOW", "2025-01-08T12:00")
+    assert send_schedule.scheduler_clock()() == WEDNESDAY
+    manager.save(template_manager.__file__.replace("template_manager.py", "הוראות שימוש בטמפלייטר.docx"),
+                 "חיפה", 7, next_send=send_schedule.next_send("חיפה", lead=LEAD))
+
+    saved = next(template for template in manager.list_templates() if template["chat_id"] == 7)
+    assert saved["next_send"] == candle_lighting("חיפה") - LEAD * 60
+    assert [template["chat_id"] for template in manager.templates_by_send_bucket(
+        template_manager.send_bucket(saved["next_send"]), until=saved["next_send"])] == [7]
+
+
+def test_tick_catches_up_on_templates_missed_for_hours(manager):
+    send_schedule.backfill(manager, WEDNESDAY, LEAD)
+    sent = []
+    # No tick ran for longer than the catch-up buckets, candle lighting is still ahead everywhere.
+    now = max(send_schedule.due_times(list(CITIES), WEDNESDAY, LEAD)) + (send_schedule.CATCH_UP_BUCKETS + 1) * 3600
+    summary = asyncio.run(send_schedule.tick(manager, make_sender(sent), now, lead=LEAD))
+
+    assert sorted(sent) == sorted(CITIES) and summary["missed"] == 0
+    for template in manager.list_templates():
+        assert template["next_send"] == candle_lighting(template["city"], FRIDAY + datetime.timedelta(weeks=1)) \
+            - LEAD * 60
+
+
+def test_templates_missed_past_candle_lighting_wait_for_next_week(manager):
+    send_schedule.backfill(manager, WEDNESDAY, LEAD)
+    sent = []
+    saturday = datetime.datetime.combine(FRIDAY + datetime.timedelta(days=1), datetime.time(12),
+                                         times.ISRAEL_TZ).timestamp()
+    summary = asyncio.run(send_schedule.tick(manager, make_sender(sent), saturday, lead=LEAD))
+
+    assert sent == [] and summary["missed"] == 3
+    for template in manager.list_templates():
+        assert template["next_send"] == candle_lighting(template["city"], FRIDAY + datetime.timedelta(weeks=1)) \
+            - LEAD * 60
+
+
+def test_tick_invokes_itself_until_done(manager):
+    send_schedule.backfill(manager, WEDNESDAY, LEAD)
+    sent = []
+    now = max(send_schedule.due_times(list(CITIES), WEDNESDAY, LEAD))
+
+    class PastItsDeadline:
+        def get_remaining_time_in_millis(self):
+            return 0
+
+    async def handler(event):
+        assert event == {"source": send_schedule.TICK_EVENT_SOURCE}
+        return await send_schedule.tick(manager, make_sender(sent), now, PastItsDeadline(), invoker, batch_size=1,
+                                        lead=LEAD)
+
+    invoker = sharded_send.LocalInvoker(handler)
+
+    async def run():
+        await invoker.invoke({"source": send_schedule.TICK_EVENT_SOURCE})
+        return await invoker.run()
+
+    summaries = asyncio.run(run())
+    assert sorted(sent) == sorted(CITIES)
+    assert [summary["done"] for summary in summaries] == [False, False, True]
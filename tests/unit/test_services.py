@@ -0,0 +1,58 @@
+import asyncio
+import os
+import time
+
+import services
+import workspace
+from templater import cities, times
+
+from tests.benchmarks import bench
+
+TEMPLATE = os.path.join(os.path.dirname(services.__file__), "הוראות שימוש בטמפלייטר.docx")
+
+
+def test_concurrent_misses_share_one_fetch_and_places_overlap():
+    provider = bench.synthetic_provider(delay=0.2)
+    cached = times.CachedTimesProvider(provider)
+    place_ids = list(cities.get_index().places.values())[:5]
+
+    async def run():
+        started_at = time.perf_counter()
+        await asyncio.gather(*(cached.fetch_async(place_ids[0]) for _ in range(5)))
+        await asyncio.gather(*(cached.fetch_async(place_id) for place_id in place_ids))
+        return time.perf_counter() - started_at
+
+    elapsed = asyncio.run(run())
+    assert provider.calls == place_ids
+    assert elapsed < 0.6
+
+
+def test_fill_document_leaves_the_loop_free(tmp_path):
+    previous = times.set_provider(times.CachedTimesProvider(bench.synthetic_provider(delay=0.1)))
+    gaps = []
+
+    async def ticker(done):
+        last = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    with open(TEMPLATE, "rb") as f:
+        template = workspace.Workspace(directory=str(tmp_path)).add("template", os.path.basename(TEMPLATE), f.read())
+
+    async def run():
+        done = asyncio.Event()
+        ticking = asyncio.ensure_future(ticker(done))
+        filled = await asyncio.gather(*(services.fill_document("חריש", template) for _ in range(4)))
+        done.set()
+        await ticking
+        return filled
+
+    try:
+        filled = asyncio.run(run())
+    finally:
+        times.set_provider(previous)
+    assert all(name.endswith(".docx") and data.startswith(b"PK") for name, data in filled)
+    assert max(gaps) < 0.1
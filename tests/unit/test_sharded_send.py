@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+
+import sharded_send
+from schedule_send_templates import SendResult
+
+
+class FakeManager:
+    """Scans in segments of the templates' index modulo the segment count, filtering after the limit."""
+
+    def __init__(self, count):
+        self.templates = [{"template_path": f"{i:04}_template.docx", "city": "חריש", "chat_id": i}
+                          for i in range(count)]
+
+    def scan_page(self, segment, total_segments, start_key, limit, filter_expression=None):
+        templates = [template for index, template in enumerate(self.templates) if index % total_segments == segment]
+        paths = [template["template_path"] for template in templates]
+        start = 0 if start_key is None else paths.index(start_key) + 1
+        page = templates[start:start + limit]
+        next_key = page[-1]["template_path"] if start + limit < len(templates) else None
+        return [template for template in page if "next_send" not in template], next_key
+
+
+class FakeContext:
+    """An invocation with `budget_ms` to run, measured on the fake clock."""
+
+    def __init__(self, budget_ms, clock):
+        self.budget_ms = budget_ms
+        self.clock = clock
+        self.started_at = clock.now
+
+    def get_remaining_time_in_millis(self):
+        return self.budget_ms - (self.clock.now - self.started_at)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now / 1000
+
+
+def make_sender(sent, clock, batch_ms=500):
+    async def send(batch):
+        clock.now += batch_ms
+        sent.extend(template["template_path"] for template in batch)
+        return [SendResult(template["template_path"], template["chat_id"], True, None) for template in batch]
+    return send
+
+
+@pytest.fixture
+def stored_templates():
+    return [{"template_path": f"{i:04}_template.docx", "city": "חריש", "chat_id": i} for i in range(60)]
+
+
+def test_shards_scan_their_own_segment_of_the_table(manager):
+    store = sharded_send.InMemoryCheckpointStore()
+    sent = []
+    for event in sharded_send.shard_events("2024-01-06", 3):
+        asyncio.run(sharded_send.process_shard(event, manager, store, make_sender(sent, FakeClock()),
+                                               batch_size=7))
+
+    assert sorted(sent) == sorted(template["template_path"] for template in manager.list_templates())
+    assert all(store.get("2024-01-06", shard)["done"] for shard in range(3))
+
+
+def test_dynamodb_checkpoints_expire(manager):
+    store = sharded_send.DynamoDBCheckpointStore()
+    description = store.dynamodb.describe_time_to_live(TableName=store.table_name)["TimeToLiveDescription"]
+    assert description == {"TimeToLiveStatus": "ENABLED", "AttributeName": "expires_at"}
+
+
+def test_shard_resumes_from_checkpoint_after_deadline():
+    manager = FakeManager(100)
+    store = sharded_send.InMemoryCheckpointStore()
+    clock = FakeClock()
+    sent = []
+    invocations = []
+
+    async def handler(event):
+        invocations.append(event)
+        context = FakeContext(3000, clock)
+        return await sharded_send.process_shard(event, manager, store, make_sender(sent, clock), invoker,
+                                                context, batch_size=4, clock=clock)
+
+    invoker = sharded_send.LocalInvoker(handler)
+
+    async def run():
+        await sharded_send.fan_out(invoker, run_id="2024-01-06", shards=3)
+        return await invoker.run()
+
+    summaries = asyncio.run(run())
+
+    assert sorted(sent) == sorted(template["template_path"] for template in manager.templates)
+    assert len(invocations) > 3
+    assert sum(summary["sent"] for summary in summaries) == 100
+    assert all(store.get("2024-01-06", shard)["done"] for shard in range(3))
+
+
+def test_finished_shard_is_not_sent_again():
+    manager = FakeManager(10)
+    store = sharded_send.InMemoryCheckpointStore()
+    clock = FakeClock()
+    sent = []
+    event = sharded_send.shard_events("2024-01-06", 1)[0]
+
+    asyncio.run(sharded_send.process_shard(event, manager, store, make_sender(sent, clock), clock=clock))
+    asyncio.run(sharded_send.process_shard(event, manager, store, make_sender(sent, clock), clock=clock))
+
+    assert len(sent) == 10
+
+
+def test_every_invocation_sends_a_page_even_past_its_deadline():
+    manager = FakeManager(10)
+    store = sharded_send.InMemoryCheckpointStore()
+    clock = FakeClock()
+    sent = []
+
+    async def handler(event):
+        # Less time left than the margin already.
+        context = FakeContext(sharded_send.DEADLINE_MARGIN_MS - 1, clock)
+        return await sharded_send.process_shard(event, manager, store, make_sender(sent, clock), invoker,
+                                                context, batch_size=4, clock=clock)
+
+    invoker = sharded_send.LocalInvoker(handler)
+
+    async def run():
+        await sharded_send.fan_out(invoker, run_id="2024-01-06", shards=1)
+        return await invoker.run()
+
+    summaries = asyncio.run(run())
+    assert len(summaries) == 3 and len(sent) == 10
+
+
+def test_scheduled_templates_are_left_to_the_ticks():
+    manager = FakeManager(10)
+    for template in manager.templates[:6]:
+        template["next_send"] = 1_700_000_000
+    sent = []
+    event = sharded_send.shard_events("2024-01-06", 1)[0]
+
+    asyncio.run(sharded_send.process_shard(event, manager, sharded_send.InMemoryCheckpointStore(),
+                                           make_sender(sent, FakeClock())))
+
+    assert sorted(sent) == sorted(template["template_path"] for template in manager.templates[6:])
@@ -0,0 +1,189 @@
+import os
+import threading
+import time
+
+import pytest
+
+import template_manager
+
+TEMPLATE = os.path.join(os.path.dirname(template_manager.__file__), "הוראות שימוש בטמפלייטר.docx")
+
+
+def stored_keys(manager):
+    return sorted(item["Key"] for item in manager.s3.list_objects_v2(Bucket=manager.bucket_name).get("Contents", []))
+
+
+def test_same_bytes_are_stored_once(manager):
+    manager.save(TEMPLATE, "חריש", 1)
+    manager.save(TEMPLATE, "חיפה", 2)
+
+    templates = manager.list_templates()
+    blob_key = templates[0]["blob_key"]
+    assert blob_key.startswith(template_manager.BLOB_PREFIX) and blob_key.endswith(".docx")
+    assert {template["blob_key"] for template in templates} == {blob_key}
+    assert stored_keys(manager) == [blob_key, f"{blob_key}.plan.json"]
+    with open(TEMPLATE, "rb") as f:
+        assert manager.load_template(blob_key) == f.read()
+
+
+def test_templates_in_memory_share_the_blob_of_files(manager):
+    with open(TEMPLATE, "rb") as f:
+        data = f.read()
+    manager.save(os.path.basename(TEMPLATE), "חריש", 1, data=data)
+    manager.save(TEMPLATE, "חיפה", 2)
+
+    blob_keys = {template["blob_key"] for template in manager.list_templates()}
+    assert len(blob_keys) == 1
+    assert stored_keys(manager) == [*blob_keys, f"{next(iter(blob_keys))}.plan.json"]
+    assert manager.load_template(next(iter(blob_keys))) == data
+
+
+def test_blob_is_deleted_with_its_last_reference(manager):
+    manager.save(TEMPLATE, "חריש", 1)
+    manager.save(TEMPLATE, "חיפה", 2)
+    first, second = manager.list_templates()
+
+    manager.delete(first["template_path"])
+    manager.delete(first["template_path"])
+    assert len(stored_keys(manager)) == 2
+
+    manager.delete(second["template_path"])
+    assert stored_keys(manager) == []
+    assert manager.list_templates() == []
+
+
+def test_templates_saved_before_blobs_are_still_read_and_deleted(manager):
+    with open(TEMPLATE, "rb") as f:
+        data = f.read()
+    manager.s3.put_object(Bucket=manager.bucket_name, Key="old_template.docx", Body=data)
+    manager.templates_table.put_item(Item={"template_path": "old_template.docx", "city": "חריש", "chat_id": 1})
+    manager.save(TEMPLATE, "חריש", 2)
+
+    template = next(template for template in manager.list_templates() if "blob_key" not in template)
+    assert manager.load_template(manager.blob_key(template)) == data
+    manager.delete_all()
+    assert stored_keys(manager) == []
+
+
+def blob_item(manager, blob_key):
+    return manager.blobs_table.get_item(Key={"blob_key": blob_key}, ConsistentRead=True).get("Item")
+
+
+def test_save_during_the_delete_of_its_blob_uploads_it_again(manager, monkeypatch):
+    manager.save(TEMPLATE, "חריש", 1)
+    template = manager.list_templates()[0]
+    delete_objects = manager._delete_objects
+    saver = threading.Thread(target=manager.save, args=(TEMPLATE, "חיפה", 2))
+
+    def delete_objects_while_saving(blob_keys):
+        # The save starts once the blob is marked, and waits for the delete to finish.
+        saver.start()
+        time.sleep(0.3)
+        assert len(manager.list_templates()) == 0
+        delete_objects(blob_keys)
+
+    monkeypatch.setattr(manager, "_delete_objects", delete_objects_while_saving)
+    manager.delete(template["template_path"])
+    saver.join()
+
+    assert [saved["chat_id"] for saved in manager.list_templates()] == [2]
+    assert stored_keys(manager) == [template["blob_key"], f"{template['blob_key']}.plan.json"]
+    assert blob_item(manager, template["blob_key"])["refs"] == 1
+
+
+def test_stale_delete_mark_is_taken_over(manager):
+    manager.save(TEMPLATE, "חריש", 1)
+    blob_key = manager.list_templates()[0]["blob_key"]
+    manager.blobs_table.put_item(Item={"blob_key": blob_key, "refs": 0, "deleting": int(time.time()) - 1})
+
+    manager.save(TEMPLATE, "חיפה", 2)
+    assert blob_item(manager, blob_key) == {"blob_key": blob_key, "refs": 1}
+
+
+def test_failed_save_gives_its_reference_back(manager, monkeypatch):
+    def fail(**kwargs):
+        raise ConnectionError("put failed")
+
+    monkeypatch.setattr(manager.templates_table, "put_item", fail)
+    with pytest.raises(ConnectionError):
+        manager.save(TEMPLATE, "חריש", 1)
+
+    assert manager.blobs_table.scan()["Items"] == []
+    assert stored_keys(manager) == []
+
+
+def put_templates(manager, count, **fields):
+    with manager.templates_table.batch_writer() as batch:
+        for i in range(count):
+            batch.put_item(Item={"template_path": f"{i:03}_template.docx", "city": ["חריש", "חיפה"][i % 2],
+                                 "chat_id": i % 4, **fields})
+
+
+def test_reads_go_through_every_page(manager, monkeypatch):
+    put_templates(manager, 10)
+    scan = manager.templates_table.scan
+    pages = []
+
+    def paged_scan(**kwargs):
+        pages.append(kwargs.get("ExclusiveStartKey"))
+        return scan(Limit=4, **kwargs)
+
+    monkeypatch.setattr(manager.templates_table, "scan", paged_scan)
+    templates = manager.list_templates()
+
+    assert len(pages) == 3 and pages[0] is None
+    assert sorted(template["template_path"] for template in templates) == [f"{i:03}_template.docx" for i in range(10)]
+    # Only the projected fields are read.
+    assert set(templates[0]) == {"template_path", "city", "chat_id"}
+
+
+def test_index_queries(manager):
+    put_templates(manager, 12)
+    manager.set_next_send("000_template.docx", 1_700_000_000)
+    manager.set_next_send("001_template.docx", 1_700_000_100)
+    manager.set_next_send("002_template.docx", 1_700_009_000)
+
+    assert len(list(manager.templates_by_city("חיפה"))) == 6
+    assert sorted(template["template_path"] for template in manager.templates_by_chat(1)) == \
+        ["001_template.docx", "005_template.docx", "009_template.docx"]
+    bucket = template_manager.send_bucket(1_700_000_000)
+    assert [template["template_path"] for template in manager.templates_by_send_bucket(bucket)] == \
+        ["000_template.docx", "001_template.docx"]
+    assert [template["template_path"] for template in manager.templates_by_send_bucket(bucket, until=1_700_000_050)] \
+        == ["000_template.docx"]
+
+
+def test_queries_scan_while_an_index_is_missing(manager):
+    manager.dynamodb.delete_table(TableName=manager.table_name)
+    manager.dynamodb.create_table(
+        TableName=manager.table_name, KeySchema=[{"AttributeName": "template_path", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "template_path", "AttributeType": "S"}],
+        ProvisionedThroughput={"ReadCapacityUnits": 1, "WriteCapacityUnits": 1})
+    # An existing table gets one of the missing indexes at a time.
+    manager = template_manager.TemplateManager()
+    indexes = manager.dynamodb.describe_table(TableName=manager.table_name)["Table"]["GlobalSecondaryIndexes"]
+    assert [index["IndexName"] for index in indexes] == ["city-index"]
+    put_templates(manager, 8)
+
+    assert sorted(template["template_path"] for template in manager.templates_by_chat(3)) == \
+        ["003_template.docx", "007_template.docx"]
+    assert len(list(manager.templates_by_city("חריש"))) == 4
+
+
+def test_delete_many_deletes_in_batches_and_keeps_shared_blobs(manager):
+    for chat_id in range(3):
+        manager.save(TEMPLATE, "חריש", chat_id)
+    for i in range(30):
+        manager.s3.put_object(Bucket=manager.bucket_name, Key=f"old_{i}.docx", Body=b"old")
+        manager.templates_table.put_item(Item={"template_path": f"old_{i}.docx", "city": "חריש", "chat_id": i})
+    saved = [template for template in manager.list_templates() if "blob_key" in template]
+    blob_key = saved[0]["blob_key"]
+
+    manager.delete_many([template for template in manager.list_templates() if template not in saved[:1]])
+    assert [template["template_path"] for template in manager.list_templates()] == [saved[0]["template_path"]]
+    assert stored_keys(manager) == [blob_key, f"{blob_key}.plan.json"]
+    assert blob_item(manager, blob_key)["refs"] == 1
+
+    manager.delete_all()
+    assert manager.list_templates() == [] and stored_keys(manager) == []
+    assert manager.blobs_table.scan()["Items"] == []
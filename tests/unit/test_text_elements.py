@@ -0,0 +1,60 @@
+import io
+import zipfile
+
+from lxml import etree
+
+from templater import templater
+
+W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+NAMES = {"enter_time": "16:57", "exit_time": "18:05", "parasha": "נח"}
+
+
+def render(template):
+    office_templater = templater.get_templater(template)
+    office_templater.templater_parser.set_names(dict(NAMES))
+    target = io.BytesIO()
+    office_templater.render(template, target)
+    with zipfile.ZipFile(target) as zip_in:
+        return {info.filename: (zip_in.read(info), info.compress_type, info.CRC) for info in zip_in.infolist()}
+
+
+def test_selects_the_runs_the_local_name_scan_did(template):
+    office_templater = templater.get_templater(template)
+    with zipfile.ZipFile(template) as zip_in:
+        parts = [zip_in.read(name) for name in zip_in.namelist() if office_templater.is_template_part(name)]
+    for data in parts:
+        tree = etree.parse(io.BytesIO(data))
+        assert templater.TEXT_ELEMENTS_XPATH(tree) == tree.getroot().xpath("//*[local-name()='t']")
+
+
+def test_selects_word_runs_below_other_elements_in_document_order():
+    tree = etree.fromstring(
+        f'<w:document xmlns:w="{W}"><w:body><w:p><w:r><w:t>1</w:t></w:r><w:ins><w:r><w:t>2</w:t></w:r></w:ins>'
+        f'<w:hyperlink><w:r><w:t>3</w:t></w:r></w:hyperlink></w:p><w:tbl><w:tr><w:tc><w:p><w:r><w:t>4</w:t>'
+        f'</w:r></w:p></w:tc></w:tr></w:tbl></w:body></w:document>')
+    assert [element.text for element in templater.TEXT_ELEMENTS_XPATH(tree)] == ["1", "2", "3", "4"]
+
+
+def test_has_tokens():
+    assert templater.has_tokens("<w:t>שבת {{enter_time}}</w:t>".encode("utf-8"))
+    assert templater.has_tokens(b"<w:t>{{enter</w:t><w:t>_time}}</w:t>")
+    assert not templater.has_tokens(b"<w:t>no tokens { at } all</w:t>")
+    # The braces of a token never come apart, so a "{" in one run and a "{" in the next is no token.
+    assert not templater.has_tokens(b"<w:t>{</w:t><w:t>{enter_time}}</w:t>")
+
+
+def test_skipping_parts_without_tokens_renders_the_same(template, monkeypatch):
+    skipped = render(template)
+    monkeypatch.setattr(templater, "has_tokens", lambda data: True)
+    assert skipped == render(template)
+
+
+def test_parts_without_tokens_are_copied_as_they_are(template):
+    with zipfile.ZipFile(template) as zip_in:
+        original = {info.filename: (zip_in.read(info), info.compress_type, info.CRC) for info in zip_in.infolist()}
+
+    rendered = render(template)
+    untouched = [name for name, (data, _, _) in original.items() if not templater.has_tokens(data)]
+
+    assert untouched
+    assert {name: rendered[name] for name in untouched} == {name: original[name] for name in untouched}
@@ -0,0 +1,31 @@
+import pytest
+
+from templater import batch, lex, utils
+
+TOKENS = ["enter_time + 10", "UP(enter_time)", "למטה(enter_time - 7)", "enter_time - 90 / 4", "UP(enter_time + 30)"]
+ENTER_TIMES = ["16:57", "18:00", "23:58", "00:03"]
+
+
+def test_time_value_keeps_datetime_semantics():
+    assert utils.add_minutes_to_time("23:50", 15) == "00:05"
+    assert utils.add_minutes_to_time(15, "00:10") == "00:25"
+    assert utils.round_time("18:00") == "18:05"
+    assert utils.round_time("18:04", round_type="floor") == "18:00"
+    assert str(utils.TimeValue.parse("18:00") - 22.5) == "17:37"
+    with pytest.raises(ValueError):
+        utils.TimeValue.parse("24:00")
+
+
+def test_parser_writes_times_as_text():
+    parser = lex.TemplaterParser({"enter_time": "16:57"})
+
+    assert parser.parse("UP(UP(enter_time) + 10)") == "17:15"
+    assert parser.parse("x = 18:00") == "18:00"
+    assert parser.parse("x - 1") == "17:59"
+
+
+@pytest.mark.parametrize("token", TOKENS)
+def test_batch_matches_scalar_evaluation(token):
+    expected = [lex.TemplaterParser({"enter_time": enter_time}).parse(token) for enter_time in ENTER_TIMES]
+
+    assert batch.evaluate_table([token], {"enter_time": ENTER_TIMES})[token].tolist() == expected
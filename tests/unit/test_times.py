@@ -0,0 +1,85 @@
+import datetime
+import threading
+import time
+
+from templater import times
+
+# A Wednesday noon in Israel, the Shabbat after is 2025-01-11.
+WEDNESDAY = datetime.datetime(2025, 1, 8, 12, tzinfo=times.ISRAEL_TZ).timestamp()
+DAY = 24 * 60 * 60
+
+
+class Clock:
+    def __init__(self, now=WEDNESDAY):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def responses(place_id):
+    return {"place": place_id}
+
+
+def test_next_shabbat_date():
+    assert times.next_shabbat_date(WEDNESDAY) == datetime.date(2025, 1, 11)
+    assert times.next_shabbat_date(WEDNESDAY + 3 * DAY) == datetime.date(2025, 1, 11)
+    assert times.next_shabbat_date(WEDNESDAY + 4 * DAY) == datetime.date(2025, 1, 18)
+
+
+def test_cache_serves_a_place_until_its_entry_expires():
+    clock = Clock()
+    provider = times.FakeTimesProvider(responses)
+    cached = times.CachedTimesProvider(provider, ttl=60, clock=clock)
+
+    assert [cached.fetch(156), cached.fetch(156), cached.fetch(151)] == [{"place": 156}, {"place": 156},
+                                                                         {"place": 151}]
+    clock.now += 59
+    cached.fetch(156)
+    assert provider.calls == [156, 151]
+
+    clock.now += 1
+    cached.fetch(156)
+    assert provider.calls == [156, 151, 156]
+
+
+def test_next_week_is_another_entry():
+    clock = Clock()
+    provider = times.FakeTimesProvider(responses)
+    cached = times.CachedTimesProvider(provider, ttl=30 * DAY, clock=clock)
+
+    cached.fetch(156)
+    clock.now += 7 * DAY
+    cached.fetch(156)
+    assert provider.calls == [156, 156]
+
+
+def test_concurrent_misses_share_one_fetch():
+    def slow(place_id):
+        time.sleep(0.05)
+        return responses(place_id)
+
+    provider = times.FakeTimesProvider(slow)
+    cached = times.CachedTimesProvider(provider)
+    threads = [threading.Thread(target=cached.fetch, args=(156,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert provider.calls == [156]
+
+
+def test_store_outlives_the_process_cache(tmp_path):
+    clock = Clock()
+    store = times.FileTimesStore(tmp_path)
+    times.CachedTimesProvider(times.FakeTimesProvider(responses), ttl=60, store=store, clock=clock).fetch(156)
+
+    # A cold container finds the entry in the store.
+    provider = times.FakeTimesProvider(responses)
+    cold = times.CachedTimesProvider(provider, ttl=60, store=store, clock=clock)
+    assert cold.fetch(156) == {"place": 156} and provider.calls == []
+
+    clock.now += 60
+    times.CachedTimesProvider(provider, ttl=60, store=store, clock=clock).fetch(156)
+    assert provider.calls == [156]
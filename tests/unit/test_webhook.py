@@ -0,0 +1,111 @@
+import asyncio
+import json
+import time
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+from telegram.request import BaseRequest
+
+import webhook
+
+
+def make_update(update_id, chat_id, text="text"):
+    return {"update_id": update_id,
+            "message": {"message_id": update_id, "date": 0, "text": text,
+                        "chat": {"id": chat_id, "type": "private"},
+                        "from": {"id": chat_id, "is_bot": False, "first_name": "user"}}}
+
+
+class FakeApplication:
+    def __init__(self, delay, fail=()):
+        self.delay = delay
+        self.fail = fail
+        self.processed = []
+
+    async def process_update(self, update):
+        await asyncio.sleep(self.delay)
+        if update.update_id in self.fail:
+            raise RuntimeError("failed")
+        self.processed.append(update.update_id)
+
+    async def update_persistence(self):
+        pass
+
+
+def parsed(event):
+    return [(record_id, Update.de_json(update, None)) for record_id, update in webhook.updates_from_event(event)]
+
+
+def test_updates_from_event():
+    single = {"body": json.dumps(make_update(1, 5))}
+    listed = {"body": json.dumps([make_update(1, 5), make_update(2, 6)])}
+    sqs = {"Records": [{"messageId": "a", "body": json.dumps(make_update(1, 5))},
+                       {"messageId": "b", "body": json.dumps(make_update(2, 6))}]}
+    assert webhook.updates_from_event(single) == [(None, make_update(1, 5))]
+    assert [record_id for record_id, _ in webhook.updates_from_event(listed)] == [None, None]
+    assert webhook.updates_from_event(sqs) == [("a", make_update(1, 5)), ("b", make_update(2, 6))]
+
+
+def test_chats_overlap_and_keep_their_order():
+    application = FakeApplication(delay=0.1)
+    updates = [make_update(update_id, chat_id) for update_id, chat_id in [(1, 5), (2, 6), (3, 5), (4, 7), (5, 6)]]
+    started_at = time.perf_counter()
+    failed = asyncio.run(webhook.dispatch(application, parsed({"body": json.dumps(updates)})))
+    elapsed = time.perf_counter() - started_at
+
+    assert failed == []
+    assert elapsed < 0.3
+    assert [update_id for update_id in application.processed if update_id in (1, 3)] == [1, 3]
+    assert [update_id for update_id in application.processed if update_id in (2, 5)] == [2, 5]
+
+
+def test_failure_holds_back_the_rest_of_its_chat():
+    application = FakeApplication(delay=0, fail={2})
+    records = [("a", make_update(1, 5)), ("b", make_update(2, 5)), ("c", make_update(3, 5)), ("d", make_update(4, 6))]
+    event = {"Records": [{"messageId": record_id, "body": json.dumps(update)} for record_id, update in records]}
+    failed = asyncio.run(webhook.dispatch(application, parsed(event)))
+
+    assert sorted(failed) == ["b", "c"]
+    assert sorted(application.processed) == [1, 4]
+
+
+class GetMeRequest(BaseRequest):
+    """Answers getMe, the one Bot API call initialize makes."""
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        return 200, json.dumps({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "bot",
+                                                       "username": "bot"}}).encode()
+
+
+def test_handler_errors_of_a_real_application_fail_their_records():
+    processed = []
+
+    async def handle(update, context):
+        if update.message.text == "fail":
+            raise RuntimeError("failed")
+        processed.append(update.update_id)
+
+    async def run(event):
+        application = ApplicationBuilder().token("1:token").request(GetMeRequest()) \
+            .get_updates_request(GetMeRequest()).build()
+        application.add_handler(MessageHandler(filters.TEXT, handle))
+        webhook.add_error_handler(application)
+        await application.initialize()
+        updates = [(record_id, Update.de_json(update, application.bot))
+                   for record_id, update in webhook.updates_from_event(event)]
+        return await webhook.dispatch(application, updates)
+
+    records = [("a", make_update(1, 5)), ("b", make_update(2, 5, "fail")), ("c", make_update(3, 5)),
+               ("d", make_update(4, 6))]
+    event = {"Records": [{"messageId": record_id, "body": json.dumps(update)} for record_id, update in records]}
+    failed = asyncio.run(run(event))
+
+    assert sorted(failed) == ["b", "c"]
+    assert sorted(processed) == [1, 4]
@@ -0,0 +1,118 @@
+import asyncio
+import os
+
+import pytest
+
+import workspace
+
+
+class FakeFile:
+    def __init__(self, data):
+        self.data = data
+        self.file_size = len(data)
+
+    async def download_to_memory(self, out):
+        out.write(self.data)
+
+    async def download_to_drive(self, custom_path):
+        with open(custom_path, "wb") as f:
+            f.write(self.data)
+
+
+class FakeBot:
+    def __init__(self, files):
+        self.files = files
+        self.requests = []
+
+    async def get_file(self, file_id):
+        self.requests.append(file_id)
+        await asyncio.sleep(0.01)
+        return FakeFile(self.files[file_id])
+
+
+def test_small_files_stay_in_memory_and_big_ones_spill(tmp_path):
+    files = workspace.Workspace(max_bytes=100, memory_threshold=10, directory=str(tmp_path))
+    small = files.add("small", "small.docx", b"x" * 10)
+    big = files.add("big", "big.docx", b"y" * 20)
+
+    assert small.path is None and small.open().read() == b"x" * 10
+    assert big.data is None and os.path.dirname(big.path) != str(tmp_path)
+    assert big.read() == b"y" * 20
+    assert files.size == 30
+
+    files.remove("big")
+    assert not os.path.exists(big.path) and files.size == 10
+
+
+def test_entries_share_their_bytes(tmp_path):
+    data = b"template" * 100
+    entry = workspace.Workspace(directory=str(tmp_path)).add("template", "template.docx", data)
+    first, second = entry.open(), entry.open()
+    assert entry.data is data
+    assert first.read(8) == second.read(8) == b"template"
+
+
+def test_quota_evicts_least_recently_used(tmp_path):
+    files = workspace.Workspace(max_bytes=30, memory_threshold=5, directory=str(tmp_path))
+    first = files.add("first", "first", b"1" * 10)
+    files.add("second", "second", b"2" * 10)
+    files.add("third", "third", b"3" * 10)
+    files.get("first")
+    files.add("fourth", "fourth", b"4" * 10)
+
+    assert list(files.entries) == ["third", "first", "fourth"]
+    assert files.size == 30 and os.path.exists(first.path)
+
+
+def test_held_entries_are_not_evicted(tmp_path):
+    files = workspace.Workspace(max_bytes=20, directory=str(tmp_path))
+    first = files.add("first", "first", b"1" * 10)
+    with files.hold(first):
+        files.add("second", "second", b"2" * 10)
+        files.add("third", "third", b"3" * 10)
+        assert list(files.entries) == ["first", "third"]
+        with files.hold(files.get("third")), pytest.raises(workspace.QuotaExceeded):
+            files.add("fourth", "fourth", b"4" * 10)
+    with files.temporary("output", b"5" * 10) as output:
+        assert files.get(output.key) is output
+    # Released, first was the least recently used.
+    assert list(files.entries) == ["third"]
+
+
+def test_download_once_per_key(tmp_path):
+    files = workspace.Workspace(memory_threshold=10, directory=str(tmp_path))
+    bot = FakeBot({"small-id": b"s" * 10, "big-id": b"b" * 50})
+
+    async def download_all():
+        return await asyncio.gather(*(files.download(bot, "small-id", "small", "small.docx") for _ in range(5)),
+                                    files.download(bot, "big-id", "big", "big.pptx"))
+
+    *smalls, big = asyncio.run(download_all())
+    assert bot.requests == ["small-id", "big-id"]
+    assert all(entry is smalls[0] for entry in smalls) and smalls[0].data == b"s" * 10
+    assert big.path.endswith("big.pptx") and big.read() == b"b" * 50
+
+
+def test_download_locks_are_dropped_once_idle(tmp_path):
+    files = workspace.Workspace(directory=str(tmp_path))
+    bot = FakeBot({f"id-{i}": b"x" * 10 for i in range(20)})
+
+    async def download_all():
+        return await asyncio.gather(*(files.download(bot, f"id-{i % 20}", f"key-{i % 20}", "template.docx")
+                                      for i in range(60)))
+
+    asyncio.run(download_all())
+    assert len(bot.requests) == 20
+    assert files.download_locks == {}
+
+
+def test_replacing_an_entry_makes_room_for_itself(tmp_path):
+    files = workspace.Workspace(max_bytes=30, memory_threshold=5, directory=str(tmp_path))
+    files.add("first", "first", b"1" * 10)
+    files.add("second", "second", b"2" * 10)
+    old = files.add("third", "third", b"3" * 10)
+    new = files.add("third", "third", b"4" * 10)
+
+    assert list(files.entries) == ["first", "second", "third"]
+    assert files.get("third") is new and files.size == 30
+    assert not os.path.exists(old.path) and new.read() == b"4" * 10
@@ -0,0 +1,104 @@
+import datetime
+import json
+
+import numpy as np
+import pytest
+
+from templater import parasha, templater, zmanim
+
+from tests.benchmarks import bench, record_times
+
+JERUSALEM, TEL_AVIV, HAIFA, EILAT = 156, 204, 151, 130
+# Minutes the local engine may differ from the API or from another algorithm.
+TOLERANCE = 1
+
+
+def minutes(value):
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def test_parashot_of_known_shabbatot():
+    expected = {
+        "2023-07-22": "דברים",
+        "2023-10-21": "נח",
+        "2024-04-20": "מצורע",
+        "2024-10-05": "האזינו",
+        "2024-10-19": "חול המועד סוכות",
+        "2024-10-26": "בראשית",
+        "2025-01-04": "ויגש",
+        "2025-04-12": "צו",
+        "2025-09-20": "נצבים",
+        # Pesach 5782 started on a Shabbat, Israel read ahead of the diaspora until Matot and Masei.
+        "2022-06-04": "נשא",
+        "2022-07-23": "מטות",
+        "2022-07-30": "מסעי",
+    }
+    assert {date: parasha.parasha(datetime.date.fromisoformat(date)) for date in expected} == expected
+
+
+def test_every_year_fits_its_readings():
+    for year in range(5700, 5900):
+        readings = {index for reading in parasha.year_schedule(year).values() for index in reading}
+        # Vayelech may be read at the start of the year that follows.
+        assert readings | {parasha.VAYELECH} == set(range(len(parasha.PARASHOT)))
+
+
+def test_solstice_sunrise_and_sunset():
+    table = zmanim.compute([JERUSALEM, EILAT], [datetime.date(2024, 6, 21), datetime.date(2024, 12, 21)])
+    assert zmanim.format_times(table["sunrise"]).tolist() == [["05:34", "06:35"], ["05:41", "06:31"]]
+    assert zmanim.format_times(table["sunset"]).tolist() == [["19:48", "16:40"], ["19:43", "16:46"]]
+
+
+@pytest.mark.parametrize("place_id", [JERUSALEM, HAIFA, EILAT])
+def test_sunrise_and_sunset_match_the_almanac_algorithm(place_id):
+    dates = [datetime.date(2025, 1, 1) + datetime.timedelta(days=day) for day in range(0, 365, 7)]
+    table = zmanim.compute([place_id], dates)
+    differences = [table[name][0, j] - record_times.almanac_sun(place_id, date, name == "sunrise")
+                   for j, date in enumerate(dates) for name in ("sunrise", "sunset")]
+    assert np.abs(differences).max() <= TOLERANCE
+
+
+def test_batch_matches_one_place_and_date_at_a_time():
+    place_ids = [JERUSALEM, TEL_AVIV, HAIFA]
+    fridays = [datetime.date(2025, 3, 28) + datetime.timedelta(weeks=week) for week in range(3)]
+    table = zmanim.shabbat_times(place_ids, fridays)
+    for i, place_id in enumerate(place_ids):
+        for j, friday in enumerate(fridays):
+            single = zmanim.shabbat_times([place_id], [friday])
+            assert {name: values[i, j] for name, values in table.items()} == \
+                   {name: values[0, 0] for name, values in single.items()}
+
+
+def test_replacements_have_the_names_of_the_api():
+    response = zmanim.response(JERUSALEM, datetime.date(2025, 1, 1))
+    replacements = templater.replacements_from_times(response)
+
+    assert replacements.keys() == templater.replacements_from_times(bench.synthetic_times()).keys()
+    assert replacements["parasha"] == "ויגש"
+    # Candle lighting is 40 minutes before sunset in Jerusalem.
+    assert minutes(replacements["sunset"]) - minutes(replacements["enter_time"]) in (40, 41)
+    assert minutes(replacements["rabino_tam"]) > minutes(replacements["exit_time"])
+
+
+def test_year_of_every_place_is_one_batch():
+    place_ids = zmanim.get_places().ids.tolist()
+    fridays = [datetime.date(2025, 1, 3) + datetime.timedelta(weeks=week) for week in range(52)]
+    table = zmanim.shabbat_times(place_ids, fridays)
+    assert table["enter"].shape == (len(place_ids), 52)
+    assert (table["enter"] < table["sunset"]).all() and (table["exit"] > table["sunset"]).all()
+
+
+@pytest.mark.parametrize("path", record_times.recordings() or [pytest.param(None, marks=pytest.mark.skip(
+    "no recorded responses, record some with python -m tests.benchmarks.record_times"))])
+def test_matches_recorded_responses(path):
+    with open(path, encoding="utf-8") as f:
+        recording = json.load(f)
+    recorded = templater.replacements_from_times(recording["response"])
+    computed = templater.replacements_from_times(
+        zmanim.response(recording["place_id"], datetime.date.fromisoformat(recording["date"])))
+
+    assert computed["parasha"] == recorded["parasha"]
+    differences = {name: minutes(computed[name]) - minutes(recorded[name]) for name in recorded if name != "parasha"
+                   and name != "פרשה"}
+    assert np.abs(list(differences.values())).max() <= TOLERANCE, differences